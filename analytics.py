@@ -0,0 +1,353 @@
+"""
+Insights from the projects of every user, to help users see what leads to
+    better results.
+
+The numbers in the details table are loaded into NumPy arrays and summed up
+    for every project, each brand of resin and each type of resin. The results
+    are saved in the insight_group and insight_metric tables by
+    ``flask refresh-insights``, which only works out the groups of projects
+    that changed since it last ran. The insights page only reads those tables,
+    and only shows groups with projects from enough different users that no
+    one user's projects can be picked out.
+"""
+from collections import Counter
+from datetime import datetime
+import warnings
+
+import numpy as np
+from sqlalchemy import bindparam, delete, insert, text
+
+from db_model import DB, InsightGroup, InsightMetric
+from helpers import result_score
+
+# The columns the projects are grouped by, and the SQL for each group's key
+#   - brands and types are matched without case or extra spaces
+GROUPS = {
+    'all': "'all'",
+    'resin_brand': 'lower(trim(d.resin_brand))',
+    'resin_type': 'lower(trim(d.resin_type))',
+}
+
+# The measurements worked out for each project, in the order of the columns
+#   of the array made by project_metrics
+METRICS = ('amount_g', 'time_to_pour', 'pouring_time', 'cure_time',
+           'start_temp', 'end_temp', 'demold_temp', 'result_scale')
+
+# The percentiles saved for each measurement
+PERCENTILES = (10, 25, 50, 75, 90)
+
+# A group is only shown once it has this many projects from this many users
+MIN_GROUP_PROJECTS = 5
+MIN_GROUP_USERS = 3
+
+# The details columns loaded for each project
+#   - the amounts, temperatures and times are the canonical ones from units.py
+DETAIL_COLUMNS = """
+    d.amount_g, d.time_to_pour_total, d.pouring_time_total,
+    d.time_to_demold_total, d.start_temp_c, d.end_temp_c, d.demold_temp_c,
+    d.result_scale
+"""
+
+
+def _floats(values):
+    """Turn a column of values into floats, with NaN for anything missing"""
+    try:
+        return np.array(values, dtype=float)
+
+    except (TypeError, ValueError):
+        # Some of the values are text that is not a number
+        floats = np.full(len(values), np.nan)
+
+        for i, value in enumerate(values):
+            try:
+                floats[i] = float(value)
+            except (TypeError, ValueError):
+                pass
+
+        return floats
+
+
+def _minutes(totals):
+    """Total minutes, with NaN if none were recorded"""
+    totals = _floats(totals)
+
+    # The forms save 0 for the times that were left blank
+    return np.where(totals > 0, totals, np.nan)
+
+
+def project_metrics(columns):
+    """
+    Work out the measurements of many projects at once
+
+    :param
+        - columns : *list* : the values of each of the DETAIL_COLUMNS, as one
+                             sequence per column
+
+    :return:
+        *ndarray* : one row per project and one column for each of METRICS,
+            with NaN for the measurements that were not recorded
+
+    Two projects as their details are saved, the second left mostly blank:
+
+    >>> project_metrics([[100.0, None], [5, 0], [3, 0], [1440, 0], [20.0, None],
+    ...                  [21.0, None], [25.0, None],
+    ...                  ['1 - Nailed It!', 'None']]).round(1).tolist()
+    ... # doctest: +NORMALIZE_WHITESPACE
+    [[100.0, 5.0, 3.0, 1440.0, 20.0, 21.0, 25.0, 1.0],
+     [nan, nan, nan, nan, nan, nan, nan, nan]]
+    """
+    (amount_g, pour_total, pouring_total, demold_total, start_temp_c,
+     end_temp_c, demold_temp_c, result_scale) = columns
+
+    # The add form saves the scale with its label, ie. "1 - Nailed It!"
+    result_scale = np.array([result_score(value) for value in result_scale],
+                            dtype=float)
+
+    return np.column_stack([
+        _floats(amount_g),
+        _minutes(pour_total),
+        _minutes(pouring_total),
+        _minutes(demold_total),
+        _floats(start_temp_c),
+        _floats(end_temp_c),
+        _floats(demold_temp_c),
+        result_scale,
+    ])
+
+
+def correlations(values, result):
+    """
+    The correlation of each column with the result scale, using only the
+        projects that recorded both
+
+    :param
+        - values : *ndarray* : one row per project, one column per measurement
+        - result : *ndarray* : the result scale of each project
+
+    :return:
+        *ndarray* : the Pearson correlation for each column; NaN if there is
+            not enough data
+    """
+    both = ~np.isnan(values) & ~np.isnan(result)[:, None]
+    count = both.sum(axis=0)
+
+    x = np.where(both, values, 0.0)
+    y = np.where(both, result[:, None], 0.0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_x = x.sum(axis=0) / count
+        mean_y = y.sum(axis=0) / count
+        cov = (x * y).sum(axis=0) / count - mean_x * mean_y
+        var_x = (x * x).sum(axis=0) / count - mean_x ** 2
+        var_y = (y * y).sum(axis=0) / count - mean_y ** 2
+        corr = cov / np.sqrt(var_x * var_y)
+
+    # Leave out what can not be trusted, or did not change at all
+    corr[(count < 3) | (var_x <= 1e-12) | (var_y <= 1e-12)] = np.nan
+
+    return corr
+
+
+def summarize(values):
+    """
+    Work out the numbers saved for a group of projects
+
+    :param
+        - values : *ndarray* : the project_metrics of the group's projects
+
+    :return:
+        *dict* : metric -> dict with the count, mean, percentiles and
+            correlation with the result scale
+    """
+    with warnings.catch_warnings():
+        # Measurements no project in the group recorded are left as NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        means = np.nanmean(values, axis=0)
+        percentiles = np.nanpercentile(values, PERCENTILES, axis=0)
+
+    counts = (~np.isnan(values)).sum(axis=0)
+    corr = correlations(values, values[:, METRICS.index('result_scale')])
+
+    summary = {}
+
+    for i, metric in enumerate(METRICS):
+        if not counts[i]:
+            continue
+
+        summary[metric] = {
+            'count': int(counts[i]),
+            'mean': float(means[i]),
+            **{f'p{p}': float(percentiles[j, i])
+               for j, p in enumerate(PERCENTILES)},
+            'corr_result': None if np.isnan(corr[i]) else float(corr[i]),
+        }
+
+    return summary
+
+
+def _group_versions(group_by):
+    """
+    Query the size and last change of every group, to find the ones changed
+
+    :return:
+        *dict* : group key -> (projects, users, id_sum, last_updated)
+    """
+    key = GROUPS[group_by]
+    where = '' if group_by == 'all' else \
+        f"WHERE d.{group_by} IS NOT NULL AND trim(d.{group_by}) <> ''"
+    group = '' if group_by == 'all' else 'GROUP BY 1'
+
+    rows = DB.engine.execute(text(
+        f"""
+        SELECT {key} AS group_key, count(*) AS projects,
+            count(DISTINCT p.user_id) AS users, sum(p.id) AS id_sum,
+            max(p.updated_at) AS last_updated
+        FROM "details" d
+            JOIN "project" p ON p.id = d.project_id
+        {where}
+        {group};
+        """).columns(last_updated=DB.DateTime)).all()
+
+    return {row.group_key: tuple(row[1:]) for row in rows if row.projects}
+
+
+def _load_groups(group_by, keys):
+    """
+    Query the details of every project in some of the groups
+
+    :return:
+        *tuple* : (array of group keys, array of labels, list of columns)
+    """
+    key = GROUPS[group_by]
+    label = "'All Projects'" if group_by == 'all' else f'trim(d.{group_by})'
+    query = text(
+        f"""
+        SELECT {key} AS group_key, {label} AS label, {DETAIL_COLUMNS}
+        FROM "details" d
+            JOIN "project" p ON p.id = d.project_id
+        {'' if group_by == 'all' else f'WHERE {key} IN :keys'};
+        """)
+
+    if group_by == 'all':
+        rows = DB.engine.execute(query).all()
+    else:
+        rows = DB.engine.execute(query.bindparams(
+            bindparam('keys', expanding=True)), keys=list(keys)).all()
+
+    columns = list(zip(*rows))
+
+    return (np.array(columns[0], dtype=object),
+            np.array(columns[1], dtype=object), columns[2:])
+
+
+def refresh_insights(full=False):
+    """
+    Work out the insights again for the groups of projects that changed since
+        they were last worked out, and remove the groups that are gone.
+
+    :param
+        - full : *bool* : work out every group, even the ones that did not change
+
+    :return:
+        *int* : the number of groups worked out
+    """
+    refreshed = 0
+
+    for group_by in GROUPS:
+        current = _group_versions(group_by)
+        saved = {row.group_key: (row.projects, row.users, row.id_sum,
+                                 row.last_updated)
+                 for row in DB.session.query(InsightGroup).filter(
+                     InsightGroup.group_by == group_by)}
+
+        changed = [key for key, version in current.items()
+                   if full or saved.get(key) != version]
+        removed = [key for key in saved if key not in current]
+
+        # Remove the old numbers of the groups that changed or are gone
+        for model in (InsightMetric, InsightGroup):
+            DB.session.execute(delete(model).where(
+                model.group_by == group_by,
+                model.group_key.in_(changed + removed)))
+
+        if changed:
+            keys, labels, columns = _load_groups(group_by, changed)
+            values = project_metrics(columns)
+            now = datetime.utcnow()
+
+            # Put the projects of each group next to each other, then split
+            #   the array where the group changes
+            order = np.argsort(keys, kind='stable')
+            group_keys, starts = np.unique(keys[order], return_index=True)
+
+            group_rows, metric_rows = [], []
+
+            for group_key, rows in zip(group_keys, np.split(order, starts[1:])):
+                projects, users, id_sum, last_updated = current[group_key]
+
+                group_rows.append({
+                    'group_by': group_by, 'group_key': group_key,
+                    # Show the brand or type the way most projects wrote it
+                    'label': Counter(labels[rows]).most_common(1)[0][0],
+                    'projects': projects, 'users': users, 'id_sum': id_sum,
+                    'last_updated': last_updated, 'refreshed_at': now,
+                })
+
+                for metric, numbers in summarize(values[rows]).items():
+                    metric_rows.append({'group_by': group_by,
+                                        'group_key': group_key,
+                                        'metric': metric, **numbers})
+
+            DB.session.execute(insert(InsightGroup), group_rows)
+            if metric_rows:
+                DB.session.execute(insert(InsightMetric), metric_rows)
+
+            refreshed += len(group_rows)
+
+        # Commit each kind of group on its own, so the page is never empty
+        DB.session.commit()
+
+    DB.session.close()
+
+    return refreshed
+
+
+def get_insights():
+    """
+    Query the saved insights of the groups big enough to show
+
+    :return:
+        *dict* : group_by -> list of groups, the largest first, each a dict
+            with the label, projects, users and a dict of its metrics
+    """
+    rows = DB.engine.execute(text(
+        """
+        SELECT g.group_by, g.group_key, g.label, g.projects, g.users,
+            g.refreshed_at, m.metric, m.count, m.mean, m.p10, m.p25, m.p50,
+            m.p75, m.p90, m.corr_result
+        FROM "insight_group" g
+            LEFT JOIN "insight_metric" m
+                ON m.group_by = g.group_by AND m.group_key = g.group_key
+        WHERE g.projects >= :min_projects AND g.users >= :min_users
+        ORDER BY g.group_by, g.projects DESC, g.label;
+        """).columns(refreshed_at=DB.DateTime), min_projects=MIN_GROUP_PROJECTS, min_users=MIN_GROUP_USERS).all()
+
+    DB.session.close()
+
+    insights = {group_by: [] for group_by in GROUPS}
+    groups = {}
+
+    for row in rows:
+        group = groups.get((row.group_by, row.group_key))
+
+        if group is None:
+            group = groups[(row.group_by, row.group_key)] = {
+                'label': row.label, 'projects': row.projects,
+                'users': row.users, 'refreshed_at': row.refreshed_at,
+                'metrics': {}}
+            insights[row.group_by].append(group)
+
+        if row.metric is not None:
+            group['metrics'][row.metric] = row
+
+    return insights
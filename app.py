@@ -1,16 +1,33 @@
+from hashlib import sha256
 from os import getenv
-from flask import Flask, render_template, request, session, redirect, flash
-from flask_session import Session
+from flask import Flask, render_template, request, session, redirect, flash, \
+    make_response, url_for, Response, stream_with_context
 from sqlalchemy import text
 from werkzeug.exceptions import default_exceptions, HTTPException, InternalServerError
-from werkzeug.security import check_password_hash, generate_password_hash
-from base64 import b64encode
+import click
 
 from db_model import DB, User
-from queries import dup_user, add_user, get_user, get_last_ten, \
-    add_new_project, dup_proj, get_all, del_rec, get_single, edit_project, \
-    user_details, edit_user
-from helpers import apology, login_required
+from passwords import hash_password, check_password, needs_rehash, \
+    PasswordsBusy
+from images import store_upload, upload_mimetype, get_image, get_variant, \
+    file_key, IMAGE_SIZES
+from migrations import run_migrations, backfill_variants
+from sessions import init_sessions, cleanup_sessions
+from metrics import init_metrics, TimedQueuePool
+from search import search_projects
+from export import csv_export, json_export
+from importer import read_rows, import_projects, ImportFileError
+from analytics import refresh_insights, get_insights, MIN_GROUP_USERS
+from recommend import index_all_features
+from queries import dup_user, add_user, get_user, set_password, get_last_ten, \
+    dup_proj, add_new_project, del_rec, edit_project, user_details, \
+    edit_user, get_page, SORT_COLUMNS, NUMBER_SORTS, FILTERS, FACETS, \
+    facet_counts, get_names, get_project, get_colorants, get_similar, \
+    iter_projects, EXPORT_COLUMNS, picked
+from compression import init_compression
+from helpers import apology, login_required, encode_cursor, decode_cursor, \
+    file_version, directory_version, not_modified, set_validators, \
+    stream_template, result_score
 
 
 # Configure the application
@@ -19,6 +36,10 @@ app = Flask(__name__)
 # Ensure the templates are auto-reloaded
 app.config['TEMPLATES_AUTO_RELOAD'] = True
 
+# Compress the pages sent, see compression.py
+#   - set up first so it runs after everything else has changed the response
+init_compression(app)
+
 """
 Configure the database uri
 """
@@ -30,25 +51,95 @@ if uri.startswith('postgres://'):
 app.config['SQLALCHEMY_DATABASE_URI'] = uri
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Time how long requests wait for a database connection (SQLite has no pool)
+if not uri.startswith('sqlite'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'poolclass': TimedQueuePool}
+
+# Add the database numbers to every response while not debugging too
+app.config['DB_METRICS_HEADERS'] = getenv('DB_METRICS_HEADERS') == '1'
+# Require this token from whatever scrapes /metrics; without it there is no
+#   /metrics page
+app.config['METRICS_TOKEN'] = getenv('METRICS_TOKEN')
+
+# Number of projects shown on each page of the all projects table
+app.config['PROJECTS_PER_PAGE'] = int(getenv('PROJECTS_PER_PAGE', 25))
+
+# The largest request that can be uploaded, in megabytes
+#   - larger uploads are turned away before they are read
+app.config['MAX_CONTENT_LENGTH'] = int(getenv('MAX_UPLOAD_MB', 16)) * 1024 * 1024
+# Number of threads in each worker making the resized copies of new images
+app.config['IMAGE_WORKERS'] = int(getenv('IMAGE_WORKERS', 2))
+
+# How passwords are hashed, see passwords.py
+#   - changing the method upgrades each user's hash at their next login
+app.config['PASSWORD_METHOD'] = getenv('PASSWORD_METHOD')
+app.config['PASSWORD_WORKERS'] = int(getenv('PASSWORD_WORKERS', 2))
+app.config['PASSWORD_QUEUE'] = int(getenv('PASSWORD_QUEUE', 4))
+
 # Connect my app to my database
 DB.init_app(app)
 
+# Record the database use of every request, see metrics.py
+init_metrics(app)
+
+# Columns of the details table that hold whole numbers
+INT_COLUMNS = ('amount', 'time_to_pour_hrs', 'time_to_pour_mins',
+               'pouring_time_hrs', 'pouring_time_mins', 'time_to_demold_hrs',
+               'time_to_demold_mins', 'start_temp', 'end_temp', 'demold_temp')
+
+# Columns that are not changed by the fields on the edit form
+EDIT_SKIP_COLUMNS = ('id', 'name', 'user_id', 'project_id', 'mold_img',
+                     'mold_img_type', 'result_img', 'result_img_type',
+                     'updated_at')
+
+# Fields on the edit form that are named differently than their columns
+EDIT_FORM_NAMES = {'time_to_demold_hrs': 'demolding_time_hrs',
+                   'time_to_demold_mins': 'demolding_time_mins'}
+
+
+# Fingerprint of the templates, so cached pages change when the templates do
+TEMPLATE_VERSION = directory_version(f'{app.root_path}/{app.template_folder}')
+
+
+# Add the fingerprint of each static file to its url, ie. styles.css?v=1a2b3c,
+#   so the url changes whenever the file does
+@app.url_defaults
+def static_version(endpoint, values):
+    if endpoint == 'static' and 'filename' in values:
+        values.setdefault('v', file_version(
+            f'{app.static_folder}/{values["filename"]}'))
+
 
 # Ensure responses aren't cached after a specified time
 @app.after_request
 def after_request(response):
+    # Static files with a fingerprint in the url can be kept forever,
+    #   the others have to be checked with the server each time
+    if request.endpoint == 'static':
+        if request.args.get('v'):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        else:
+            response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    # Leave alone any response that has set its own caching, like the images
+    if "Cache-Control" in response.headers:
+        return response
+
     response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
     response.headers["Expires"] = 1000
     response.headers["Pragma"] = "no-cache"
     return response
 
 
-# Configure session to use filesystem (instead of signed cookies)
-# Will store the session on the users disk vs digitally signed cookies,
-#   which is done by default with Flask
+# Configure sessions to be stored on the server (instead of signed cookies)
+# SESSION_BACKEND picks where they are stored, see sessions.py:
+#   - "database" shares them between every worker and host
+#   - "memory" keeps them in one worker, for running on a single node
+#   - "filesystem" stores them on this host's disk
 app.config.from_object(__name__)
-app.config["SESSION_TYPE"] = "filesystem"
-Session(app)
+app.config["SESSION_BACKEND"] = getenv('SESSION_BACKEND', 'filesystem')
+init_sessions(app)
 
 
 # Create the index route
@@ -140,7 +231,7 @@ def register():
 
         else:
             # Hash the user's password to store in the database
-            hashed_pw = generate_password_hash(password)
+            hashed_pw = hash_password(password)
             # Add the username and hashed password into the user database table
             add_user(first, last, name, hashed_pw, email_add)
 
@@ -148,10 +239,9 @@ def register():
             rows = get_user(name)
             # rows = user_details(user_id)
 
-            # Ensure username exists and password is correct
-            if len(rows) != 1 or not check_password_hash(
-                    rows[0]['password'], request.form.get("password")
-            ):
+            # Ensure the new user was saved, the password was just hashed so
+            #   there is no need to check it again
+            if len(rows) != 1:
                 return apology("invalid username and/or password", 403)
 
             # Remember which user has logged in
@@ -195,9 +285,20 @@ def login():
         row = get_user(request.form.get("username"))
 
         # Ensure username exists and password is correct
-        if len(row) != 1 or not check_password_hash(row[0]['password'], request.form.get("password")):
+        if len(row) != 1 or not check_password(row[0]['password'], request.form.get("password")):
             return apology("invalid username and/or password", 403)
 
+        # Hash the password again if the hash settings have changed since
+        #   it was saved, while we have the password to do it
+        if needs_rehash(row[0]['password']):
+            try:
+                set_password(row[0]['id'],
+                             hash_password(request.form.get("password")))
+
+            except PasswordsBusy:
+                # The user is logged in either way, it is upgraded next time
+                pass
+
         # Remember which user has logged in
         # Stores the users "id" in the Flask session by taking the 1 and only
         #   row in the rows list and grabbing the value from the "id" column
@@ -268,7 +369,7 @@ def edit_act():
                         return apology("Your passwords do not match. Please try again!")
 
                     # Hash the user's password to store in the database
-                    hashed_pw = generate_password_hash(password)
+                    hashed_pw = hash_password(password)
 
                     # Add new hashed password to user dictionary
                     user_dict['password'] = hashed_pw
@@ -327,59 +428,75 @@ def add():
         # Get the users id number
         user_id = session.get("user_id")
 
-        # If project name is already in the data base
-        if dup_proj(request.form.get('name'), user_id):
+        # Iterate through the dictionary of project parameters
+        for key, val in proj_dict.items():
+            if (key == 'amt') or (key == 'time_to_pour_hrs'
+            ) or (key == 'time_to_pour_mins') or (key == 'pouring_time_hrs'
+            ) or (key == 'pouring_time_mins') or (key == 'time_to_demold_hrs'
+            ) or (key == 'time_to_demold_mins') or (key == 'start_temp'
+            ) or (key == 'end_temp') or (key == 'demold_temp'):
+                if request.form.get(val):
+                    proj_dict[key] = int(request.form.get(val))
+
+                else:
+                    proj_dict[key] = 0
+
+            # Get the values from the form if they are not empty
+            elif request.form.get(val) and (
+                    key != 'mold_img' or key != 'mold_img_type' or
+                    key != 'res_img' or key != 'res_img_type'):
+                proj_dict[key] = request.form.get(val)
+
+            else:
+                proj_dict[key] = None
+
+        # Turn away a name the user already has before storing the images,
+        #   so a rejected project does not leave its images behind
+        if dup_proj(proj_dict['name'], user_id):
             return apology(
                 "You have already used\nthat project name.\n\nPlease try another name."
             )
 
-        else:
-            # Iterate through the dictionary of project parameters
-            for key, val in proj_dict.items():
-                if (key == 'amt') or (key == 'time_to_pour_hrs'
-                ) or (key == 'time_to_pour_mins') or (key == 'pouring_time_hrs'
-                ) or (key == 'pouring_time_mins') or (key == 'time_to_demold_hrs'
-                ) or (key == 'time_to_demold_mins') or (key == 'start_temp'
-                ) or (key == 'end_temp') or (key == 'demold_temp'):
-                    if request.form.get(val):
-                        proj_dict[key] = int(request.form.get(val))
-
-                    else:
-                        proj_dict[key] = 0
-
-                # Get the values from the form if they are not empty
-                elif request.form.get(val) and (
-                        key != 'mold_img' or key != 'mold_img_type' or
-                        key != 'res_img' or key != 'res_img_type'):
-                    proj_dict[key] = request.form.get(val)
+        # Check if the key is the mold_img,
+        #   because it needs to be added differently
+        #   - the type is told from the bytes, not from what the browser sent
+        try:
+            mold_pic = request.files['mold_img']
+            res_pic = request.files['res_img']
 
-                else:
-                    proj_dict[key] = None
+            # Check both images before storing either, so a rejected result
+            #   image does not leave the mold image behind
+            for pic in (mold_pic, res_pic):
+                if pic.filename:
+                    upload_mimetype(pic)
 
-            # Check if the key is the mold_img,
-            #   because it needs to be added differently
-            mold_pic = request.files['mold_img']
             if mold_pic.filename:
-                proj_dict['mold_img'] = b64encode(mold_pic.read()).decode('utf-8')
-                proj_dict['mold_img_type'] = mold_pic.mimetype.split('/')[1]
+                proj_dict['mold_img'], mimetype = store_upload(mold_pic)
+                proj_dict['mold_img_type'] = mimetype.split('/')[1]
 
             # Check if the key is the result_img,
             #   because it needs to be added differently
-            res_pic = request.files['res_img']
             if res_pic.filename:
-                proj_dict['res_img'] = b64encode(res_pic.read()).decode('utf-8')
-                proj_dict['res_img_type'] = res_pic.mimetype.split('/')[1]
+                proj_dict['res_img'], mimetype = store_upload(res_pic)
+                proj_dict['res_img_type'] = mimetype.split('/')[1]
 
-            # Set the user_id parameter in the dictionary
-            proj_dict['user_id'] = user_id
-            # Add the new project to the database using function from queries.py
-            add_new_project(proj_dict)
+        except ValueError as e:
+            return apology(str(e))
 
-            # Display a message on the home page to let the user know their
-            #   project was successfully added to the database
-            flash(f'Your project "{request.form.get("name")}" has been added successfully!')
-            # Redirect user to the home page
-            return redirect('/')
+        # Set the user_id parameter in the dictionary
+        proj_dict['user_id'] = user_id
+        # Add the new project to the database using function from queries.py
+        # If project name is already in the data base, nothing is added
+        if add_new_project(proj_dict) is None:
+            return apology(
+                "You have already used\nthat project name.\n\nPlease try another name."
+            )
+
+        # Display a message on the home page to let the user know their
+        #   project was successfully added to the database
+        flash(f'Your project "{request.form.get("name")}" has been added successfully!')
+        # Redirect user to the home page
+        return redirect('/')
 
     # If the request method is 'GET' show the form to add a project
     return render_template('add.html')
@@ -390,21 +507,25 @@ def add():
 @login_required  # Decorator to ensure user is logged in
 def remove():
     """
-    Functionality for the user to remove a project from their account
+    Functionality for the user to remove one or more projects from their
+        account
     """
     # # Check to make sure the user is already logged in
     # check_valid_login()
 
-    # Query a list of all projects on the user's account
-    projects = get_all(session.get("user_id"))
+    # Get the id and name of every project on the user's account
+    user_projects = get_names(session.get("user_id"))
 
-    # Get a list of all project names
-    user_projects = [row[1] for row in projects]
-
-    # Remove the project user selects
+    # Remove all the projects the user selects at once
     if request.method == "POST":
-        del_rec(request.form.get('name'), session.get('user_id'))
-        flash(f'Project "{request.form.get("name")}" has been successfully removed!')
+        proj_ids = request.form.getlist('project_id', type=int)
+
+        # If the user did not select any projects...
+        if not proj_ids:
+            return apology("Need to select at least one project to remove.")
+
+        removed = del_rec(proj_ids, session.get('user_id'))
+        flash(f'{removed} project(s) have been successfully removed!')
         return redirect('/')
 
     return render_template('remove.html', names=user_projects)
@@ -422,8 +543,7 @@ def pick_edit():
     # check_valid_login()
 
     # Create a list of project names for dropdown selection
-    projects = get_all(session.get("user_id"))
-    user_projects = [row[1] for row in projects]
+    user_projects = [name for _, name in get_names(session.get("user_id"))]
 
     if request.method == "POST":
         # Redirect user to the edit page
@@ -443,69 +563,67 @@ def edit(project):
     # # Check to make sure the user is already logged in
     # check_valid_login()
 
-    # Create a dictionary to hold all parameters needed
-    proj_dict = {
-        'id': None, 'name': None, 'mold_img': None, 'mold_img_type': None,
-        'result_img': None, 'result_img_type': None, 'notes': None,
-        'user_id': None, 'project_id': None, 'resin_brand': None,
-        'resin_type': None, 'amount': None, 'unit': None,
-        'colors': None, 'color_amts': None, 'color_types': None,
-        'glitters': None, 'glitter_amts': None, 'glitter_types': None,
-        'time_to_pour_hrs': None, 'time_to_pour_mins': None,
-        'pouring_time_hrs': None, 'pouring_time_mins': None,
-        'time_to_demold_hrs': None, 'time_to_demold_mins': None,
-        'result_scale': None, 'start_temp': None, 'start_temp_unit': None,
-        'end_temp': None, 'end_temp_unit': None, 'demold_temp': None,
-        'demold_temp_unit': None
-    }
-
-    # Grab the project id from the database for the project name given
-    projects = get_all(session.get("user_id"))
-    project_id = [row[:1] for row in projects if project in row[1]]
-
-    # Get the details for the project name given
-    project_details = get_single(project_id[0])
+    # Get the details for the project name given in a single query
+    proj_dict = get_project(session.get("user_id"), project)
 
-    # Iterate through the dictionary to add the values from the database for
-    #   the project specified
-    i = 0  # Create a counter to increment
-    for k, _ in proj_dict.items():
-        # Change the value in the dictionary to the value at the current location
-        proj_dict[k] = project_details[i]
-        i += 1  # Increment the index location value by 1
+    # If the user does not have a project with that name...
+    if proj_dict is None:
+        return apology("Project not found", 404)
 
     if request.method == "POST":
+        # Keep track of only the values that are different from the saved ones
+        changes = {}
+
         # Iterate through the dictionary of project parameters
         for key, val in proj_dict.items():
-            if key != 'id' and key != 'name' and key != 'user_id' and key != 'project_id':
-                # Check if the key is the mold_img,
-                #   because it needs to be handled differently
-                if key == 'mold_img':
-                    mold_pic = b64encode(
-                        request.files['mold_img'].read()).decode('utf-8')
+            # The images and the values the user can not change are skipped
+            if key in EDIT_SKIP_COLUMNS:
+                continue
 
-                    if mold_pic != proj_dict[key] and mold_pic:
-                        proj_dict[key] = mold_pic
+            # Some form fields are named differently than their columns
+            form_key = EDIT_FORM_NAMES.get(key, key)
 
-                # Check if the key is the result_img,
-                #   because it needs to be added differently
-                elif key == 'result_img':
-                    res_pic = b64encode(
-                        request.files['result_img'].read()).decode('utf-8')
+            # Leave alone anything that was not sent with the form
+            if form_key not in request.form:
+                continue
 
-                    if res_pic != proj_dict[key] and res_pic:
-                        proj_dict[key] = res_pic
+            # Empty fields and selects left on "Select One" are saved as
+            #   nothing, the same as when adding
+            new_val = picked(key, request.form.get(form_key) or None)
 
-                # Get the values from the form if they are different
-                elif request.form.get(key) != proj_dict[key]:
-                    new_val = request.form.get(key)
-                    proj_dict[key] = new_val
+            # Turn the whole number values into numbers to compare them
+            if key in INT_COLUMNS:
+                try:
+                    new_val = int(new_val) if new_val else 0
 
-                else:  # Otherwise, continue iterating and change nothing
-                    proj_dict[key] = proj_dict[key]
+                except ValueError:
+                    return apology("Times, temperatures, and amounts\n"
+                                   "need to be whole numbers.")
 
-        # Add the new project to the database using function from queries.py
-        edit_project(proj_dict)
+            # Get the values from the form if they are different
+            if new_val != val:
+                changes[key] = new_val
+
+        # Check the uploaded images against the keys of the saved images,
+        #   so an image is only read when a different one is uploaded
+        pics = {key: request.files.get(key) for key in ('mold_img', 'result_img')}
+        pics = {key: pic for key, pic in pics.items() if pic and pic.filename
+                and file_key(pic.stream) != proj_dict[key]}
+
+        # Check both images before storing either, like when adding
+        try:
+            for pic in pics.values():
+                upload_mimetype(pic)
+
+        except ValueError as e:
+            return apology(str(e))
+
+        for key, pic in pics.items():
+            changes[key], mimetype = store_upload(pic)
+            changes[f'{key}_type'] = mimetype.split('/')[1]
+
+        # Save only the changed values using the function from queries.py
+        edit_project(proj_dict['id'], proj_dict['user_id'], changes)
 
         # Display a message on the home page to let the user know their
         #   project was successfully added to the database
@@ -522,7 +640,8 @@ def edit(project):
 @login_required  # Decorator to ensure user is logged in
 def all_projects():
     """
-    Functionality to view all the projects currently in the user's account
+    Functionality to view all the projects currently in the user's account,
+        one page at a time and sorted by the column the user picks
     """
     # # Check to make sure the user is already logged in
     # check_valid_login()
@@ -532,26 +651,160 @@ def all_projects():
         'SELECT first FROM "user" WHERE id = :user_id'
     ), user_id=session.get("user_id")).one()
 
-    # Query a list of all projects on the user's account
-    projects = get_all(session.get("user_id"))
+    # Get the sort order and page the user asked for from the url
+    sort = request.args.get('sort', 'id')
+    if sort not in SORT_COLUMNS:
+        sort = 'id'
+    descending = request.args.get('order') == 'desc'
+
+    # A cursor that can not be read, or was made for a different sort, can
+    #   not be compared to the sort column
+    after = None
+    if request.args.get('after'):
+        after = decode_cursor(request.args['after'], sort,
+                              number=sort in NUMBER_SORTS)
+        if after is None:
+            return apology("That page link is not valid", 400)
+
+    # Get the amount and temperature ranges and the facet values the user
+    #   asked for, if any
+    filters = {key: request.args.get(key, type=str if key in FACETS else float)
+               for key in FILTERS}
+    filters = {key: value for key, value in filters.items()
+               if value is not None and value != ''}
+
+    # Let the user ask for a different page size, up to a limit
+    per_page = request.args.get('per_page', type=int) or \
+        app.config['PROJECTS_PER_PAGE']
+    per_page = min(max(per_page, 1), 100)
+
+    # Query just one page of projects on the user's account
+    projects, next_cursor = get_page(session.get("user_id"), sort, descending,
+                                     after, per_page, filters)
+    # The cursor for the next page goes in its url, if there is one
+    if next_cursor is not None:
+        next_cursor = encode_cursor(sort, next_cursor)
+
+    # Create a list of all column names to display, with the key to sort
+    #   by for the columns that can be sorted
+    cols = [('Project Name', 'name'), ('Mold Image', None),
+            ('Brand of Resin', 'resin_brand'), ('Type of Resin', 'resin_type'),
+            ('Amount of Resin', 'amount'), ('Color(s)', None),
+            ('Amount of Color(s)', None), ('Type of Color(s)', None),
+            ('Glitter(s)', None), ('Amount of Glitter(s)', None),
+            ('Type of Glitter(s)', None), ('Time Until Pour (HH:MM)', None),
+            ('Pouring Time (HH:MM)', None),
+            ('Time until De-molding (HH:MM)', 'cure_time'),
+            ('Starting Room Temp', 'start_temp'), ('Ending Room Temp', None),
+            ('De-molding Room Temp', None), ('Result Scale', 'result_scale'),
+            ('Result Image', None), ('Additional Notes', None)]
+
+    # The filters without each facet, for the links that take a facet off
+    without = {facet: {key: value for key, value in filters.items()
+                       if key != facet} for facet in FACETS}
+
+    # The table can be long, so send it as it is rendered
+    return stream_template('all_projects.html', project=projects,
+                           cols=cols, user=first[0], sort=sort,
+                           descending=descending, per_page=per_page,
+                           filters=filters, without=without,
+                           facets=facet_counts(session.get("user_id")),
+                           next_cursor=next_cursor,
+                           first_page=after is None)
+
+
+# Create a route to search the user's projects
+@app.route('/search')
+@login_required  # Decorator to ensure user is logged in
+def search():
+    """
+    Functionality to find the user's projects by the words in them, the best
+        matches first
+    """
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+
+    # Query just one page of the projects that match
+    results, has_next = search_projects(session.get("user_id"), query, page,
+                                        app.config['PROJECTS_PER_PAGE'])
+
+    return render_template('search.html', query=query, results=results,
+                           page=page, has_next=has_next)
+
+
+# Create a route to show what the projects of every user have in common
+@app.route('/insights')
+@login_required  # Decorator to ensure user is logged in
+def insights():
+    """
+    Functionality to show the anonymous numbers worked out from every user's
+        projects by `flask refresh-insights`
+    """
+    return render_template('insights.html', insights=get_insights(),
+                           min_users=MIN_GROUP_USERS)
+
+
+# Create the routes to download all the user's projects as a file
+@app.route('/export.<file_type>')
+@login_required  # Decorator to ensure user is logged in
+def export(file_type):
+    """
+    Functionality to download every project in the user's account as a CSV or
+        JSON file, sent as the projects are read from the database
+    """
+    writers = {'csv': (csv_export, 'text/csv'),
+               'json': (json_export, 'application/json')}
+
+    if file_type not in writers:
+        return apology("Projects can only be exported\nas csv or json", 404)
+
+    writer, mimetype = writers[file_type]
 
-    # Create a list of all column names to display
-    cols = ['Project Name', 'Mold Image', 'Brand of Resin',
-            'Type of Resin', 'Amount of Resin', 'Color(s)',
-            'Amount of Color(s)', 'Type of Color(s)', 'Glitter(s)',
-            'Amount of Glitter(s)', 'Type of Glitter(s)',
-            'Time Until Pour (HH:MM)', 'Pouring Time (HH:MM)',
-            'Time until De-molding (HH:MM)', 'Starting Room Temp',
-            'Ending Room Temp', 'De-molding Room Temp', 'Result Scale',
-            'Result Image', 'Additional Notes']
+    # The images are left out unless the user asks for links to them
+    image_url = None
+    if request.args.get('images') == 'link':
+        def image_url(key):
+            return url_for('image', img_hash=key, _external=True)
 
-    mold_type = [row['mold_img_type'] for row in projects]
-    res_type = [row['result_img_type'] for row in projects]
+    pieces = writer(iter_projects(session.get("user_id")), EXPORT_COLUMNS,
+                    image_url)
 
-    return render_template('all_projects.html', project=projects,
-                           cols=cols, user=first[0],
-                           mold_type=mold_type,
-                           res_type=res_type)
+    return Response(stream_with_context(pieces), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=resin_projects.{file_type}'})
+
+
+# Create a route to add many projects at once from a file
+@app.route('/import', methods=["GET", "POST"])
+@login_required  # Decorator to ensure user is logged in
+def import_file():
+    """
+    Functionality for the user to add many projects from a CSV or JSON file,
+        showing which rows could not be added and why
+    """
+    if request.method == "POST":
+        upload = request.files.get('file')
+
+        if not upload or not upload.filename:
+            return apology("Please choose a file to import")
+
+        # Tell the types of file apart by their extension
+        file_type = upload.filename.rsplit('.', 1)[-1].lower()
+
+        try:
+            rows = read_rows(upload.stream, file_type)
+
+        except ImportFileError as e:
+            return apology(str(e))
+
+        added, errors = import_projects(rows, session.get("user_id"))
+
+        flash(f'{added} project(s) have been imported successfully!')
+
+        return render_template('import.html', added=added, errors=errors,
+                               filename=upload.filename)
+
+    # If the request method is 'GET' show the form to upload a file
+    return render_template('import.html')
 
 
 # Create route to select just one project
@@ -565,8 +818,7 @@ def select():
     # check_valid_login()
 
     # Create a list of project names for dropdown selection
-    projects = get_all(session.get("user_id"))
-    user_projects = [row[1] for row in projects]
+    user_projects = [name for _, name in get_names(session.get("user_id"))]
 
     if request.method == "POST":
         # Redirect user to the edit page
@@ -586,38 +838,106 @@ def display(project):
     # # Check to make sure the user is already logged in
     # check_valid_login()
 
-    # Create a dictionary to hold all parameters needed
-    proj_dict = {
-        'id': None, 'name': None, 'mold_img': None, 'mold_img_type': None,
-        'result_img': None, 'result_img_type': None, 'notes': None,
-        'user_id': None, 'project_id': None, 'resin_brand': None,
-        'resin_type': None, 'amount': None, 'unit': None,
-        'colors': None, 'color_amts': None, 'color_types': None,
-        'glitters': None, 'glitter_amts': None, 'glitter_types': None,
-        'time_to_pour_hrs': None, 'time_to_pour_mins': None,
-        'pouring_time_hrs': None, 'pouring_time_mins': None,
-        'time_to_demold_hrs': None, 'time_to_demold_mins': None,
-        'result_scale': None, 'start_temp': None, 'start_temp_unit': None,
-        'end_temp': None, 'end_temp_unit': None, 'demold_temp': None,
-        'demold_temp_unit': None
-    }
+    # Get the details for the project name given in a single query
+    proj_dict = get_project(session.get("user_id"), project)
 
-    # Grab the project id from the database for the project name given
-    projects = get_all(session.get("user_id"))
-    project_id = [row[0] for row in projects if project in row[1]]
+    # If the user does not have a project with that name...
+    if proj_dict is None:
+        return apology("Project not found", 404)
 
-    # Get the details for the project name given
-    project_details = get_single(project_id[0])
+    # The user's projects most like this one, from the cached feature vectors
+    similar = get_similar(session.get("user_id"), proj_dict['id'])
 
-    # Iterate through the dictionary to add the values from the database for
-    #   the project specified
-    i = 0  # Create a counter to increment
-    for k, _ in proj_dict.items():
-        # Change the value in the dictionary to the value at the current location
-        proj_dict[k] = project_details[i]
-        i += 1  # Increment the index location value by 1
+    # The page only changes when the project, the similar projects or the
+    #   templates do
+    updated_at = proj_dict['updated_at']
+    similar_version = sha256(repr(similar).encode('utf-8')).hexdigest()[:12]
+    etag = f'{proj_dict["id"]}-{updated_at and updated_at.timestamp()}-' \
+           f'{similar_version}-{TEMPLATE_VERSION}'
 
-    return render_template('display.html', project=proj_dict)
+    # The browser already has this version of the page, no need to render it
+    if not_modified(etag, updated_at):
+        return set_validators(make_response('', 304), etag, updated_at)
+
+    # The colors and glitters are already split into their own rows
+    colorants = get_colorants(proj_dict['id'])
+
+    # The similar project with the best result, 1 being the best
+    #   - the scale is saved with its label, ie. "1 - Nailed It!"
+    scored = [row for row in similar
+              if result_score(row['result_scale']) is not None]
+    best = min(scored, key=lambda row: result_score(row['result_scale']),
+               default=None)
+
+    return set_validators(
+        make_response(render_template('display.html', project=proj_dict,
+                                      colorants=colorants, similar=similar,
+                                      best=best)),
+        etag, updated_at)
+
+
+# Create a route to serve the project images
+@app.route('/image/<img_hash>')
+@login_required  # Decorator to ensure user is logged in
+def image(img_hash):
+    """
+    Serve a single image from the image store.
+
+    Images are saved under the SHA-256 of their bytes, so the content for a
+        given url can never change and the browser can cache it forever.
+    """
+    # The browser already has this image, no need to query the database
+    if img_hash in request.if_none_match:
+        response = make_response('', 304)
+
+    else:
+        img = get_image(img_hash)
+
+        # If there is no image saved with that key...
+        if img is None:
+            return apology("Image not found", 404)
+
+        response = make_response(img.data)
+        response.mimetype = img.mimetype
+
+    response.set_etag(img_hash)
+    response.headers["Cache-Control"] = "private, max-age=31536000, immutable"
+    return response
+
+
+# Create a route to serve the resized copies of the project images
+@app.route('/image/<img_hash>/<size>')
+@login_required  # Decorator to ensure user is logged in
+def image_variant(img_hash, size):
+    """
+    Serve a resized copy of a single image from the image store.
+
+    If the copy has not been made yet, send the browser to the original image
+        without caching the redirect, so the copy is used once it exists.
+    """
+    # If the size asked for is not one we make...
+    if size not in IMAGE_SIZES:
+        return apology("Image size not found", 404)
+
+    etag = f'{img_hash}-{size}'
+
+    # The browser already has this image, no need to query the database
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+
+    else:
+        img = get_variant(img_hash, size)
+
+        # If the resized copy has not been made yet...
+        if img is None:
+            return redirect(url_for('image', img_hash=img_hash))
+
+        response = make_response(img.data)
+        response.mimetype = img.mimetype
+
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, max-age=31536000, immutable"
+    return response
 
 
 # Create a route to create the database
@@ -639,10 +959,90 @@ def create_db():
     return redirect('/')
 
 
+@app.cli.command('migrate')
+def migrate():
+    """
+    Bring an existing database up to date with the current models
+    """
+    run_migrations()
+    click.echo('The database has been migrated successfully!')
+
+
+@app.cli.command('backfill-thumbnails')
+def backfill_thumbnails():
+    """
+    Make the thumbnail and medium copies for images uploaded before them
+    """
+    resized = backfill_variants()
+    click.echo(f'{resized} image(s) have been resized successfully!')
+
+
+@app.cli.command('cleanup-sessions')
+def cleanup_sessions_command():
+    """
+    Remove the expired sessions from the database session table
+    """
+    removed = cleanup_sessions()
+    click.echo(f'{removed} expired session(s) have been removed successfully!')
+
+
+@app.cli.command('import-projects')
+@click.argument('username')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def import_projects_command(username, path):
+    """
+    Add the projects in a CSV or JSON file to a user's account
+    """
+    user = User.query.filter_by(username=username).first()
+
+    if user is None:
+        raise click.ClickException(f'There is no user named {username}')
+
+    try:
+        with open(path, 'rb') as f:
+            rows = read_rows(f, path.rsplit('.', 1)[-1].lower())
+
+    except ImportFileError as e:
+        raise click.ClickException(str(e))
+
+    added, errors = import_projects(rows, user.id)
+
+    for number, message in errors:
+        click.echo(f'Row {number}: {message}', err=True)
+
+    click.echo(f'{added} project(s) have been imported successfully!')
+
+
+@app.cli.command('build-features')
+def build_features():
+    """
+    Make the feature vectors used to find similar projects for every project
+        without a current one
+    """
+    indexed = index_all_features()
+    click.echo(f'{indexed} project(s) have been given new feature vectors!')
+
+
+@app.cli.command('refresh-insights')
+@click.option('--full', is_flag=True,
+              help='Work out every group, not just the ones that changed.')
+def refresh_insights_command(full):
+    """
+    Work out the insights again for the groups of projects that have changed
+    """
+    refreshed = refresh_insights(full)
+    click.echo(f'{refreshed} group(s) of projects have been refreshed successfully!')
+
+
 def errorhandler(e):
     """Handle error"""
     if not isinstance(e, HTTPException):
         e = InternalServerError()
+    # Say how big an upload can be, instead of "Request Entity Too Large"
+    if e.code == 413:
+        return apology(f"Uploads can be at most\n"
+                       f"{app.config['MAX_CONTENT_LENGTH'] // 1024 // 1024} MB.",
+                       413)
     return apology(e.name, e.code)
 
 
@@ -651,5 +1051,14 @@ for code in default_exceptions:
     app.errorhandler(code)(errorhandler)
 
 
+@app.errorhandler(PasswordsBusy)
+def passwords_busy(e):
+    """Turn away logins while too many passwords are being hashed"""
+    response = make_response(apology("Too many people are logging in.\n"
+                                      "Please try again in a moment.", 503))
+    response.headers['Retry-After'] = '5'
+    return response
+
+
 if __name__ == '__main__':
     app.run(debug=True)
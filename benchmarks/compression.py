@@ -0,0 +1,123 @@
+"""
+Benchmark the bytes saved and the CPU time spent compressing a full page of
+    the all projects table.
+
+A temporary SQLite database is filled with projects like the ones users add,
+    the page is rendered once by the app, and then compressed with each
+    encoding and level, both whole and a streamed piece at a time.
+
+Usage:
+    python benchmarks/compression.py [--projects 100] [--repeat 20]
+"""
+import argparse
+import os
+import sys
+import tempfile
+from time import process_time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORK_DIR = tempfile.mkdtemp()
+os.environ['DATABASE_URI'] = f'sqlite:///{WORK_DIR}/compression.db'
+os.environ['SESSION_BACKEND'] = 'memory'
+
+from app import app  # noqa: E402
+from compression import Compressor, brotli  # noqa: E402
+from db_model import DB, User  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+from queries import add_projects  # noqa: E402
+
+BRANDS = ['ArtResin', 'Let\'s Resin', 'Amazing Clear Cast', 'Pro Marine',
+          'Craft Resin']
+COLORS = ['Red', 'Ocean Blue', 'Gold', 'Pearl White', 'Black', 'Teal']
+
+
+def seed(count):
+    """
+    Add a user with `count` projects, returning the user's id
+    """
+    with app.app_context():
+        run_migrations()
+        user = User(first='Bench', last='Mark', username='bench',
+                    password='x', email='bench@example.com')
+        DB.session.add(user)
+        DB.session.commit()
+        user_id = user.id
+
+        add_projects([{
+            'name': f'Coaster set {i}', 'mold_img': None, 'mold_img_type': None,
+            'res_img': None, 'res_img_type': None, 'user_id': user_id,
+            'notes': 'Poured in two layers, torched the bubbles out after '
+                     f'ten minutes. Attempt number {i}.',
+            'resin_brand': BRANDS[i % len(BRANDS)], 'resin_type': 'Epoxy',
+            'amt': 100 + i, 'unit': 'Grams',
+            'colors': ', '.join(COLORS[i % 3:i % 3 + 3]),
+            'color_amts': '2, 1, 3', 'color_types': 'Mica Powder, Ink, Paste',
+            'glitters': 'Holographic', 'glitter_amts': '1',
+            'glitter_types': 'Chunky', 'time_to_pour_hrs': 0,
+            'time_to_pour_mins': 10, 'pouring_time_hrs': 0,
+            'pouring_time_mins': 5, 'time_to_demold_hrs': 24 + i % 48,
+            'time_to_demold_mins': 0, 'result_scale': i % 5 + 1,
+            'start_temp': 70, 'start_temp_unit': 'Fahrenheit',
+            'end_temp': 72, 'end_temp_unit': 'Fahrenheit',
+            'demold_temp': 68, 'demold_temp_unit': 'Fahrenheit',
+        } for i in range(count)])
+
+    return user_id
+
+
+def time_compression(chunks, encoding, level, repeat):
+    """
+    Compress the page `repeat` times, returning (size, CPU ms per page)
+    """
+    start = process_time()
+
+    for _ in range(repeat):
+        compressor = Compressor(encoding, level, level)
+        size = sum(len(compressor.compress(chunk) + compressor.flush())
+                   for chunk in chunks) + len(compressor.finish())
+
+    return size, (process_time() - start) * 1000 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--projects', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    user_id = seed(args.projects)
+    app.config['PROJECTS_PER_PAGE'] = args.projects
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+
+    # Keep the pieces the page is streamed in, without compression
+    response = client.get('/all_projects', buffered=False,
+                          headers={'Accept-Encoding': 'identity'})
+    chunks = [chunk for chunk in response.response]
+    response.close()
+    page = b''.join(chunks)
+
+    print(f'{len(page)} byte page of {args.projects} projects, '
+          f'{len(chunks)} streamed pieces\n')
+    print(f'{"encoding":<10}{"level":>6}{"mode":>10}{"bytes":>10}'
+          f'{"saved":>8}{"CPU ms":>9}')
+
+    levels = [('gzip', level) for level in (1, 6, 9)]
+    if brotli is not None:
+        levels += [('br', level) for level in (1, 5, 11)]
+
+    for encoding, level in levels:
+        for mode, pieces in (('whole', [page]), ('streamed', chunks)):
+            size, cpu_ms = time_compression(pieces, encoding, level, args.repeat)
+            print(f'{encoding:<10}{level:>6}{mode:>10}{size:>10}'
+                  f'{1 - size / len(page):>8.1%}{cpu_ms:>9.2f}')
+
+    if brotli is None:
+        print('\nbrotli is not installed, only gzip was measured')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark importing a large CSV file of projects.
+
+A CSV file like a crafter's spreadsheet of past pours is made in memory, then
+    read, checked and added to a temporary SQLite database the same way the
+    /import page does, timing each step.
+
+Usage:
+    python benchmarks/import_projects.py [--rows 10000] [--database URI]
+
+Pass a Postgres uri with --database to time the inserts over the network.
+"""
+import argparse
+import csv
+from io import BytesIO, StringIO
+import os
+import random
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORK_DIR = tempfile.mkdtemp()
+os.environ.setdefault('DATABASE_URI', f'sqlite:///{WORK_DIR}/import.db')
+os.environ['SESSION_BACKEND'] = 'memory'
+
+from app import app  # noqa: E402
+from db_model import DB, User  # noqa: E402
+from importer import clean_rows, import_projects, read_rows  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+
+BRANDS = ['ArtResin', 'Let\'s Resin', 'Amazing Clear Cast', 'Pro Marine',
+          'Craft Resin']
+COLORS = ['Red', 'Ocean Blue', 'Gold', 'Pearl White', 'Black', 'Teal']
+TYPES = ['Mica Powder', 'Alcohol Ink', 'Pigment Paste']
+
+
+def make_csv(count):
+    """
+    Make a CSV file of `count` projects, using the add form's field names
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['name', 'resin_brand', 'resin_type', 'amount', 'unit',
+                     'color', 'color_amt', 'color_types', 'glitter',
+                     'glitter_amt', 'glitter_types', 'time_to_pour_mins',
+                     'pouring_time_mins', 'demolding_time_hrs', 'start_temp',
+                     'start_temp_unit', 'res_scale', 'notes'])
+
+    for i in range(count):
+        writer.writerow([
+            f'Pour {i}', random.choice(BRANDS), 'Epoxy', random.randint(50, 500),
+            'Grams', ', '.join(random.sample(COLORS, 2)), '2, 1',
+            ', '.join(random.sample(TYPES, 2)), 'Holographic', '1', 'Chunky',
+            random.randint(5, 20), random.randint(2, 10), random.randint(12, 72),
+            random.randint(65, 80), 'Fahrenheit', random.randint(1, 5),
+            'Poured in two layers and torched the bubbles out.'])
+
+    return buffer.getvalue().encode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--database', default=None)
+    args = parser.parse_args()
+
+    if args.database:
+        app.config['SQLALCHEMY_DATABASE_URI'] = args.database
+
+    random.seed(0)
+    data = make_csv(args.rows)
+
+    with app.app_context():
+        run_migrations()
+        user = User(first='Bench', last='Mark', username=f'import{random.random()}',
+                    password='x', email=f'import{random.random()}@example.com')
+        DB.session.add(user)
+        DB.session.commit()
+        user_id = user.id
+
+        start = perf_counter()
+        rows = read_rows(BytesIO(data), 'csv')
+        read_time = perf_counter() - start
+
+        start = perf_counter()
+        clean_rows(rows, user_id)
+        clean_time = perf_counter() - start
+
+        # The full import checks the rows again, then adds them
+        start = perf_counter()
+        added, errors = import_projects(rows, user_id)
+        import_time = perf_counter() - start
+
+    print(f'{len(data) / 1e6:.1f} MB file with {args.rows} projects\n')
+    print(f'{"step":<24}{"seconds":>10}{"rows/s":>12}')
+
+    for step, seconds in (('read the file', read_time),
+                          ('check the rows', clean_time),
+                          ('check and add the rows', import_time)):
+        print(f'{step:<24}{seconds:>10.2f}{args.rows / seconds:>12.0f}')
+
+    print(f'\n{added} projects added, {len(errors)} rows with errors')
+
+
+if __name__ == '__main__':
+    main()
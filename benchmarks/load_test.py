@@ -0,0 +1,256 @@
+"""
+Load test the main pages with many users browsing at once.
+
+Run benchmarks/seed.py first. Each virtual user logs in as one of the made up
+    users, then every virtual user loads the same page over and over for a
+    while before moving on to the next page. The time each load takes, the
+    number of loads per second and the most memory the app used are reported
+    for each page, and saved as JSON so runs can be compared.
+
+The app is run in this process through the Flask test client, or pass --url
+    to load the pages from a running server, ie. ``gunicorn app:app``. Give the
+    server's process id with --pid to record its memory too; the memory of its
+    worker processes is added in.
+
+Usage:
+    python benchmarks/load_test.py [--vus 20] [--seconds 20] [--users 1000]
+        [--projects 500] [--url http://127.0.0.1:8000 --pid PID]
+        [--database URI] [--output load_test.json] [--compare OLD.json]
+"""
+import argparse
+from datetime import datetime
+from http.client import HTTPConnection
+import json
+import os
+import random
+import sys
+from statistics import quantiles
+from threading import Event, Thread
+from time import perf_counter
+from urllib.parse import urlencode, urlsplit, quote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from seed import DEFAULT_DATABASE, PASSWORD  # noqa: E402
+
+# The pages loaded, in order; {project} is filled in with a random project
+ROUTES = ('/home', '/all_projects', '/display/{project}', '/edit/{project}')
+
+
+class TestClientUser:
+    """
+    A virtual user loading pages from the app in this process
+    """
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def post(self, path, form):
+        return self.client.post(path, data=form).status_code
+
+    def get(self, path):
+        return self.client.get(path).status_code
+
+
+class HTTPUser:
+    """
+    A virtual user loading pages from a running server, keeping its cookies
+    """
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.connection = HTTPConnection(parts.hostname, parts.port or 80)
+        self.cookies = {}
+
+    def _request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value
+                                          in self.cookies.items())
+
+        self.connection.request(method, path, body, headers)
+        response = self.connection.getresponse()
+        response.read()
+
+        for cookie in response.headers.get_all('Set-Cookie') or ():
+            name, value = cookie.split(';', 1)[0].split('=', 1)
+            self.cookies[name] = value
+
+        return response.status
+
+    def post(self, path, form):
+        return self._request('POST', path, urlencode(form), {
+            'Content-Type': 'application/x-www-form-urlencoded'})
+
+    def get(self, path):
+        return self._request('GET', path)
+
+
+def memory_mb(pids):
+    """
+    The memory used by some processes and their child processes, in megabytes
+    """
+    total = 0
+
+    for pid in pids:
+        children = f'/proc/{pid}/task/{pid}/children'
+
+        if os.path.exists(children):
+            with open(children) as f:
+                total += memory_mb([int(child) for child in f.read().split()])
+
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                total += next(int(line.split()[1]) for line in f
+                              if line.startswith('VmRSS:')) / 1024
+
+        except (OSError, StopIteration):
+            # The process has stopped, or this is not Linux
+            pass
+
+    return total
+
+
+def browse(user, route, projects, stop, results, rng):
+    """Load one page over and over until told to stop, timing each load"""
+    while not stop.is_set():
+        path = route.format(project=quote(f'Project {rng.randrange(projects)}'))
+
+        start = perf_counter()
+        status = user.get(path)
+        results.append((perf_counter() - start, status))
+
+
+def run_route(users, route, projects, seconds, pids, rng):
+    """
+    Have every virtual user load one page for a number of seconds
+
+    :return:
+        *dict* : the numbers for the page
+    """
+    stop = Event()
+    results = [[] for _ in users]
+    peak = [memory_mb(pids)]
+
+    threads = [Thread(target=browse, args=(user, route, projects, stop, result,
+                                           random.Random(rng.random())))
+               for user, result in zip(users, results)]
+
+    start = perf_counter()
+
+    for thread in threads:
+        thread.start()
+
+    # Check the memory used while the pages load
+    while not stop.wait(0.1):
+        peak.append(memory_mb(pids))
+
+        if perf_counter() - start >= seconds:
+            stop.set()
+
+    for thread in threads:
+        thread.join()
+
+    elapsed = perf_counter() - start
+    results = [result for user_results in results for result in user_results]
+    cuts = quantiles([time for time, _ in results], n=100)
+
+    return {
+        'requests': len(results),
+        'errors': sum(status >= 400 for _, status in results),
+        'throughput': round(len(results) / elapsed, 1),
+        'p50_ms': round(cuts[49] * 1000, 1),
+        'p95_ms': round(cuts[94] * 1000, 1),
+        'p99_ms': round(cuts[98] * 1000, 1),
+        'peak_rss_mb': round(max(peak), 1),
+    }
+
+
+def print_results(report, old=None):
+    """Print a table of the results, with the change from an old run if given"""
+    print(f'{"page":<22}{"loads":>8}{"errors":>8}{"loads/s":>9}'
+          f'{"p50":>9}{"p95":>9}{"p99":>9}{"RSS MB":>9}'
+          + (f'{"p95 vs old":>12}' if old else ''))
+
+    for route, row in report['routes'].items():
+        line = (f'{route:<22}{row["requests"]:>8}{row["errors"]:>8}'
+                f'{row["throughput"]:>9.1f}{row["p50_ms"]:>7.1f}ms'
+                f'{row["p95_ms"]:>7.1f}ms{row["p99_ms"]:>7.1f}ms'
+                f'{row["peak_rss_mb"]:>9.1f}')
+
+        if old and route in old['routes']:
+            before = old['routes'][route]['p95_ms']
+            line += f'{(row["p95_ms"] - before) / before:>+12.0%}'
+
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--vus', type=int, default=20,
+                        help='virtual users browsing at once')
+    parser.add_argument('--seconds', type=float, default=20,
+                        help='seconds spent on each page')
+    parser.add_argument('--users', type=int, default=1000,
+                        help='number of users made by seed.py')
+    parser.add_argument('--projects', type=int, default=500,
+                        help='projects for each user made by seed.py')
+    parser.add_argument('--url', help='load the pages from this server instead')
+    parser.add_argument('--pid', type=int, action='append', default=[],
+                        help='process id of the server, to record its memory')
+    parser.add_argument('--database', default=DEFAULT_DATABASE)
+    parser.add_argument('--output', default='load_test.json')
+    parser.add_argument('--compare', help='a JSON file from an earlier run')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    if args.url:
+        users = [HTTPUser(args.url) for _ in range(args.vus)]
+        pids = args.pid
+
+    else:
+        # The app reads these when it is imported
+        os.environ['DATABASE_URI'] = args.database
+        os.environ['SESSION_BACKEND'] = 'memory'
+
+        from app import app
+
+        users = [TestClientUser(app) for _ in range(args.vus)]
+        pids = [os.getpid()]
+
+    for user in users:
+        status = user.post('/login', {'username': f'user{rng.randrange(args.users)}',
+                                      'password': PASSWORD})
+        if status != 302:
+            sys.exit(f'Could not log in ({status}), run benchmarks/seed.py first')
+
+    report = {
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'target': args.url or 'test client',
+        # Only the kind of database, the uri can hold a password
+        'database': None if args.url else args.database.split(':', 1)[0],
+        'vus': args.vus,
+        'seconds': args.seconds,
+        'routes': {},
+    }
+
+    for route in ROUTES:
+        report['routes'][route] = run_route(users, route, args.projects,
+                                            args.seconds, pids, rng)
+
+    old = None
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+
+    print_results(report, old)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f'\nSaved to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Benchmark how a burst of logins affects the other pages.
+
+The app is served by a threaded server on a local port, like a gunicorn worker
+    with --threads. Some clients log in over and over while one other client
+    keeps loading a page that does not hash anything, and the time that page
+    takes is measured. This is done with the passwords hashed in the request
+    thread and again with the hashing pool from passwords.py.
+
+Usage:
+    python benchmarks/password_hashing.py [--seconds 10] [--logins 8]
+"""
+import argparse
+from http.client import HTTPConnection
+import logging
+import os
+import sys
+import tempfile
+from statistics import quantiles
+from threading import Event, Thread
+from time import perf_counter
+from urllib.parse import urlencode
+
+from werkzeug.serving import make_server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORK_DIR = tempfile.mkdtemp()
+os.environ.setdefault('DATABASE_URI', f'sqlite:///{WORK_DIR}/passwords.db')
+os.environ['SESSION_BACKEND'] = 'memory'
+
+from app import app  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+import passwords  # noqa: E402
+from queries import add_user  # noqa: E402
+
+LOGIN = urlencode({'username': 'bench', 'password': 'correct horse'})
+
+
+def log_in(port, stop, results):
+    """Keep logging in until told to stop, counting each kind of answer"""
+    connection = HTTPConnection('127.0.0.1', port)
+
+    while not stop.is_set():
+        connection.request('POST', '/login', LOGIN, {
+            'Content-Type': 'application/x-www-form-urlencoded'})
+        response = connection.getresponse()
+        response.read()
+        results[response.status] = results.get(response.status, 0) + 1
+
+
+def load_page(port, stop, times):
+    """Keep loading the login form until told to stop, timing each load"""
+    connection = HTTPConnection('127.0.0.1', port)
+
+    while not stop.is_set():
+        start = perf_counter()
+        connection.request('GET', '/login')
+        connection.getresponse().read()
+        times.append(perf_counter() - start)
+
+
+def run(port, seconds, logins):
+    """
+    Run the logins and the page loads together for a number of seconds
+
+    :return:
+        *tuple* : (dict of status -> count for the logins, list of page times)
+    """
+    stop = Event()
+    results, times = {}, []
+    threads = [Thread(target=log_in, args=(port, stop, results))
+               for _ in range(logins)]
+    threads.append(Thread(target=load_page, args=(port, stop, times)))
+
+    for thread in threads:
+        thread.start()
+
+    stop.wait(seconds)
+    stop.set()
+
+    for thread in threads:
+        thread.join()
+
+    return results, times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--logins', type=int, default=8,
+                        help='number of clients logging in at once')
+    args = parser.parse_args()
+
+    with app.app_context():
+        run_migrations()
+        add_user('Bench', 'Mark', 'bench',
+                 passwords.hash_password('correct horse'), 'bench@example.com')
+
+    # Leave out the line logged for every request
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    print(f'{args.logins} clients logging in for {args.seconds:.0f}s each run\n')
+    print(f'{"hashing":<24}{"logins/s":>10}{"turned away":>13}'
+          f'{"page p50":>10}{"p95":>8}{"p99":>8}')
+
+    for label, workers in (('in the request', 0),
+                           (f'pool of {os.cpu_count()}', os.cpu_count())):
+        app.config['PASSWORD_WORKERS'] = workers
+        app.config['PASSWORD_QUEUE'] = workers * 2
+
+        results, times = run(server.port, args.seconds, args.logins)
+        cuts = quantiles(times, n=100)
+
+        print(f'{label:<24}{results.get(302, 0) / args.seconds:>10.1f}'
+              f'{results.get(503, 0):>13}{cuts[49] * 1000:>8.1f}ms'
+              f'{cuts[94] * 1000:>6.1f}ms{cuts[98] * 1000:>6.1f}ms')
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""
+Time every query helper in queries.py as a user's projects grow.
+
+One user's projects are added to an in-memory SQLite database in steps, ie.
+    10, 100, 1,000 and then 5,000 projects, next to other users with projects
+    of their own. At each step every helper is called many times, and the
+    middle time of a call and the database round trips each call makes are
+    recorded.
+
+Helpers that should cost the same no matter how many projects the user has
+    are flagged when their round trips go up, or their time grows more than
+    --growth times, between the smallest and largest step. The script exits
+    with an error when anything is flagged, so it can be run before shipping.
+
+Usage:
+    python benchmarks/queries_bench.py [--sizes 10,100,1000,5000] [--calls 50]
+        [--growth 3] [--database URI]
+"""
+import argparse
+import os
+import random
+import sys
+from statistics import median
+from time import perf_counter
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DATABASE_URI', 'sqlite://')
+os.environ['SESSION_BACKEND'] = 'memory'
+
+from app import app  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+import queries  # noqa: E402
+from queries import add_projects, invalidate_user_cache  # noqa: E402
+from seed import make_project  # noqa: E402
+
+# Helpers that read every project of the user, so they are meant to grow
+GROWS_WITH_PROJECTS = {'get_all', 'get_names', 'facet_counts'}
+
+# Round trips made to the database, counted by the listener below
+_round_trips = [0]
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_round_trip(conn, cursor, statement, parameters, context,
+                      executemany):
+    _round_trips[0] += 1
+
+
+def add_user(number):
+    """Add a made up user, returning its id"""
+    queries.add_user('Bench', f'Mark {number}', f'bench{number}', 'x',
+                     f'bench{number}@example.com')
+    return queries.get_user(f'bench{number}')[0]['id']
+
+
+def make_cases(user_id, rng, size):
+    """
+    The calls to time, one function with no arguments for each helper
+
+    :return:
+        *dict* : helper name -> function making one call
+    """
+    name = f'Project {rng.randrange(size)}'
+    proj_id = queries.get_project(user_id, name)['id']
+    user = dict(zip(('id', 'first', 'last', 'username', 'password', 'email'),
+                    queries.user_details(user_id)))
+    # The projects added by add_new_project, removed again by del_rec
+    added = []
+    counter = iter(range(10 ** 9))
+
+    def add_new_project():
+        # The same details every time, so each call makes the same inserts
+        project = make_project(user_id, f'new {next(counter)}',
+                               random.Random(0), [None])
+        added.append(queries.add_new_project(project))
+
+    def del_rec():
+        queries.del_rec([added.pop()] if added else [], user_id)
+
+    def edit_project():
+        queries.edit_project(proj_id, user_id, {
+            'notes': f'Edited {next(counter)}', 'amount': rng.randint(20, 2000)})
+
+    def cold(function, *args):
+        """Call a cached helper without its cache, to time the query itself"""
+        def call():
+            invalidate_user_cache(user_id)
+            function(*args)
+        return call
+
+    return {
+        'dup_user': lambda: queries.dup_user(user['username']),
+        'get_user': lambda: queries.get_user(user['username']),
+        'user_details': lambda: queries.user_details(user_id),
+        'edit_user': lambda: queries.edit_user(dict(user)),
+        'dup_proj': lambda: queries.dup_proj(name, user_id),
+        'get_last_ten': lambda: queries.get_last_ten(user_id),
+        'get_single': lambda: queries.get_single(proj_id),
+        'get_project': lambda: queries.get_project(user_id, name),
+        'get_page': lambda: queries.get_page(user_id),
+        'get_names': cold(queries.get_names, user_id),
+        'facet_counts': cold(queries.facet_counts, user_id),
+        'get_all': lambda: queries.get_all(user_id),
+        'add_new_project': add_new_project,
+        'del_rec': del_rec,
+        'edit_project': edit_project,
+    }
+
+
+def time_cases(cases, calls):
+    """
+    Call each helper a number of times
+
+    :return:
+        *dict* : helper name -> (middle milliseconds per call, round trips
+            per call)
+    """
+    results = {}
+
+    for helper, call in cases.items():
+        times = []
+        _round_trips[0] = 0
+
+        for _ in range(calls):
+            start = perf_counter()
+            call()
+            times.append(perf_counter() - start)
+
+        results[helper] = (median(times) * 1000, _round_trips[0] / calls)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', default='10,100,1000,5000',
+                        help='projects the user has at each step')
+    parser.add_argument('--calls', type=int, default=50,
+                        help='calls of each helper at each step')
+    parser.add_argument('--growth', type=float, default=3,
+                        help='how many times slower a helper can get')
+    parser.add_argument('--other-users', type=int, default=20)
+    parser.add_argument('--database', default=None)
+    args = parser.parse_args()
+
+    if args.database:
+        app.config['SQLALCHEMY_DATABASE_URI'] = args.database
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    rng = random.Random(0)
+    results = {}
+
+    with app.app_context():
+        run_migrations()
+
+        # Other users' projects share the tables, like on the live site
+        for number in range(args.other_users):
+            other_id = add_user(f'other{number}')
+            add_projects([make_project(other_id, i, rng, [None])
+                          for i in range(max(sizes) // 10)])
+
+        user_id = add_user('main')
+        have = 0
+
+        for size in sizes:
+            add_projects([make_project(user_id, i, rng, [None])
+                          for i in range(have, size)])
+            have = size
+
+            results[size] = time_cases(make_cases(user_id, rng, size),
+                                       args.calls)
+
+    helpers = list(results[sizes[0]])
+    print('Middle milliseconds per call (round trips per call) by the number '
+          'of projects the user has\n')
+    print(f'{"helper":<18}' + ''.join(f'{size:>16}' for size in sizes))
+
+    flagged = []
+
+    for helper in helpers:
+        print(f'{helper:<18}' + ''.join(
+            f'{results[size][helper][0]:>9.2f} ({results[size][helper][1]:>3.0f})'
+            for size in sizes), end='')
+
+        (first_ms, first_trips), (last_ms, last_trips) = \
+            results[sizes[0]][helper], results[sizes[-1]][helper]
+
+        if helper in GROWS_WITH_PROJECTS:
+            print('  grows by design')
+
+        elif last_trips > first_trips or last_ms > first_ms * args.growth:
+            flagged.append(helper)
+            print(f'  FLAGGED: {last_ms / first_ms:.1f}x slower')
+
+        else:
+            print()
+
+    if flagged:
+        sys.exit(f'\nThese helpers get slower as the projects grow: '
+                 f'{", ".join(flagged)}')
+
+
+if __name__ == '__main__':
+    main()
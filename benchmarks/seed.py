@@ -0,0 +1,165 @@
+"""
+Fill a database with made up users and projects for the load test.
+
+Every user gets the same password, "benchmark", and projects named
+    "Project 0", "Project 1" and so on, with details, colors, glitters and
+    images like the ones crafters upload. The images are picked from a set of
+    made up photos of the chosen size, saved once each like real uploads.
+
+Usage:
+    python benchmarks/seed.py [--users 1000] [--projects 500] [--images 50]
+        [--image-kb 300] [--database URI]
+
+Without --database the SQLite file shared with load_test.py is used. Pass the
+    same uri to both scripts to test against Postgres. Seed an empty database,
+    the made up usernames can only be added once.
+"""
+import argparse
+from io import BytesIO
+import os
+import random
+import sys
+import tempfile
+from time import perf_counter
+
+from sqlalchemy import insert, select
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_model import DB, User  # noqa: E402
+from helpers import RESULT_SCALES  # noqa: E402
+from images import store_image  # noqa: E402
+from passwords import hash_password  # noqa: E402
+from queries import add_projects  # noqa: E402
+
+# The database used by both seed.py and load_test.py when none is given
+DEFAULT_DATABASE = 'sqlite:///' + os.path.join(tempfile.gettempdir(),
+                                               'resin_load_test.db')
+# The password of every made up user
+PASSWORD = 'benchmark'
+
+BRANDS = ['ArtResin', 'Let\'s Resin', 'Amazing Clear Cast', 'Pro Marine',
+          'Craft Resin', 'Resin Obsession', 'TotalBoat']
+RESIN_TYPES = ['Epoxy', 'Deep Pour Epoxy', 'UV Resin', 'Polyester']
+COLORS = ['Red', 'Ocean Blue', 'Gold', 'Pearl White', 'Black', 'Teal', 'Purple',
+          'Emerald', 'Copper', 'Rose Gold']
+COLOR_TYPES = ['Mica Powder', 'Alcohol Ink', 'Pigment Paste', 'Liquid Dye']
+GLITTERS = ['Holographic', 'Silver Flake', 'Gold Chunky', 'Iridescent']
+GLITTER_TYPES = ['Chunky', 'Fine', 'Flake']
+NOTES = ['Poured in two layers and torched the bubbles out.',
+         'Demolded early and the bottom was still a little soft.',
+         'Added the ink last for the cells, came out great.',
+         'Too cold in the garage, lots of micro bubbles.']
+
+
+def make_image(size_kb, rng):
+    """
+    Make a JPEG photo of about size_kb kilobytes
+
+    Random noise is used so the image does not compress to less than asked for.
+    """
+    from PIL import Image as PILImage
+
+    # Noise takes about 1.5 bytes per pixel as a JPEG
+    side = max(16, int((size_kb * 1024 / 1.5) ** 0.5))
+    noise = rng.randbytes(side * side * 3)
+    buffer = BytesIO()
+    PILImage.frombytes('RGB', (side, side), noise).save(buffer, 'JPEG',
+                                                        quality=85)
+    return buffer.getvalue()
+
+
+def make_project(user_id, number, rng, images):
+    """
+    Make a project dictionary, with the keys used by add_new_project
+    """
+    colors = rng.sample(COLORS, rng.randint(0, 3))
+    glitters = rng.sample(GLITTERS, rng.randint(0, 2))
+
+    return {
+        'user_id': user_id, 'name': f'Project {number}',
+        'mold_img': rng.choice(images), 'mold_img_type': 'jpeg',
+        'res_img': rng.choice(images), 'res_img_type': 'jpeg',
+        'resin_brand': rng.choice(BRANDS), 'resin_type': rng.choice(RESIN_TYPES),
+        'amt': rng.randint(20, 2000), 'unit': rng.choice(['Grams', 'Ounces']),
+        'colors': ', '.join(colors),
+        'color_amts': ', '.join(str(rng.randint(1, 5)) for _ in colors),
+        'color_types': ', '.join(rng.choice(COLOR_TYPES) for _ in colors),
+        'glitters': ', '.join(glitters),
+        'glitter_amts': ', '.join(str(rng.randint(1, 3)) for _ in glitters),
+        'glitter_types': ', '.join(rng.choice(GLITTER_TYPES) for _ in glitters),
+        'time_to_pour_hrs': 0, 'time_to_pour_mins': rng.randint(3, 20),
+        'pouring_time_hrs': 0, 'pouring_time_mins': rng.randint(2, 15),
+        'time_to_demold_hrs': rng.randint(12, 72), 'time_to_demold_mins': 0,
+        'start_temp': rng.randint(65, 80), 'start_temp_unit': 'Fahrenheit',
+        'end_temp': rng.randint(18, 27), 'end_temp_unit': 'Celsius',
+        'demold_temp': rng.randint(65, 80), 'demold_temp_unit': 'Fahrenheit',
+        'result_scale': rng.choice(RESULT_SCALES), 'notes': rng.choice(NOTES),
+    }
+
+
+def seed(users, projects, images, image_kb, rng):
+    """
+    Add the made up users, images and projects; run in an app context
+
+    :return:
+        *dict* : the number of each kind of row added
+    """
+    # Hashing once for everyone keeps seeding fast
+    password = hash_password(PASSWORD)
+    DB.session.execute(insert(User), [
+        {'first': 'Load', 'last': f'Tester {i}', 'username': f'user{i}',
+         'password': password, 'email': f'user{i}@example.com'}
+        for i in range(users)])
+    DB.session.commit()
+
+    user_ids = [user_id for user_id, in DB.session.execute(select(User.id).where(
+        User.username.in_([f'user{i}' for i in range(users)])).order_by(User.id))]
+    DB.session.close()
+
+    # Each image is saved once, with its resized copies, like an upload
+    keys = [store_image(make_image(image_kb, rng), 'image/jpeg')
+            for _ in range(images)]
+
+    for user_id in user_ids:
+        add_projects([make_project(user_id, number, rng, keys)
+                      for number in range(projects)])
+
+    return {'users': len(user_ids), 'projects': len(user_ids) * projects,
+            'images': len(keys)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--projects', type=int, default=500,
+                        help='projects for each user')
+    parser.add_argument('--images', type=int, default=50,
+                        help='number of different images to pick from')
+    parser.add_argument('--image-kb', type=int, default=300,
+                        help='size of each image in kilobytes')
+    parser.add_argument('--database', default=DEFAULT_DATABASE)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # The app reads these when it is imported
+    os.environ['DATABASE_URI'] = args.database
+    os.environ['SESSION_BACKEND'] = 'memory'
+
+    from app import app
+    from migrations import run_migrations
+
+    start = perf_counter()
+
+    with app.app_context():
+        run_migrations()
+        counts = seed(args.users, args.projects, args.images, args.image_kb,
+                      random.Random(args.seed))
+
+    print(f'Added {counts["users"]} users, {counts["projects"]} projects and '
+          f'{counts["images"]} images of about {args.image_kb} KB '
+          f'in {perf_counter() - start:.0f}s')
+
+
+if __name__ == '__main__':
+    main()
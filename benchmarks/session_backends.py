@@ -0,0 +1,115 @@
+"""
+Benchmark the time each session backend adds to a request.
+
+Every backend is run against the same small Flask app, with one route that
+    only reads the session (a normal page view) and one that changes it (like
+    logging in). Flask's own signed cookie sessions are used as the baseline.
+
+Usage:
+    python benchmarks/session_backends.py [--requests 2000] [--database URI]
+
+Without --database a temporary SQLite database is used, pass a Postgres uri
+    to see the cost of the database backend over the network.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from statistics import mean, quantiles
+from time import perf_counter
+
+from flask import Flask, session
+from flask.sessions import SecureCookieSessionInterface
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_model import DB  # noqa: E402
+from sessions import init_sessions  # noqa: E402
+
+
+def make_app(database_uri, session_dir):
+    """
+    Create the app used to time the backends
+    """
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SESSION_FILE_DIR'] = session_dir
+    app.secret_key = 'benchmark'
+    DB.init_app(app)
+
+    @app.route('/read')
+    def read():
+        return str(session.get('user_id'))
+
+    @app.route('/write')
+    def write():
+        session['user_id'] = session.get('user_id', 0) + 1
+        return ''
+
+    with app.app_context():
+        DB.create_all()
+
+    return app
+
+
+def time_requests(client, path, count):
+    """
+    Time `count` requests to a path, in microseconds each
+    """
+    timings = []
+
+    for _ in range(count):
+        start = perf_counter()
+        client.get(path)
+        timings.append((perf_counter() - start) * 1e6)
+
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--database', default=None)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    database_uri = args.database or f'sqlite:///{work_dir}/sessions.db'
+    app = make_app(database_uri, os.path.join(work_dir, 'flask_session'))
+
+    results = {}
+
+    for backend in ('cookie', 'memory', 'database', 'filesystem'):
+        if backend == 'cookie':
+            app.session_interface = SecureCookieSessionInterface()
+        else:
+            app.config['SESSION_BACKEND'] = backend
+            init_sessions(app)
+
+        client = app.test_client()
+        # Warm up, and start a session for the reads to load
+        time_requests(client, '/write', 50)
+        time_requests(client, '/read', 50)
+
+        results[backend] = {
+            path: time_requests(client, f'/{path}', args.requests)
+            for path in ('read', 'write')
+        }
+
+    shutil.rmtree(work_dir)
+
+    baseline = {path: mean(results['cookie'][path]) for path in ('read', 'write')}
+
+    print(f'{"backend":<12}{"route":<8}{"mean us":>10}{"p95 us":>10}'
+          f'{"overhead us":>14}')
+
+    for backend, paths in results.items():
+        for path, timings in paths.items():
+            print(f'{backend:<12}{path:<8}{mean(timings):>10.1f}'
+                  f'{quantiles(timings, n=20)[-1]:>10.1f}'
+                  f'{mean(timings) - baseline[path]:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
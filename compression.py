@@ -0,0 +1,165 @@
+"""
+Compression of the responses sent by the app, since gunicorn and the Heroku
+    router both send pages exactly as the app gives them.
+
+Brotli is used when the browser accepts it and the brotli package is
+    installed, gzip otherwise. Streamed responses, like the all projects page,
+    are compressed a piece at a time as they are sent.
+"""
+import zlib
+
+from flask import request
+
+# Brotli makes smaller pages than gzip, but gzip is always there to fall back on
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Types of responses worth compressing, images are already compressed
+COMPRESS_TYPES = ('text/html', 'text/css', 'text/plain', 'text/csv',
+                  'text/javascript', 'application/javascript',
+                  'application/json', 'image/svg+xml', 'image/x-icon')
+# Responses smaller than this many bytes are sent as they are, since the
+#   compressed copy would not be much smaller
+COMPRESS_MIN_SIZE = 500
+# The gzip level (1-9) and brotli quality (0-11); both trade CPU for size
+COMPRESS_LEVEL = 6
+COMPRESS_BR_LEVEL = 5
+
+
+class Compressor:
+    """
+    A streaming gzip or brotli compressor with the same methods for either
+    """
+
+    def __init__(self, encoding, level, br_level):
+        self.encoding = encoding
+
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=br_level)
+        else:
+            # wbits of 16 + 15 writes the gzip header and trailer
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        """Compress part of the response, returning what is ready to send"""
+        if self.encoding == 'br':
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def flush(self):
+        """Everything compressed so far, so the browser can show it already"""
+        if self.encoding == 'br':
+            return self._compressor.flush()
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        """The end of the compressed response"""
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+def choose_encoding(accept_encodings):
+    """
+    Pick the best compression the browser accepts
+
+    :param
+        - accept_encodings : *Accept* : the parsed Accept-Encoding header
+
+    :return:
+        *str* : "br" or "gzip"; None if the browser accepts neither
+    """
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return accept_encodings.best_match(offered)
+
+
+def compress_stream(chunks, compressor):
+    """
+    Compress the pieces of a streamed response as they are made
+
+    :param
+        - chunks     : *iterable*   : the pieces of the response
+        - compressor : *Compressor* : the compressor to use
+
+    :return:
+        *generator* : the compressed pieces
+    """
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+
+            data = compressor.compress(chunk) + compressor.flush()
+
+            if data:
+                yield data
+
+        yield compressor.finish()
+
+    finally:
+        # Let the original response clean up, ie. close a file
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def init_compression(app):
+    """
+    Compress the responses of the app.
+
+    This has to be set up before any other after_request functions, since
+        Flask runs them in the reverse order and this needs to run last.
+
+    :param
+        - app : *Flask* : the application to compress the responses of
+    """
+    app.config.setdefault('COMPRESS_TYPES', COMPRESS_TYPES)
+    app.config.setdefault('COMPRESS_MIN_SIZE', COMPRESS_MIN_SIZE)
+    app.config.setdefault('COMPRESS_LEVEL', COMPRESS_LEVEL)
+    app.config.setdefault('COMPRESS_BR_LEVEL', COMPRESS_BR_LEVEL)
+
+    @app.after_request
+    def compress_response(response):
+        # Only whole responses of the right type can be compressed
+        if response.status_code != 200 or request.method == 'HEAD' or \
+                response.mimetype not in app.config['COMPRESS_TYPES'] or \
+                'Content-Encoding' in response.headers or \
+                'no-transform' in response.headers.get('Cache-Control', ''):
+            return response
+
+        # Caches need to keep a copy for each encoding
+        response.vary.add('Accept-Encoding')
+
+        encoding = choose_encoding(request.accept_encodings)
+
+        if encoding is None:
+            return response
+
+        compressor = Compressor(encoding, app.config['COMPRESS_LEVEL'],
+                                app.config['COMPRESS_BR_LEVEL'])
+
+        if response.is_streamed or response.direct_passthrough:
+            # The length is not known until the whole response has been sent
+            response.response = compress_stream(response.response, compressor)
+            response.direct_passthrough = False
+            response.headers.pop('Content-Length', None)
+
+        else:
+            data = response.get_data()
+
+            if len(data) < app.config['COMPRESS_MIN_SIZE']:
+                return response
+
+            response.set_data(compressor.compress(data) + compressor.finish())
+
+        response.headers['Content-Encoding'] = encoding
+
+        # The compressed bytes are not the same as the original, but they are
+        #   still the same page
+        etag, weak = response.get_etag()
+
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+
+        return response
@@ -1,4 +1,9 @@
+from datetime import datetime
+from sqlite3 import Connection as SQLiteConnection
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 # from .app import app
 
@@ -6,6 +11,15 @@ from flask_sqlalchemy import SQLAlchemy
 DB = SQLAlchemy()
 
 
+# SQLite only follows the foreign keys, including ON DELETE CASCADE, when asked
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, SQLiteConnection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys = ON')
+        cursor.close()
+
+
 # Create table class for the user data
 class User(DB.Model):
     """
@@ -50,28 +64,38 @@ class Project(DB.Model):
             name the user entered for the project
                 - each project name must be unique to user
         - *mold_img*:
-            BLOB data for image of mold used for project
+            SHA-256 key of the mold image in the image table
         - *mold_img_type*:
             the type of image of mold used for project
         - *result_img*:
-            BLOB data for image of the resulting project
-        - *mold_img*:
+            SHA-256 key of the result image in the image table
+        - *result_img_type*:
             the type of image of the resulting project
         - *notes*:
             any additional notes user entered
         - *user_id*:
             links to the user who created the project
                 - Many-to-One relationship to the user table
+        - *updated_at*:
+            when the project or its details were last added or changed
+                - used as the version of the project's pages for caching
     """
     id = DB.Column(DB.Integer, primary_key=True)
     name = DB.Column(DB.String, nullable=False)
-    mold_img = DB.Column(DB.Text)
+    mold_img = DB.Column(DB.String(64))
     mold_img_type = DB.Column(DB.String)
-    result_img = DB.Column(DB.Text)
+    result_img = DB.Column(DB.String(64))
     result_img_type = DB.Column(DB.String)
     notes = DB.Column(DB.String)
     user_id = DB.Column(DB.Integer, DB.ForeignKey('user.id'), nullable=False)
     user = DB.relationship('User', backref=DB.backref('project', lazy=True))
+    updated_at = DB.Column(DB.DateTime, default=datetime.utcnow)
+
+    # Lets the pages and names of a user's projects be read from the indexes
+    #   - the database makes sure each project name is unique to the user
+    __table_args__ = (DB.Index('ix_project_user_id_id', 'user_id', 'id'),
+                      DB.Index('uq_project_user_id_name', 'user_id', 'name',
+                               unique=True))
 
     def __repr__(self):
         return '<Project %r>' % self.name
@@ -85,6 +109,10 @@ class Details(DB.Model):
         - *project_id*:
             links to the rest of the details of the project
                 - One-to-One relationship to the project table
+                - removed by the database when the project is removed
+        - *user_id*:
+            the user_id of the project, copied here so a user's projects can
+            be read in the order of the indexes below
         - *resin_brand*:
             the brand of resin the user used for the project
         - *resin_type*:
@@ -131,9 +159,18 @@ class Details(DB.Model):
             room temperature when de-molding
         - *demold_temp_unit*:
             unit of de-molding room temperature
+        - *amount_g*, *amount_ml*:
+            the amount of resin in grams and in milliliters, worked out from
+            the amount and unit by units.py so amounts can be compared
+        - *start_temp_c*, *end_temp_c*, *demold_temp_c*:
+            each room temperature in degrees Celsius, worked out by units.py
+        - *time_to_pour_total*, *pouring_time_total*, *time_to_demold_total*:
+            each time in minutes, from its hours and minutes by units.py
     """
-    project_id = DB.Column(DB.Integer, DB.ForeignKey('project.id'), primary_key=True, nullable=False)
-    id = DB.relationship('Project', backref=DB.backref('details', lazy=True))
+    project_id = DB.Column(DB.Integer, DB.ForeignKey('project.id', ondelete='CASCADE'), primary_key=True, nullable=False)
+    id = DB.relationship('Project', backref=DB.backref(
+        'details', lazy=True, cascade='all, delete-orphan', passive_deletes=True))
+    user_id = DB.Column(DB.Integer)
     resin_brand = DB.Column(DB.String)
     resin_type = DB.Column(DB.String)
     amount = DB.Column(DB.Integer)
@@ -157,6 +194,285 @@ class Details(DB.Model):
     end_temp_unit = DB.Column(DB.String)
     demold_temp = DB.Column(DB.Integer)
     demold_temp_unit = DB.Column(DB.String)
+    amount_g = DB.Column(DB.Float)
+    amount_ml = DB.Column(DB.Float)
+    start_temp_c = DB.Column(DB.Float)
+    end_temp_c = DB.Column(DB.Float)
+    demold_temp_c = DB.Column(DB.Float)
+    time_to_pour_total = DB.Column(DB.Integer)
+    pouring_time_total = DB.Column(DB.Integer)
+    time_to_demold_total = DB.Column(DB.Integer)
+
+    # Lets a page of one user's projects be sorted or filtered by amount,
+    #   starting temperature or cure time, read in the order of its user_id
+    #   index, which holds the exact expression from queries.SORT_COLUMNS
+    __table_args__ = (DB.Index('ix_details_user_id_amount_g', user_id,
+                               DB.func.coalesce(amount_g, -1), project_id),
+                      DB.Index('ix_details_user_id_start_temp_c', user_id,
+                               DB.func.coalesce(start_temp_c, -1000),
+                               project_id),
+                      DB.Index('ix_details_user_id_time_to_demold_total',
+                               user_id, time_to_demold_total, project_id))
 
     def __repr__(self):
         return '<Details %r>' % self.project_id
+
+
+# Create a table class for each color used in a project
+class ProjectColor(DB.Model):
+    """
+    project_color table column definitions:
+
+        - *project_id*:
+            links to the project the color was used in
+                - Many-to-One relationship to the project table
+                - removed by the database when the project is removed
+        - *position*:
+            the order the color was listed in, starting at 0
+        - *name*:
+            the color the user used, ie. "Ocean Blue"
+        - *amount*:
+            the amount of the color used, as the user entered it
+        - *type*:
+            the type of colorant, ie. "Mica Powder"
+
+    The rows are split from the comma separated colors, color_amts and
+        color_types of the details table whenever those are saved.
+    """
+    project_id = DB.Column(DB.Integer, DB.ForeignKey('project.id', ondelete='CASCADE'),
+                           primary_key=True)
+    position = DB.Column(DB.Integer, primary_key=True)
+    name = DB.Column(DB.String)
+    amount = DB.Column(DB.String)
+    type = DB.Column(DB.String)
+    project = DB.relationship('Project', backref=DB.backref(
+        'project_colors', lazy=True, order_by=position,
+        cascade='all, delete-orphan', passive_deletes=True))
+
+    # Find the projects that used a color or type of colorant, in any case
+    __table_args__ = (
+        DB.Index('ix_project_color_name', DB.func.lower(name), project_id),
+        DB.Index('ix_project_color_type', DB.func.lower(type), project_id),
+    )
+
+    def __repr__(self):
+        return '<ProjectColor %r>' % self.name
+
+
+# Create a table class for each glitter used in a project
+class ProjectGlitter(DB.Model):
+    """
+    project_glitter table column definitions:
+
+        - *project_id*:
+            links to the project the glitter was used in
+                - Many-to-One relationship to the project table
+                - removed by the database when the project is removed
+        - *position*:
+            the order the glitter was listed in, starting at 0
+        - *name*:
+            the glitter the user used, ie. "Holographic Silver"
+        - *amount*:
+            the amount of the glitter used, as the user entered it
+        - *type*:
+            the type of glitter, ie. "Chunky"
+
+    The rows are split from the comma separated glitters, glitter_amts and
+        glitter_types of the details table whenever those are saved.
+    """
+    project_id = DB.Column(DB.Integer, DB.ForeignKey('project.id', ondelete='CASCADE'),
+                           primary_key=True)
+    position = DB.Column(DB.Integer, primary_key=True)
+    name = DB.Column(DB.String)
+    amount = DB.Column(DB.String)
+    type = DB.Column(DB.String)
+    project = DB.relationship('Project', backref=DB.backref(
+        'project_glitters', lazy=True, order_by=position,
+        cascade='all, delete-orphan', passive_deletes=True))
+
+    # Find the projects that used a glitter or type of glitter, in any case
+    __table_args__ = (
+        DB.Index('ix_project_glitter_name', DB.func.lower(name), project_id),
+        DB.Index('ix_project_glitter_type', DB.func.lower(type), project_id),
+    )
+
+    def __repr__(self):
+        return '<ProjectGlitter %r>' % self.name
+
+
+# Create a table class for the uploaded image data
+class Image(DB.Model):
+    """
+    image table column definitions:
+
+        - *hash*:
+            SHA-256 hex digest of the image bytes
+                - images are stored once no matter how many projects use them
+        - *data*:
+            the raw bytes of the uploaded image
+        - *mimetype*:
+            the full mimetype of the image, ie. "image/png"
+        - *size*:
+            the size of the image in bytes
+    """
+    hash = DB.Column(DB.String(64), primary_key=True)
+    data = DB.Column(DB.LargeBinary, nullable=False)
+    mimetype = DB.Column(DB.String, nullable=False)
+    size = DB.Column(DB.Integer, nullable=False)
+
+    def __repr__(self):
+        return '<Image %r>' % self.hash
+
+
+# Create a table class for the resized copies of the uploaded images
+class ImageVariant(DB.Model):
+    """
+    image_variant table column definitions:
+
+        - *hash*:
+            SHA-256 key of the original image in the image table
+                - Many-to-One relationship to the image table
+        - *size*:
+            name of the size the image was resized to, ie. "thumb" or "medium"
+        - *data*:
+            the raw bytes of the resized image
+        - *mimetype*:
+            the full mimetype of the resized image
+    """
+    hash = DB.Column(DB.String(64), DB.ForeignKey('image.hash'),
+                     primary_key=True)
+    size = DB.Column(DB.String(16), primary_key=True)
+    data = DB.Column(DB.LargeBinary, nullable=False)
+    mimetype = DB.Column(DB.String, nullable=False)
+
+    def __repr__(self):
+        return '<ImageVariant %r %r>' % (self.hash, self.size)
+
+
+# Create a table class for the server side session data
+class UserSession(DB.Model):
+    """
+    user_session table column definitions:
+
+        - *id*:
+            the random session id saved in the user's cookie
+        - *data*:
+            the pickled contents of the session
+        - *expiry*:
+            when the session stops being valid
+                - indexed so expired sessions can be removed in batches
+    """
+    id = DB.Column(DB.String(255), primary_key=True)
+    data = DB.Column(DB.LargeBinary, nullable=False)
+    expiry = DB.Column(DB.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return '<UserSession %r>' % self.id
+
+
+# Create a table class for the groups of projects the insights are made for
+class InsightGroup(DB.Model):
+    """
+    insight_group table column definitions:
+
+        - *group_by*:
+            the details column the projects are grouped by, ie. "resin_brand"
+                - "all" for the group of every project
+        - *group_key*:
+            the lower case value of the column shared by the projects
+        - *label*:
+            the value of the column as most users wrote it, to show on the page
+        - *projects*:
+            the number of projects in the group
+        - *users*:
+            the number of different users with projects in the group
+        - *id_sum*:
+            the sum of the project ids in the group
+                - with projects and last_updated, shows if the group changed
+        - *last_updated*:
+            the latest updated_at of the projects in the group
+        - *refreshed_at*:
+            when the insights for the group were last worked out
+    """
+    group_by = DB.Column(DB.String(32), primary_key=True)
+    group_key = DB.Column(DB.String, primary_key=True)
+    label = DB.Column(DB.String)
+    projects = DB.Column(DB.Integer, nullable=False)
+    users = DB.Column(DB.Integer, nullable=False)
+    id_sum = DB.Column(DB.BigInteger, nullable=False)
+    last_updated = DB.Column(DB.DateTime)
+    refreshed_at = DB.Column(DB.DateTime, nullable=False)
+
+    def __repr__(self):
+        return '<InsightGroup %r %r>' % (self.group_by, self.group_key)
+
+
+# Create a table class for the insights on each measurement of a group
+class InsightMetric(DB.Model):
+    """
+    insight_metric table column definitions:
+
+        - *group_by*, *group_key*:
+            the group of projects the numbers are for
+                - removed by the database when the group is removed
+        - *metric*:
+            the measurement, ie. "cure_time" in minutes or "start_temp" in
+                degrees Celsius
+        - *count*:
+            the number of projects in the group with the measurement recorded
+        - *mean*, *p10*, *p25*, *p50*, *p75*, *p90*:
+            the average and percentiles of the measurement
+        - *corr_result*:
+            the correlation of the measurement with the result scale
+                - negative means higher values went with better results,
+                  since 1 is the best result
+    """
+    group_by = DB.Column(DB.String(32), primary_key=True)
+    group_key = DB.Column(DB.String, primary_key=True)
+    metric = DB.Column(DB.String(32), primary_key=True)
+    count = DB.Column(DB.Integer, nullable=False)
+    mean = DB.Column(DB.Float)
+    p10 = DB.Column(DB.Float)
+    p25 = DB.Column(DB.Float)
+    p50 = DB.Column(DB.Float)
+    p75 = DB.Column(DB.Float)
+    p90 = DB.Column(DB.Float)
+    corr_result = DB.Column(DB.Float)
+
+    __table_args__ = (
+        DB.ForeignKeyConstraint(
+            [group_by, group_key],
+            ['insight_group.group_by', 'insight_group.group_key'],
+            ondelete='CASCADE'),
+    )
+
+    def __repr__(self):
+        return '<InsightMetric %r %r %r>' % (self.group_by, self.group_key,
+                                            self.metric)
+
+
+# Create a table class for the feature vector of each project
+class ProjectFeature(DB.Model):
+    """
+    project_feature table column definitions:
+
+        - *project_id*:
+            the project the vector was made from
+                - removed by the database when the project is removed
+        - *user_id*:
+            the user who added the project
+                - indexed so all of a user's vectors can be loaded at once
+        - *version*:
+            the recommend.FEATURE_VERSION the vector was made with
+        - *vector*:
+            the float32 bytes of the vector, see recommend.py
+    """
+    project_id = DB.Column(DB.Integer, DB.ForeignKey('project.id', ondelete='CASCADE'),
+                           primary_key=True)
+    user_id = DB.Column(DB.Integer, DB.ForeignKey('user.id'), nullable=False,
+                        index=True)
+    version = DB.Column(DB.Integer, nullable=False)
+    vector = DB.Column(DB.LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return '<ProjectFeature %r>' % self.project_id
@@ -0,0 +1,98 @@
+"""
+Writers for the project exports, each turning batches of rows into pieces of
+    the file as they are read, so an export of any size only ever holds one
+    batch in memory.
+"""
+import csv
+from datetime import datetime
+from io import StringIO
+import json
+
+# Spreadsheets run text starting with these as formulas
+FORMULA_STARTS = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _cell(value):
+    """A value made safe to open in a spreadsheet"""
+    if isinstance(value, str) and value.startswith(FORMULA_STARTS):
+        return "'" + value
+    return value
+
+
+def _value(value):
+    """A value that can be written as JSON"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def csv_export(batches, columns, image_url=None):
+    """
+    Write batches of rows as a CSV file, one piece per batch
+
+    :param
+        - batches   : *iterable* : lists of rows with the given columns
+        - columns   : *tuple*    : names of the columns, the image columns last
+        - image_url : *function* : turns an image key into a link; None to
+                                   leave the images out
+
+    :return:
+        *generator* : the pieces of the CSV file
+    """
+    # Leave out the image columns unless they are linked
+    count = len(columns) if image_url else len(columns) - 2
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+
+    # The header is sent before the projects are queried
+    writer.writerow(columns[:count])
+    yield buffer.getvalue()
+
+    for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+
+        for row in batch:
+            values = [_cell(value) for value in row[:len(columns) - 2]]
+
+            if image_url:
+                values += [image_url(key) if key else '' for key in row[-2:]]
+
+            writer.writerow(values)
+
+        yield buffer.getvalue()
+
+
+def json_export(batches, columns, image_url=None):
+    """
+    Write batches of rows as a JSON list of objects, one piece per batch
+
+    :param
+        - batches   : *iterable* : lists of rows with the given columns
+        - columns   : *tuple*    : names of the columns, the image columns last
+        - image_url : *function* : turns an image key into a link; None to
+                                   leave the images out
+
+    :return:
+        *generator* : the pieces of the JSON file
+    """
+    yield '['
+    first = True
+
+    for batch in batches:
+        pieces = []
+
+        for row in batch:
+            project = {col: _value(value)
+                       for col, value in zip(columns[:-2], row)}
+
+            if image_url:
+                project.update({col: image_url(key) if key else None
+                                for col, key in zip(columns[-2:], row[-2:])})
+
+            pieces.append(('\n' if first else ',\n') + json.dumps(project))
+            first = False
+
+        yield ''.join(pieces)
+
+    yield '\n]\n'
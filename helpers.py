@@ -1,5 +1,12 @@
-from flask import redirect, render_template, request, session
-from functools import wraps
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import timezone
+from flask import Response, current_app, get_flashed_messages, redirect, \
+    render_template, request, session, stream_with_context
+from functools import lru_cache, wraps
+from hashlib import sha256
+import json
+import os
+import re
 
 
 def apology(message, code=400):
@@ -31,3 +38,205 @@ def login_required(f):
     return decorated_function
 
 
+
+
+# The result scale choices on the add form, from the best result to the worst
+RESULT_SCALES = ('1 - Nailed It!', '2 - Almost There',
+                 '3 - Just Okay but Needs some Improvement',
+                 '4 - Needs a lot of Improvement', '5 - Completely Bombed it!')
+
+
+def result_score(value):
+    """
+    The number at the start of a result scale, the way the add form saves it
+
+    :param
+        - value : *str* : a saved result scale, ie. "1 - Nailed It!"
+
+    :return:
+        *int* : the number from 1 (the best result) to 5; None if there is none
+
+    >>> result_score('1 - Nailed It!'), result_score('5 - Completely Bombed it!')
+    (1, 5)
+    >>> result_score('3'), result_score(4), result_score(' 2 - Almost There')
+    (3, 4, 2)
+    >>> result_score('None'), result_score(None), result_score('12'), result_score('')
+    (None, None, None, None)
+    """
+    match = re.match(r'\s*([1-5])(?!\d)', str(value)) if value is not None \
+        else None
+
+    return int(match.group(1)) if match else None
+
+
+def encode_cursor(sort, cursor):
+    """
+    Turn a page cursor into a string that can be used in a url.
+
+    :param
+        - sort   : *str*   : the key in SORT_COLUMNS the page is sorted by
+        - cursor : *tuple* : (sort value, project id) of the last row on a page
+
+    :return:
+        *str* : url safe version of the cursor, with the sort it was made for
+    """
+    return urlsafe_b64encode(json.dumps([sort, *cursor]).encode('utf-8')
+                             ).decode('utf-8')
+
+
+def decode_cursor(value, sort, number=False):
+    """
+    Turn a cursor from a url back into a page cursor.
+
+    The cursor is only used for the sort it was made for, so its value is
+        never compared to a column of another type.
+
+    :param
+        - value  : *str*  : url safe cursor made by encode_cursor
+        - sort   : *str*  : the key in SORT_COLUMNS the page is sorted by
+        - number : *bool* : True if the sort column holds numbers, not text
+
+    :return:
+        *tuple* : (sort value, project id); None if the cursor is not valid
+            or was made for a different sort
+    """
+    try:
+        cursor_sort, sort_key, proj_id = json.loads(
+            urlsafe_b64decode(value.encode('utf-8')))
+
+    except (ValueError, TypeError):
+        return None
+
+    # True and False are ints too, but no sort column holds them, and every
+    #   sort column turns NULLs into a value so no real cursor holds None
+    kind = (int, float) if number else str
+    if cursor_sort != sort or isinstance(sort_key, bool) or \
+            not isinstance(sort_key, kind) or type(proj_id) is not int:
+        return None
+
+    return sort_key, proj_id
+
+
+def file_version(path):
+    """
+    Get a short fingerprint of a file's contents, for versioned urls.
+
+    :param
+        - path : *str* : path to the file
+
+    :return:
+        *str* : first 12 characters of the SHA-256 of the file; empty if the
+            file does not exist
+    """
+    try:
+        stat = os.stat(path)
+
+    except OSError:
+        return ''
+
+    # Only read the file again when it has been changed
+    return _hash_file(path, stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=256)
+def _hash_file(path, mtime, size):
+    """Hash a file's contents, cached for each version of the file"""
+    with open(path, 'rb') as f:
+        return sha256(f.read()).hexdigest()[:12]
+
+
+def directory_version(path):
+    """
+    Get a short fingerprint of every file in a directory, ie. the templates
+
+    :param
+        - path : *str* : path to the directory
+
+    :return:
+        *str* : first 12 characters of a SHA-256 over all the files
+    """
+    digest = sha256()
+
+    for root, _, files in sorted(os.walk(path)):
+        for name in sorted(files):
+            digest.update(file_version(os.path.join(root, name)).encode('utf-8'))
+
+    return digest.hexdigest()[:12]
+
+
+def not_modified(etag, last_modified=None):
+    """
+    Check if the browser's saved copy of a page is still current, so the
+        page does not need to be rendered again.
+
+    :param
+        - etag          : *str*      : the version of the page
+        - last_modified : *datetime* : when the page last changed, in UTC
+
+    :return:
+        *bool* : True if the browser can use its saved copy
+    """
+    # Pages with a message waiting to be shown always need to be rendered
+    if session.get('_flashes'):
+        return False
+
+    # Compressed pages are sent with a weak copy of the tag
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+
+    if request.if_modified_since and last_modified:
+        # The header only goes down to the second
+        changed = last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+        return changed <= request.if_modified_since
+
+    return False
+
+
+def set_validators(response, etag, last_modified=None):
+    """
+    Add the headers the browser needs to ask if a page has changed
+
+    :param
+        - response      : *Response* : the page, or a 304 response
+        - etag          : *str*      : the version of the page
+        - last_modified : *datetime* : when the page last changed, in UTC
+
+    :return:
+        *Response* : the response with the headers added
+    """
+    response.set_etag(etag)
+
+    if last_modified:
+        response.last_modified = last_modified.replace(tzinfo=timezone.utc)
+
+    # The browser can keep the page, but has to check it is current each time
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+# Number of template pieces put together before each part of a streamed page
+#   is sent, so each part is big enough to compress well
+STREAM_BUFFER = 200
+
+
+def stream_template(template_name, **context):
+    """
+    Render a template a part at a time as it is sent, so a large page can
+        start showing before it has all been rendered.
+
+    :param
+        - template_name : *str* : name of the template to render
+        - context       : variables to pass to the template
+
+    :return:
+        *Response* : the streamed page
+    """
+    # The session is saved before the page is sent, so the messages have to
+    #   be taken out of it now instead of by the template
+    get_flashed_messages()
+
+    current_app.update_template_context(context)
+    stream = current_app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(STREAM_BUFFER)
+
+    return Response(stream_with_context(stream), mimetype='text/html')
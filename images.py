@@ -0,0 +1,326 @@
+"""
+Content addressed storage for the project images
+"""
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from io import BytesIO
+from string import hexdigits
+from threading import Lock
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from db_model import DB, Image, ImageVariant
+
+# Pillow is only needed to make the resized copies, without it the pages
+#   fall back to the original images
+try:
+    from PIL import Image as PILImage, ImageOps
+except ImportError:
+    PILImage = None
+
+# The largest width and height for each resized copy of an image
+#   - thumb is twice the size shown in the project tables for sharp screens
+IMAGE_SIZES = {'thumb': (140, 100), 'medium': (800, 800)}
+
+# The first bytes of each type of image that can be uploaded, and its mimetype
+#   - (offset, bytes) pairs must all match
+IMAGE_SIGNATURES = (
+    (((0, b'\xff\xd8\xff'),), 'image/jpeg'),
+    (((0, b'\x89PNG\r\n\x1a\n'),), 'image/png'),
+    (((0, b'GIF87a'),), 'image/gif'),
+    (((0, b'GIF89a'),), 'image/gif'),
+    (((0, b'RIFF'), (8, b'WEBP')), 'image/webp'),
+    (((0, b'BM'),), 'image/bmp'),
+)
+# Number of bytes read from the start of a file to tell its type
+SNIFF_BYTES = 16
+
+# Threads making the resized copies after the upload has been saved, so the
+#   request does not wait for the image to be decoded and resized
+#   - copies still waiting when a worker stops are made by
+#     "flask backfill-thumbnails"
+_executor = None
+_executor_lock = Lock()
+
+
+def is_image_key(value):
+    """
+    Check if a value stored in a project image column is an image store key
+
+    :param
+        - value : *str* : value from the mold_img or result_img column
+
+    :return:
+        *bool* : True if the value is a SHA-256 hex digest; False if not
+    """
+    return bool(value) and len(value) == 64 and all(
+        char in hexdigits for char in value)
+
+
+def file_key(stream, chunk_size=65536):
+    """
+    Get the image key for an uploaded file without reading it all into memory
+
+    :param
+        - stream     : *file* : the uploaded file, which must be seekable
+        - chunk_size : *int*  : number of bytes to read at a time
+
+    :return:
+        *str* : the key the image would be saved under
+    """
+    digest = sha256()
+
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        digest.update(chunk)
+
+    # Put the file back to the start so it can still be saved
+    stream.seek(0)
+
+    return digest.hexdigest()
+
+
+def sniff_mimetype(header):
+    """
+    Tell the type of an image from its first bytes, instead of trusting the
+        type sent by the browser
+
+    :param
+        - header : *bytes* : at least the first SNIFF_BYTES bytes of the file
+
+    :return:
+        *str* : the mimetype of the image; None if it is not a type we accept
+    """
+    for signature, mimetype in IMAGE_SIGNATURES:
+        if all(header[offset:offset + len(magic)] == magic
+               for offset, magic in signature):
+            return mimetype
+
+    return None
+
+
+def _image_saved(key):
+    """Check if an image is already saved under a key"""
+    return DB.session.query(Image.hash).filter(
+        Image.hash == key).first() is not None
+
+
+def _add_image(key, data, mimetype):
+    """
+    Save the bytes of an image under its key
+
+    :return:
+        *bool* : True if this call saved the image; False if another request
+            saved it first
+    """
+    try:
+        DB.session.add(Image(hash=key, data=data, mimetype=mimetype,
+                             size=len(data)))
+        DB.session.commit()
+
+    except IntegrityError:
+        # Another request saved the same image first, which is fine
+        DB.session.rollback()
+        return False
+
+    return True
+
+
+def store_image(data, mimetype):
+    """
+    Add an image to the image table, keyed by the SHA-256 of its bytes
+
+    :param
+        - data     : *bytes* : the raw bytes of the image
+        - mimetype : *str*   : the full mimetype of the image, ie. "image/png"
+
+    :return:
+        *str* : the key to save in the project table for this image
+    """
+    key = sha256(data).hexdigest()
+
+    # The same bytes only ever need to be saved once
+    if not _image_saved(key) and _add_image(key, data, mimetype):
+        # Make the resized copies once, while we still have the bytes
+        store_variants(key, data)
+
+    return key
+
+
+def upload_mimetype(upload):
+    """
+    Tell the type of an uploaded image from its first bytes
+
+    :param
+        - upload : *FileStorage* : the uploaded file from request.files
+
+    :return:
+        *str* : the mimetype of the image, ie. "image/png"
+
+    :raises:
+        ValueError : if the file is not a type of image we accept
+    """
+    stream = upload.stream
+    mimetype = sniff_mimetype(stream.read(SNIFF_BYTES))
+    stream.seek(0)
+
+    if mimetype is None:
+        raise ValueError('Images must be JPEG, PNG, GIF, WebP or BMP files.')
+
+    return mimetype
+
+
+def store_upload(upload):
+    """
+    Add an uploaded image to the image table, and make its resized copies in
+        the background.
+
+    The upload is hashed in chunks and only read into memory when it is not
+        saved already. Werkzeug keeps large uploads in a temporary file rather
+        than in memory, and MAX_CONTENT_LENGTH limits how big they can be.
+
+    :param
+        - upload : *FileStorage* : the uploaded file from request.files
+
+    :return:
+        *tuple* : (key to save in the project table, mimetype of the image)
+
+    :raises:
+        ValueError : if the file is not a type of image we accept
+    """
+    mimetype = upload_mimetype(upload)
+    stream = upload.stream
+    key = file_key(stream)
+
+    # The file is only read into memory when it is a new image
+    if not _image_saved(key) and _add_image(key, stream.read(), mimetype):
+        process_in_background(key)
+
+    return key, mimetype
+
+
+def process_in_background(key):
+    """
+    Make the resized copies of a saved image on one of the background threads
+
+    :param
+        - key : *str* : SHA-256 key of the original image
+    """
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=current_app.config.get('IMAGE_WORKERS', 2),
+                thread_name_prefix='images')
+
+    _executor.submit(_make_variants, current_app._get_current_object(), key)
+
+
+def _make_variants(app, key):
+    """Make and save the resized copies of an image, run on a background thread"""
+    with app.app_context():
+        try:
+            # Read the bytes back, so the request did not have to keep them
+            image = get_image(key)
+
+            if image is not None:
+                store_variants(key, image.data)
+
+        except Exception:
+            # The original is shown until the copies are made by a backfill
+            app.logger.exception(f'Could not make the resized copies of {key}')
+
+
+def make_variants(data):
+    """
+    Resize an image to each of the sizes in IMAGE_SIZES
+
+    :param
+        - data : *bytes* : the raw bytes of the original image
+
+    :return:
+        *dict* : size name -> JPEG bytes; empty if the image can not be resized
+    """
+    if PILImage is None:
+        return {}
+
+    try:
+        original = PILImage.open(BytesIO(data))
+        # Turn the image the way the camera was held before resizing
+        original = ImageOps.exif_transpose(original).convert('RGB')
+
+    except (OSError, ValueError, PILImage.DecompressionBombError):
+        # Not an image Pillow can read, the original will be shown instead
+        return {}
+
+    variants = {}
+
+    for size, box in IMAGE_SIZES.items():
+        resized = original.copy()
+        resized.thumbnail(box)
+
+        buffer = BytesIO()
+        resized.save(buffer, 'JPEG', quality=80, optimize=True)
+        variants[size] = buffer.getvalue()
+
+    return variants
+
+
+def store_variants(key, data):
+    """
+    Add the resized copies of an image to the image_variant table
+
+    :param
+        - key  : *str*   : SHA-256 key of the original image
+        - data : *bytes* : the raw bytes of the original image
+
+    :return:
+        *int* : the number of resized copies saved
+    """
+    variants = make_variants(data)
+
+    for size, resized in variants.items():
+        DB.session.merge(ImageVariant(hash=key, size=size, data=resized,
+                                      mimetype='image/jpeg'))
+
+    DB.session.commit()
+
+    return len(variants)
+
+
+def get_image(key):
+    """
+    Query to get a single image from the image table
+
+    :param
+        - key : *str* : SHA-256 key of the image
+
+    :return:
+        row with the image data and mimetype; None if not found
+    """
+    image = DB.session.query(Image.data, Image.mimetype).filter(
+        Image.hash == key).first()
+
+    DB.session.close()
+
+    return image
+
+
+def get_variant(key, size):
+    """
+    Query to get a single resized copy of an image
+
+    :param
+        - key  : *str* : SHA-256 key of the original image
+        - size : *str* : name of the size needed, ie. "thumb"
+
+    :return:
+        row with the image data and mimetype; None if not found
+    """
+    variant = DB.session.query(ImageVariant.data, ImageVariant.mimetype).filter(
+        ImageVariant.hash == key, ImageVariant.size == size).first()
+
+    DB.session.close()
+
+    return variant
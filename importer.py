@@ -0,0 +1,248 @@
+"""
+Import many projects at once from a CSV or JSON file, ie. from a spreadsheet
+    of past pours or a file made by the export.
+
+Each row or object uses the same names as the fields of the add project form,
+    ie. "name", "amount", "color" and "demolding_time_hrs". The column names
+    of the export, ie. "colors" and "time_to_demold_hrs", work too, so an
+    exported file can be imported again. Images are not imported.
+"""
+import csv
+from io import TextIOWrapper
+import json
+
+from sqlalchemy.exc import IntegrityError
+
+from helpers import RESULT_SCALES, result_score
+from queries import add_new_project, add_projects, get_names, picked
+
+# The most rows one file can have
+MAX_IMPORT_ROWS = 20000
+# Rows added per transaction, so an error only undoes its own batch
+IMPORT_BATCH_SIZE = 500
+
+# The project dictionary keys used by add_new_project, and the names each can
+#   be given in a file: the add form's field name first, then the others
+FIELD_NAMES = {
+    'name': ('name',),
+    'resin_brand': ('resin_brand',),
+    'resin_type': ('resin_type',),
+    'amt': ('amount', 'amt'),
+    'unit': ('unit',),
+    'colors': ('color', 'colors'),
+    'color_amts': ('color_amt', 'color_amts'),
+    'color_types': ('color_types',),
+    'glitters': ('glitter', 'glitters'),
+    'glitter_amts': ('glitter_amt', 'glitter_amts'),
+    'glitter_types': ('glitter_types',),
+    'time_to_pour_hrs': ('time_to_pour_hrs',),
+    'time_to_pour_mins': ('time_to_pour_mins',),
+    'pouring_time_hrs': ('pouring_time_hrs',),
+    'pouring_time_mins': ('pouring_time_mins',),
+    'time_to_demold_hrs': ('demolding_time_hrs', 'time_to_demold_hrs'),
+    'time_to_demold_mins': ('demolding_time_mins', 'time_to_demold_mins'),
+    'start_temp': ('start_temp',),
+    'start_temp_unit': ('start_temp_unit',),
+    'end_temp': ('end_temp',),
+    'end_temp_unit': ('end_temp_unit',),
+    'demold_temp': ('demold_temp',),
+    'demold_temp_unit': ('demold_temp_unit',),
+    'result_scale': ('res_scale', 'result_scale'),
+    'notes': ('notes',),
+}
+
+# Keys saved as whole numbers, with 0 when left blank like the add form
+INT_FIELDS = ('amt', 'time_to_pour_hrs', 'time_to_pour_mins',
+              'pouring_time_hrs', 'pouring_time_mins', 'time_to_demold_hrs',
+              'time_to_demold_mins', 'start_temp', 'end_temp', 'demold_temp')
+# The smallest and largest whole numbers the database columns can hold
+INT_RANGE = (-2 ** 31, 2 ** 31 - 1)
+# The choices on the add form for the temperature units
+TEMP_UNITS = ('Fahrenheit', 'Celsius')
+# The choices on the add form for the unit of the amount of resin, by the
+#   names a file can use for each, written without case
+#   - older projects were also saved with the plural names
+UNITS = {name.lower(): unit for unit in (
+    'Grams', 'Ounces', 'Milliliters', 'Quart', 'Pint', 'Teaspoon',
+    'Tablespoon', 'Gallon', 'Other') for name in (unit, unit.rstrip('s') + 's')}
+
+# The export puts a quote before text that would run as a spreadsheet formula
+FORMULA_STARTS = ("'=", "'+", "'-", "'@")
+
+
+class ImportFileError(Exception):
+    """
+    A file that can not be imported at all, ie. it is not valid JSON
+    """
+
+
+def read_rows(stream, file_type):
+    """
+    Read the rows of an uploaded file
+
+    :param
+        - stream    : *file* : the file, opened in binary mode
+        - file_type : *str*  : "csv" or "json"
+
+    :return:
+        *list* : a dictionary for each row
+
+    :raises:
+        ImportFileError : if the file can not be read
+    """
+    try:
+        if file_type == 'csv':
+            rows = list(csv.DictReader(TextIOWrapper(stream, encoding='utf-8-sig')))
+
+        elif file_type == 'json':
+            rows = json.load(stream)
+
+            if not isinstance(rows, list) or \
+                    not all(isinstance(row, dict) for row in rows):
+                raise ImportFileError('The JSON file must be a list of projects.')
+
+        else:
+            raise ImportFileError('Only csv and json files can be imported.')
+
+    except (UnicodeDecodeError, csv.Error, ValueError) as e:
+        raise ImportFileError(f'The file could not be read: {e}')
+
+    if len(rows) > MAX_IMPORT_ROWS:
+        raise ImportFileError(
+            f'A file can have at most {MAX_IMPORT_ROWS} projects.')
+
+    return rows
+
+
+def _text(value):
+    """A value from a file as stripped text; None if blank"""
+    if value is None:
+        return None
+
+    value = str(value).strip()
+
+    # Undo the quote the export adds before formulas
+    if value.startswith(FORMULA_STARTS):
+        value = value[1:]
+
+    return value or None
+
+
+def clean_rows(rows, user_id, existing_names=()):
+    """
+    Check every row and turn it into a project dictionary for add_projects
+
+    :param
+        - rows           : *list* : dictionaries read from the file
+        - user_id        : *int*  : id of the user the projects are added for
+        - existing_names : *set*  : names the user already has projects with
+
+    :return:
+        *tuple* : (list of (row number, project dictionary) for the valid rows,
+            list of (row number, error message) for the others); row numbers
+            start at 1
+    """
+    projects, errors = [], []
+    seen = set(existing_names)
+
+    for number, row in enumerate(rows, start=1):
+        project = {'user_id': user_id, 'mold_img': None, 'mold_img_type': None,
+                   'res_img': None, 'res_img_type': None}
+        problems = []
+
+        for key, names in FIELD_NAMES.items():
+            # Use the first of the names the row has a value for
+            value = next((value for value in map(_text, map(row.get, names))
+                          if value is not None), None)
+
+            if key in INT_FIELDS:
+                try:
+                    # Whole numbers can be written like "12.0" by spreadsheets
+                    value = int(float(value)) if value is not None else 0
+                except (ValueError, OverflowError):
+                    problems.append(f'{names[0]} must be a whole number')
+                else:
+                    if not INT_RANGE[0] <= value <= INT_RANGE[1]:
+                        problems.append(f'{names[0]} must be between '
+                                        f'{INT_RANGE[0]} and {INT_RANGE[1]}')
+
+            project[key] = value
+
+        if project['name'] is None:
+            problems.append('name is required')
+        elif project['name'] in seen:
+            problems.append(f'a project named "{project["name"]}" already exists')
+
+        # The unit is saved the way the add form writes it, so its amount can
+        #   be turned into grams and milliliters by units.py
+        project['unit'] = picked('unit', project['unit'])
+
+        if project['unit'] is not None:
+            if project['unit'].lower() in UNITS:
+                project['unit'] = UNITS[project['unit'].lower()]
+            else:
+                problems.append('unit must be one of the choices on the add '
+                                'form, ie. Grams or Ounces')
+
+        for key in ('start_temp_unit', 'end_temp_unit', 'demold_temp_unit'):
+            if project[key] is not None and project[key] not in TEMP_UNITS:
+                problems.append(f'{key} must be Fahrenheit or Celsius')
+
+        # The scale is saved the way the add form saves it, ie. both "1" and
+        #   "1 - Nailed It!" are saved as "1 - Nailed It!"; the form's "None"
+        #   from older exports is saved as nothing
+        project['result_scale'] = picked('result_scale',
+                                         project['result_scale'])
+
+        if project['result_scale'] is not None:
+            score = result_score(project['result_scale'])
+
+            if score is None:
+                problems.append('res_scale must be 1, 2, 3, 4 or 5, '
+                                'ie. "1 - Nailed It!"')
+            else:
+                project['result_scale'] = RESULT_SCALES[score - 1]
+
+        if problems:
+            errors.append((number, '; '.join(problems)))
+        else:
+            seen.add(project['name'])
+            projects.append((number, project))
+
+    return projects, errors
+
+
+def import_projects(rows, user_id, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Check and add the projects read from a file, a batch per transaction
+
+    :param
+        - rows       : *list* : dictionaries read from the file
+        - user_id    : *int*  : id of the user the projects are added for
+        - batch_size : *int*  : number of projects added per transaction
+
+    :return:
+        *tuple* : (number of projects added, list of (row number, error message)
+            for the rows that were not added, in order)
+    """
+    existing = {name for _, name in get_names(user_id)}
+    projects, errors = clean_rows(rows, user_id, existing)
+    added = 0
+
+    for start in range(0, len(projects), batch_size):
+        batch = projects[start:start + batch_size]
+
+        try:
+            added += len(add_projects([project for _, project in batch]))
+
+        except IntegrityError:
+            # Something in the batch was added by someone else at the same
+            #   time, so add its rows one at a time to find out which
+            for number, project in batch:
+                if add_new_project(project) is None:
+                    errors.append((number, f'a project named '
+                                           f'"{project["name"]}" already exists'))
+                else:
+                    added += 1
+
+    return added, sorted(errors)
@@ -0,0 +1,222 @@
+"""
+Per request database instrumentation, shown in the response headers when
+    debugging and as Prometheus metrics on the /metrics endpoint, which is
+    only served once METRICS_TOKEN is set.
+
+Every worker process keeps its own numbers, so with more than one gunicorn
+    worker each scrape of /metrics only sees the worker that answered it.
+"""
+from hmac import compare_digest
+from threading import Lock
+from time import perf_counter
+
+from flask import Response, abort, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+from db_model import DB
+
+# Upper bounds of the histogram buckets for times, in seconds
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                2.5, 5.0, 10.0)
+# Upper bounds of the histogram buckets for the number of queries
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    """
+    A Prometheus histogram with one set of buckets per endpoint
+    """
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._values = {}  # endpoint -> [bucket counts, sum, count]
+        self._lock = Lock()
+
+    def observe(self, endpoint, value):
+        """
+        Add a single value to the histogram for an endpoint
+        """
+        with self._lock:
+            counts, total, count = self._values.get(
+                endpoint, ([0] * len(self.buckets), 0.0, 0))
+
+            counts = [n + (value <= bound)
+                      for n, bound in zip(counts, self.buckets)]
+            self._values[endpoint] = (counts, total + value, count + 1)
+
+    def render(self):
+        """
+        The histogram in the Prometheus text format
+        """
+        lines = [f'# HELP {self.name} {self.description}',
+                 f'# TYPE {self.name} histogram']
+
+        with self._lock:
+            for endpoint, (counts, total, count) in sorted(self._values.items()):
+                label = f'endpoint="{endpoint}"'
+
+                for bound, n in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {n}')
+
+                lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {count}')
+                lines.append(f'{self.name}_sum{{{label}}} {total}')
+                lines.append(f'{self.name}_count{{{label}}} {count}')
+
+        return lines
+
+
+REQUEST_TIME = Histogram('rch_request_duration_seconds',
+                         'Time to answer each request', TIME_BUCKETS)
+DB_QUERIES = Histogram('rch_db_queries_per_request',
+                       'Database round trips made by each request',
+                       COUNT_BUCKETS)
+DB_TIME = Histogram('rch_db_time_seconds',
+                    'Total time spent in the database by each request',
+                    TIME_BUCKETS)
+POOL_WAIT = Histogram('rch_db_pool_checkout_wait_seconds',
+                      'Time spent waiting for a connection from the pool',
+                      TIME_BUCKETS)
+
+
+class TimedQueuePool(QueuePool):
+    """
+    The default connection pool, timing how long each checkout waits
+    """
+
+    def _do_get(self):
+        start = perf_counter()
+
+        try:
+            return super()._do_get()
+
+        finally:
+            wait = perf_counter() - start
+            endpoint = request.endpoint if has_request_context() else None
+            POOL_WAIT.observe(endpoint or 'none', wait)
+
+            if has_request_context() and 'db_stats' in g:
+                g.db_stats['pool_wait'] += wait
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query_timer(conn, cursor, statement, parameters, context,
+                       executemany):
+    conn.info.setdefault('query_start', []).append(perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _stop_query_timer(conn, cursor, statement, parameters, context,
+                      executemany):
+    elapsed = perf_counter() - conn.info['query_start'].pop()
+
+    # Queries run outside of a request, like the CLI commands, are not counted
+    if not has_request_context() or 'db_stats' not in g:
+        return
+
+    stats = g.db_stats
+    stats['queries'] += 1
+    stats['time'] += elapsed
+
+    if elapsed > stats['slowest_time']:
+        stats['slowest_time'] = elapsed
+        stats['slowest'] = statement
+
+
+@event.listens_for(Engine, 'handle_error')
+def _drop_query_timer(context):
+    # A statement that fails never reaches after_cursor_execute, so its start
+    #   time would be left on the pooled connection
+    timers = context.connection is not None and \
+        context.statement is not None and \
+        context.connection.info.get('query_start')
+
+    if timers:
+        timers.pop()
+
+
+def init_metrics(app):
+    """
+    Start recording the database use of every request made to the app
+
+    :param
+        - app : *Flask* : the application to record the requests of
+    """
+
+    @app.before_request
+    def start_request_stats():
+        g.request_start = perf_counter()
+        g.db_stats = {'queries': 0, 'time': 0.0, 'pool_wait': 0.0,
+                      'slowest_time': 0.0, 'slowest': None}
+
+    @app.after_request
+    def record_request_stats(response):
+        # Nothing to record if the request failed before it started
+        if 'db_stats' not in g:
+            return response
+
+        endpoint = request.endpoint or 'none'
+        stats = g.db_stats
+
+        REQUEST_TIME.observe(endpoint, perf_counter() - g.request_start)
+        DB_QUERIES.observe(endpoint, stats['queries'])
+        DB_TIME.observe(endpoint, stats['time'])
+
+        # Show the numbers for each page while debugging
+        if app.debug or app.config.get('DB_METRICS_HEADERS'):
+            response.headers['X-DB-Queries'] = str(stats['queries'])
+            response.headers['X-DB-Time-ms'] = f'{stats["time"] * 1000:.2f}'
+            response.headers['X-DB-Pool-Wait-ms'] = \
+                f'{stats["pool_wait"] * 1000:.2f}'
+
+            if stats['slowest']:
+                response.headers['X-DB-Slowest-ms'] = \
+                    f'{stats["slowest_time"] * 1000:.2f}'
+                # Headers can not hold new lines, and only the start is needed
+                response.headers['X-DB-Slowest'] = \
+                    ' '.join(stats['slowest'].split())[:200]
+
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        """
+        All the recorded numbers in the Prometheus text format
+        """
+        token = app.config.get('METRICS_TOKEN')
+
+        # The page names, traffic and query times are not for the public, so
+        #   there is no page here at all until a token has been set
+        if not token:
+            abort(404)
+
+        # Only let in the scraper holding the token
+        #   - as bytes, since compare_digest refuses text that is not ASCII
+        if not compare_digest(
+                request.headers.get('Authorization', '').encode('utf-8'),
+                f'Bearer {token}'.encode('utf-8')):
+            abort(401)
+
+        lines = []
+
+        for histogram in (REQUEST_TIME, DB_QUERIES, DB_TIME, POOL_WAIT):
+            lines.extend(histogram.render())
+
+        # The current state of the connection pool, if it keeps one
+        pool = DB.engine.pool
+
+        if isinstance(pool, QueuePool):
+            for name, value, description in (
+                    ('size', pool.size(), 'Connections the pool keeps open'),
+                    ('checked_out', pool.checkedout(), 'Connections in use'),
+                    ('overflow', pool.overflow(),
+                     'Connections open past the pool size')):
+                lines.append(f'# HELP rch_db_pool_{name} {description}')
+                lines.append(f'# TYPE rch_db_pool_{name} gauge')
+                lines.append(f'rch_db_pool_{name} {value}')
+
+        return Response('\n'.join(lines) + '\n',
+                        mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,415 @@
+"""
+Migrations to bring a database created by an older version of the
+application up to date with the current models.
+
+Every migration checks what has already been done before changing anything,
+so it is safe to run ``flask migrate`` after every deploy.
+"""
+from base64 import b64decode
+from binascii import Error as Base64Error
+
+from sqlalchemy import bindparam, insert, inspect, text
+from sqlalchemy.schema import CreateIndex
+
+from db_model import DB, Details
+from queries import COLORANTS, SELECT_COLUMNS, split_colorants
+from images import is_image_key, store_image, get_image, store_variants
+from recommend import index_all_features
+from search import create_search_index, index_all_projects
+from units import GRAMS_PER_UNIT, MILLILITERS_PER_UNIT, SOURCE_COLUMNS, \
+    TEMP_UNITS, canonical_values
+
+
+def create_tables():
+    """
+    Create any tables that do not exist in the database yet
+    """
+    DB.create_all()
+    DB.session.commit()
+
+
+def add_columns():
+    """
+    Add any columns on the models that are missing from existing tables.
+
+    The new columns are added without NOT NULL or defaults, which not every
+        database can add to a table that already has rows, and are filled in
+        by the migrations that follow.
+    """
+    inspector = inspect(DB.engine)
+
+    for table in DB.metadata.sorted_tables:
+        existing = {col['name'] for col in inspector.get_columns(table.name)}
+
+        for column in table.columns:
+            if column.name not in existing:
+                col_type = column.type.compile(dialect=DB.engine.dialect)
+                DB.session.execute(text(
+                    f'ALTER TABLE "{table.name}" '
+                    f'ADD COLUMN "{column.name}" {col_type}'))
+
+    DB.session.commit()
+    DB.session.close()
+
+
+def project_versions():
+    """
+    Give every project without one a version, so its pages can be cached
+    """
+    DB.session.execute(text(
+        """
+        UPDATE "project"
+        SET updated_at = CURRENT_TIMESTAMP
+        WHERE updated_at IS NULL;
+        """))
+    DB.session.commit()
+    DB.session.close()
+
+
+def unique_project_names():
+    """
+    Rename any projects that share a name with an older project of the same
+        user, so the unique index on user_id and name can be created.
+    """
+    dups = DB.engine.execute(text(
+        """
+        SELECT p.id, p.name
+        FROM "project" p
+        WHERE EXISTS (
+            SELECT 1
+            FROM "project" o
+            WHERE o.user_id = p.user_id AND o.name = p.name AND o.id < p.id
+        );
+        """)).all()
+
+    for proj_id, name in dups:
+        DB.session.execute(text(
+            'UPDATE "project" SET name = :name WHERE id = :id'),
+            {'name': f'{name} ({proj_id})', 'id': proj_id})
+
+    # The index on user_id and name was not unique before
+    DB.session.execute(text('DROP INDEX IF EXISTS ix_project_user_id_name'))
+
+    DB.session.commit()
+    DB.session.close()
+
+
+def cascade_project_details():
+    """
+    Make the database remove a project's details when the project is removed
+    """
+    if DB.engine.dialect.name == 'postgresql':
+        for fk in inspect(DB.engine).get_foreign_keys('details'):
+            if fk['referred_table'] == 'project' and \
+                    fk['options'].get('ondelete', '').upper() != 'CASCADE':
+                DB.session.execute(text(
+                    f"""
+                    ALTER TABLE "details"
+                    DROP CONSTRAINT "{fk['name']}",
+                    ADD CONSTRAINT "{fk['name']}" FOREIGN KEY (project_id)
+                        REFERENCES "project" (id) ON DELETE CASCADE;
+                    """))
+
+    elif DB.engine.dialect.name == 'sqlite':
+        create_sql = DB.engine.execute(text(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'details'"
+        )).scalar()
+
+        # SQLite can not change a foreign key, so the table is copied into a
+        #   new one made from the current model
+        if 'ON DELETE CASCADE' not in create_sql.upper():
+            columns = ', '.join(
+                col['name'] for col in inspect(DB.engine).get_columns('details'))
+            DB.session.execute(text('ALTER TABLE "details" RENAME TO "details_old"'))
+            DB.metadata.tables['details'].create(bind=DB.session.connection())
+            DB.session.execute(text(
+                f'INSERT INTO "details" ({columns}) SELECT {columns} FROM "details_old"'))
+            DB.session.execute(text('DROP TABLE "details_old"'))
+
+    DB.session.commit()
+    DB.session.close()
+
+
+def details_user_ids():
+    """
+    Copy the user_id of every project to its details row, so a user's projects
+        can be sorted by the (user_id, ...) indexes on the details table
+    """
+    DB.session.execute(text(
+        """
+        UPDATE "details"
+        SET user_id = (
+            SELECT p.user_id FROM "project" p WHERE p.id = details.project_id
+        )
+        WHERE user_id IS NULL;
+        """))
+
+    # These indexes could not give one user's projects in order, and are
+    #   replaced by the ones on user_id, or were not used by any query and
+    #   only slowed down every write
+    for index in ('ix_details_amount_g', 'ix_details_start_temp_c',
+                  'ix_details_time_to_demold_total', 'ix_details_amount_ml',
+                  'ix_details_end_temp_c', 'ix_details_demold_temp_c',
+                  'ix_details_time_to_pour_total',
+                  'ix_details_pouring_time_total'):
+        DB.session.execute(text(f'DROP INDEX IF EXISTS {index}'))
+
+    DB.session.commit()
+    DB.session.close()
+
+
+def create_indexes():
+    """
+    Create any indexes on the models that do not exist in the database yet
+    """
+    for table in DB.metadata.sorted_tables:
+        for index in table.indexes:
+            # SQLAlchemy can not see indexes on expressions, like lower(name),
+            #   so let the database check instead
+            create = str(CreateIndex(index).compile(dialect=DB.engine.dialect))
+            DB.session.execute(text(
+                create.replace(' INDEX ', ' INDEX IF NOT EXISTS ', 1)))
+
+    DB.session.commit()
+    DB.session.close()
+
+
+def images_to_store(batch_size=50):
+    """
+    Move the base64 encoded images in the project table into the image table,
+        leaving only the image key behind in the project table.
+
+    :param
+        - batch_size : *int* : number of project rows to convert per commit
+    """
+    last_id = 0  # Keep track of where the last batch ended
+
+    while True:
+        rows = DB.engine.execute(text(
+            """
+            SELECT id, mold_img, mold_img_type, result_img, result_img_type
+            FROM "project"
+            WHERE id > :last_id
+            ORDER BY id
+            LIMIT :limit;
+            """), last_id=last_id, limit=batch_size).all()
+
+        if not rows:
+            break
+
+        for row in rows:
+            mold_key = _image_to_key(row['mold_img'], row['mold_img_type'])
+            result_key = _image_to_key(row['result_img'], row['result_img_type'])
+
+            # Only write to the rows that still hold base64 data
+            if mold_key != row['mold_img'] or result_key != row['result_img']:
+                DB.session.execute(text(
+                    """
+                    UPDATE "project"
+                    SET mold_img = :mold_img, result_img = :result_img
+                    WHERE id = :id;
+                    """), {'mold_img': mold_key, 'result_img': result_key,
+                           'id': row['id']})
+
+        # Commit the changes for this batch of projects
+        DB.session.commit()
+        last_id = rows[-1]['id']
+
+    DB.session.close()
+
+
+def colorants_to_tables(batch_size=500):
+    """
+    Split the comma separated colors and glitters of the projects saved
+        before they had their own tables into the project_color and
+        project_glitter tables.
+
+    :param
+        - batch_size : *int* : number of projects to split per commit
+    """
+    for model, columns in COLORANTS.values():
+        last_id = 0  # Keep track of where the last batch ended
+
+        while True:
+            rows = DB.engine.execute(text(
+                f"""
+                SELECT d.project_id, {', '.join(f'd.{col}' for col in columns)}
+                FROM "details" d
+                WHERE d.project_id > :last_id
+                    AND NOT EXISTS (
+                        SELECT 1 FROM "{model.__tablename__}" c
+                        WHERE c.project_id = d.project_id
+                    )
+                ORDER BY d.project_id
+                LIMIT :limit;
+                """), last_id=last_id, limit=batch_size).all()
+
+            if not rows:
+                break
+
+            new_rows = [dict(colorant, project_id=row[0])
+                        for row in rows for colorant in split_colorants(*row[1:])]
+
+            # Add the rows for the whole batch at once
+            if new_rows:
+                DB.session.execute(insert(model), new_rows)
+            DB.session.commit()
+
+            last_id = rows[-1][0]
+
+    DB.session.close()
+
+
+def normalize_units(batch_size=500):
+    """
+    Fill in the amounts in grams and milliliters, the temperatures in Celsius
+        and the times in minutes of the projects saved before they had those
+        columns.
+
+    :param
+        - batch_size : *int* : number of projects to fill in per commit
+    """
+    last_id = 0  # Keep track of where the last batch ended
+    update = Details.__table__.update().where(
+        Details.project_id == bindparam('pid'))
+
+    # Only pick the rows with a value that can be worked out, so the ones
+    #   with a unit that can not be turned into grams or Celsius, ie. "Other",
+    #   are not picked again on every migration
+    select = text(
+        f"""
+        SELECT d.project_id, {', '.join(f'd.{col}' for col in SOURCE_COLUMNS)}
+        FROM "details" d
+        WHERE d.project_id > :last_id
+            AND ((d.amount_g IS NULL AND d.amount <> 0
+                    AND d.unit IN :amount_units)
+                OR (d.start_temp_c IS NULL AND d.start_temp IS NOT NULL
+                    AND d.start_temp_unit IN :temp_units)
+                OR (d.end_temp_c IS NULL AND d.end_temp IS NOT NULL
+                    AND d.end_temp_unit IN :temp_units)
+                OR (d.demold_temp_c IS NULL AND d.demold_temp IS NOT NULL
+                    AND d.demold_temp_unit IN :temp_units)
+                OR d.time_to_pour_total IS NULL
+                OR d.pouring_time_total IS NULL
+                OR d.time_to_demold_total IS NULL)
+        ORDER BY d.project_id
+        LIMIT :limit;
+        """).bindparams(bindparam('amount_units', expanding=True),
+                        bindparam('temp_units', expanding=True))
+
+    while True:
+        rows = DB.engine.execute(
+            select, last_id=last_id, limit=batch_size,
+            amount_units=list(GRAMS_PER_UNIT) + list(MILLILITERS_PER_UNIT),
+            temp_units=list(TEMP_UNITS)).all()
+
+        if not rows:
+            break
+
+        # Update the whole batch at once
+        DB.session.execute(update, [
+            dict(canonical_values(row._mapping), pid=row.project_id)
+            for row in rows])
+        DB.session.commit()
+
+        last_id = rows[-1].project_id
+
+    DB.session.close()
+
+
+def unpicked_selects():
+    """
+    Save nothing instead of "None" in the details columns of the selects that
+        were left on "Select One", the way new projects are saved
+    """
+    for column in SELECT_COLUMNS:
+        DB.session.execute(text(
+            f'UPDATE "details" SET {column} = NULL WHERE {column} = \'None\''))
+
+    DB.session.commit()
+    DB.session.close()
+
+
+def _image_to_key(value, img_type):
+    """
+    Store a base64 encoded image and get its image key
+
+    :param
+        - value    : *str* : base64 data or key from the project table
+        - img_type : *str* : the type of image saved with the project, ie. "png"
+
+    :return:
+        *str* : the image key, or the value unchanged if there is nothing to move
+    """
+    if not value or is_image_key(value):
+        return value
+
+    try:
+        data = b64decode(value, validate=True)
+
+    except (Base64Error, ValueError):
+        # Not an image we can recover, so the project will show no image
+        return None
+
+    # Older rows saved only the part after the slash, ie. "png"
+    if img_type and '/' not in img_type:
+        img_type = f'image/{img_type}'
+
+    return store_image(data, img_type or 'image/jpeg')
+
+
+def backfill_variants(batch_size=20):
+    """
+    Make the resized copies for every image that does not have them yet
+
+    :param
+        - batch_size : *int* : number of images to look up at a time
+
+    :return:
+        *int* : the number of images that were resized
+    """
+    last_hash = ''  # Keep track of where the last batch ended
+    resized = 0
+
+    while True:
+        keys = DB.engine.execute(text(
+            """
+            SELECT i.hash
+            FROM "image" i
+            WHERE i.hash > :last_hash
+                AND NOT EXISTS (
+                    SELECT 1 FROM "image_variant" v WHERE v.hash = i.hash
+                )
+            ORDER BY i.hash
+            LIMIT :limit;
+            """), last_hash=last_hash, limit=batch_size).all()
+
+        if not keys:
+            break
+
+        # Load one image at a time so only one is ever held in memory
+        for key, in keys:
+            if store_variants(key, get_image(key).data):
+                resized += 1
+
+        last_hash = keys[-1][0]
+
+    DB.session.close()
+
+    return resized
+
+
+# All the migrations, in the order they need to be run
+MIGRATIONS = [create_tables, add_columns, project_versions,
+              unique_project_names, cascade_project_details, details_user_ids,
+              create_indexes, images_to_store, create_search_index,
+              index_all_projects, colorants_to_tables, index_all_features,
+              normalize_units, unpicked_selects]
+
+
+def run_migrations():
+    """
+    Run every migration in order
+    """
+    for migration in MIGRATIONS:
+        migration()
@@ -0,0 +1,164 @@
+"""
+Password hashing on a small pool of worker processes.
+
+Hashing a password is slow on purpose, so it is done in other processes
+    instead of the one answering requests. Each worker only lets a few hashes
+    wait at once; when that many are already waiting, the next login is turned
+    away straight away with PasswordsBusy instead of holding up the worker.
+
+The settings are read from the app config:
+
+    - *PASSWORD_METHOD*  : the werkzeug hash method and cost of new hashes,
+                           ie. "pbkdf2:sha256:260000"
+    - *PASSWORD_WORKERS* : processes hashing for each worker; 0 hashes in the
+                           request, ie. while developing
+    - *PASSWORD_QUEUE*   : the most hashes each worker lets run or wait at once
+"""
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from threading import BoundedSemaphore, Lock
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash, \
+    DEFAULT_PBKDF2_ITERATIONS
+
+# The cost of new hashes when PASSWORD_METHOD is not set
+DEFAULT_METHOD = f'pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}'
+# The most seconds to wait for a hash once it has started waiting
+HASH_TIMEOUT = 30
+
+# The pool and the limit on waiting hashes, made the first time they are
+#   needed so each gunicorn worker gets its own after forking
+_pool = None
+_slots = None
+_pool_lock = Lock()
+
+
+class PasswordsBusy(Exception):
+    """
+    Too many passwords are being hashed in this worker, try again shortly
+    """
+
+
+def _run(function, *args):
+    """
+    Run a hashing function on the pool, or in this process if there is none
+
+    :raises:
+        PasswordsBusy : if PASSWORD_QUEUE hashes are already running or
+            waiting, the hash took longer than HASH_TIMEOUT or a worker process
+            stopped
+    """
+    global _pool, _slots
+
+    workers = current_app.config.get('PASSWORD_WORKERS', 0)
+
+    if not workers:
+        return function(*args)
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers)
+            _slots = BoundedSemaphore(
+                current_app.config.get('PASSWORD_QUEUE', workers * 4))
+
+        # Keep using this pool and limit even if they are replaced below
+        pool, slots = _pool, _slots
+
+    # Turn the request away now rather than let it wait behind the others
+    if not slots.acquire(blocking=False):
+        raise PasswordsBusy()
+
+    try:
+        future = pool.submit(function, *args)
+
+        # The slot is only given back once the hash is done, even when this
+        #   request stops waiting for it, so no more than PASSWORD_QUEUE hashes
+        #   are ever running or waiting in the pool
+        future.add_done_callback(lambda _: slots.release())
+
+    except BrokenProcessPool:
+        slots.release()
+        _replace_pool(pool)
+        raise PasswordsBusy()
+
+    except BaseException:
+        # Nothing was queued, so nothing else will give the slot back
+        slots.release()
+        raise
+
+    try:
+        return future.result(timeout=HASH_TIMEOUT)
+
+    except TimeoutError:
+        # Drop the hash if it has not started yet
+        future.cancel()
+        raise PasswordsBusy()
+
+    except BrokenProcessPool:
+        _replace_pool(pool)
+        raise PasswordsBusy()
+
+
+def _replace_pool(pool):
+    """
+    Forget a pool after one of its worker processes stopped, which breaks the
+        whole pool, so the next hash starts a new one
+    """
+    global _pool
+
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+
+
+def _method():
+    """The current PASSWORD_METHOD, written the way werkzeug saves it"""
+    method = current_app.config.get('PASSWORD_METHOD') or DEFAULT_METHOD
+
+    # Werkzeug adds its default number of iterations when none is given
+    if method.startswith('pbkdf2:') and method.count(':') == 1:
+        method += f':{DEFAULT_PBKDF2_ITERATIONS}'
+
+    return method
+
+
+def hash_password(password):
+    """
+    Hash a password with the current PASSWORD_METHOD
+
+    :param
+        - password : *str* : the password the user entered
+
+    :return:
+        *str* : the hash to save in the user table
+    """
+    return _run(generate_password_hash, password, _method())
+
+
+def check_password(pwhash, password):
+    """
+    Check a password against its saved hash
+
+    :param
+        - pwhash   : *str* : the hash saved in the user table
+        - password : *str* : the password the user entered
+
+    :return:
+        *bool* : True if the password is right; False if not
+    """
+    return _run(check_password_hash, pwhash, password)
+
+
+def needs_rehash(pwhash):
+    """
+    Check if a saved hash was made with a different method or cost than the
+        current PASSWORD_METHOD, so it should be made again at the next login
+
+    :param
+        - pwhash : *str* : the hash saved in the user table
+
+    :return:
+        *bool* : True if the hash is out of date; False if not
+    """
+    return pwhash.split('$', 1)[0] != _method()
@@ -1,6 +1,114 @@
-from sqlalchemy import text
+from collections import OrderedDict
+from datetime import datetime
+from itertools import zip_longest
+from threading import Lock
+from time import monotonic
+
+import numpy as np
+from sqlalchemy import text, update, delete, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from db_model import DB, User, Project, Details, ProjectColor, ProjectGlitter
+from recommend import index_features, nearest, FEATURE_SIZE, FEATURE_VERSION
+from search import index_projects, SEARCH_WEIGHTS
+from units import SOURCE_COLUMNS, canonical_values
+
+# How many seconds a user's cached values can be used for
+#   - each worker process keeps its own cache, so this is also the longest
+#     another worker can show old values after a change
+CACHE_SECONDS = 60
+# The most users to keep cached values for in each worker process
+CACHE_MAX_USERS = 1000
+
+# The child table of each kind of colorant, and the comma separated details
+#   columns its rows are split from: (names, amounts, types)
+COLORANTS = {
+    'color': (ProjectColor, ('colors', 'color_amts', 'color_types')),
+    'glitter': (ProjectGlitter, ('glitters', 'glitter_amts', 'glitter_types')),
+}
+
+# The details columns picked from a select on the add and edit forms, which
+#   send the text "None" when a select is left on "Select One"
+SELECT_COLUMNS = ('unit', 'start_temp_unit', 'end_temp_unit',
+                  'demold_temp_unit', 'result_scale')
+
+
+def picked(column, value):
+    """
+    The value to save in a details column, with nothing for a select that was
+        left on "Select One"
+
+    :param
+        - column : *str* : name of the details column
+        - value  : the value from the form, file or caller
+
+    :return:
+        the value to save; None if it is the forms' "None"
+    """
+    return None if column in SELECT_COLUMNS and value == 'None' else value
+
+
+# Cached values for each user: user_id -> {name: (expires, value)}
+#   - ordered from least to most recently used so old users are dropped first
+_user_cache = OrderedDict()
+_user_cache_lock = Lock()
+# How many times each user's cache was invalidated: user_id -> count
+#   - a value loaded while the count changed may be from before the change,
+#     so it is not saved
+_user_generations = {}
+
+
+def _cached(user_id, name, load):
+    """
+    Get a value from the user's cache, loading and saving it if needed
+
+    :param
+        - user_id : *int*      : id of the user the value belongs to
+        - name    : *str*      : name of the cached value, ie. "names"
+        - load    : *function* : called with no arguments to get the value
+
+    :return:
+        the cached value
+    """
+    now = monotonic()
+
+    with _user_cache_lock:
+        entry = _user_cache.get(user_id, {}).get(name)
+
+        if entry is not None and entry[0] > now:
+            _user_cache.move_to_end(user_id)
+            return entry[1]
+
+        generation = _user_generations.get(user_id, 0)
 
-from db_model import DB, User, Project, Details
+    # Load outside the lock so other users are not held up by the query
+    value = load()
+
+    with _user_cache_lock:
+        # The user's projects changed while loading, so the value may be old
+        if _user_generations.get(user_id, 0) != generation:
+            return value
+
+        _user_cache.setdefault(user_id, {})[name] = (now + CACHE_SECONDS, value)
+        _user_cache.move_to_end(user_id)
+
+        # Drop the least recently used users when the cache is full
+        while len(_user_cache) > CACHE_MAX_USERS:
+            _user_cache.popitem(last=False)
+
+    return value
+
+
+def invalidate_user_cache(user_id):
+    """
+    Remove all the cached values for a user after their projects change
+
+    :param
+        - user_id : *int* : id of the user whose projects changed
+    """
+    with _user_cache_lock:
+        _user_cache.pop(user_id, None)
+        _user_generations[user_id] = _user_generations.get(user_id, 0) + 1
 
 
 def dup_user(name):
@@ -121,6 +229,21 @@ def edit_user(user_dict):
     DB.session.close()
 
 
+def set_password(user_id, hash_pass):
+    """
+    Query to save a new hash of a user's password, ie. when it is made again
+        with the current hash settings at login
+
+    :param
+        - user_id   : *int* : id of the user
+        - hash_pass : *str* : the new hash of the user's password
+    """
+    DB.session.execute(update(User).where(User.id == user_id).values(
+        password=hash_pass))
+    DB.session.commit()
+    DB.session.close()
+
+
 def dup_proj(proj_name, user_id):
     """
     Query to verify project name does not already exist
@@ -132,17 +255,13 @@ def dup_proj(proj_name, user_id):
     :return:
         *bool* : True if project name already exists; False if not found
     """
-    # Get all project names by the user
-    proj_names = DB.session.query(Project.name).filter(
-        Project.user_id == user_id).all()
+    # Look up just this name using the unique index on user_id and name
+    found = DB.session.query(Project.id).filter(
+        Project.user_id == user_id, Project.name == proj_name).first()
 
     DB.session.close()
 
-    # Pull out all the names from the tuples and put them in a list
-    name = [True for i in proj_names if proj_name in i]
-
-    # Check if the project name is already used my the user
-    return True in name
+    return found is not None
 
 
 def get_last_ten(user_id):
@@ -155,8 +274,8 @@ def get_last_ten(user_id):
     """
     rows = DB.engine.execute(
         text("""
-            SELECT p.name, d.resin_brand, d.resin_type, d.amount, d.unit,
-                d.colors, d.glitters, d.result_scale
+            SELECT p.name, p.mold_img, d.resin_brand, d.resin_type, d.amount,
+                d.unit, d.colors, d.glitters, d.result_scale
             FROM "project" p
                 JOIN "details" d ON d.project_id = p.id
             WHERE p.user_id = :user_id
@@ -239,55 +358,263 @@ def add_new_project(project_dict: dict):
                 - type of result image uploaded, taken from data when uploaded
 
     :return:
-        Adds all given parameters to the database
+        *int* : the new project id; None if the user already has a project
+            with the same name
     """
-    # Create new values to add to the project table based on given parameters
-    new_project = Project(name=project_dict['name'],
-                          mold_img=project_dict['mold_img'],
-                          mold_img_type=project_dict['mold_img_type'],
-                          result_img=project_dict['res_img'],
-                          result_img_type=project_dict['res_img_type'],
-                          notes=project_dict['notes'],
-                          user_id=project_dict['user_id']
-                          )
-    # Add the new values to the project table
+    # Create the new project and its details, linked together
+    new_project = _new_project(project_dict)
+    # Add the new values to both tables
     DB.session.add(new_project)
-    # Commit those changes so we can get the new project id number
-    DB.session.commit()
-    # Get the new project id number for the details table
-    proj_id = DB.engine.execute(text(
-        'SELECT id FROM "project" WHERE name = :name and user_id = :user_id'),
-        name=project_dict['name'], user_id=project_dict['user_id']).one()
+
+    try:
+        # Send the inserts, getting the new project id back from the database
+        #   so the details row can use it in the same transaction
+        DB.session.flush()
+        proj_id = new_project.id
+        # Make the project searchable and comparable in the same transaction
+        index_projects([proj_id])
+        index_features([proj_id])
+        # Commit both rows at once, so there is never half of a project saved
+        DB.session.commit()
+
+    except IntegrityError:
+        DB.session.rollback()
+
+        # The unique index stops two projects with the same name, even if
+        #   they are submitted at the same time
+        if dup_proj(project_dict['name'], project_dict['user_id']):
+            return None
+
+        raise
+
+    finally:
+        DB.session.close()
+
+    # The user's list of projects has changed
+    invalidate_user_cache(project_dict['user_id'])
+
+    return proj_id
+
+
+def add_projects(project_dicts, batch_size=500):
+    """
+    Function to add many new projects at once, for imports and migrations.
+
+    All the projects are added in one transaction, so if any of them can not
+        be added then none of them are.
+
+    :param
+        - project_dicts : *list* : dictionaries with the same keys used by
+                                   add_new_project
+        - batch_size    : *int*  : number of projects to send to the database
+                                   at a time
+
+    :return:
+        *list* : the new project ids, in the same order as project_dicts
+    """
+    proj_ids = []
+
+    try:
+        for start in range(0, len(project_dicts), batch_size):
+            batch = project_dicts[start:start + batch_size]
+            # Each table is inserted as one statement with many rows, without
+            #   making an object for every row
+            DB.session.execute(insert(Project),
+                               [_project_values(project) for project in batch])
+
+            # Get the new project ids back by the user and name of each,
+            #   which the unique index makes one lookup per project
+            keys = {(project['user_id'], project['name']) for project in batch}
+            new_ids = {(user_id, name): proj_id for proj_id, user_id, name in
+                       DB.session.execute(select(
+                           Project.id, Project.user_id, Project.name
+                       ).where(Project.user_id.in_({key[0] for key in keys}),
+                               Project.name.in_({key[1] for key in keys})))}
+            batch_ids = [new_ids[project['user_id'], project['name']]
+                         for project in batch]
+
+            DB.session.execute(insert(Details), [
+                dict(_details_values(project), project_id=proj_id)
+                for proj_id, project in zip(batch_ids, batch)])
+
+            for model, columns in COLORANTS.values():
+                rows = [dict(row, project_id=proj_id)
+                        for proj_id, project in zip(batch_ids, batch)
+                        for row in split_colorants(*map(project.get, columns))]
+                if rows:
+                    DB.session.execute(insert(model), rows)
+
+            proj_ids.extend(batch_ids)
+            index_projects(batch_ids)
+            index_features(batch_ids)
+
+        # Commit all the projects at once
+        DB.session.commit()
+
+    except Exception:
+        DB.session.rollback()
+        raise
+
+    finally:
+        DB.session.close()
+
+    # The lists of projects have changed for everyone who got a new project
+    for user_id in {project_dict['user_id'] for project_dict in project_dicts}:
+        invalidate_user_cache(user_id)
+
+    return proj_ids
+
+
+def _project_values(project_dict):
+    """The project table columns of a new project, from its dictionary"""
+    return {'name': project_dict['name'],
+            'mold_img': project_dict['mold_img'],
+            'mold_img_type': project_dict['mold_img_type'],
+            'result_img': project_dict['res_img'],
+            'result_img_type': project_dict['res_img_type'],
+            'notes': project_dict['notes'],
+            'user_id': project_dict['user_id'],
+            'updated_at': datetime.utcnow()}
+
+
+def _details_values(project_dict):
+    """The details table columns of a new project, from its dictionary"""
+    values = {'user_id': project_dict['user_id'],
+              'resin_brand': project_dict['resin_brand'],
+              'resin_type': project_dict['resin_type'],
+              'amount': project_dict['amt'],
+              'unit': project_dict['unit'],
+              'colors': project_dict['colors'],
+              'color_amts': project_dict['color_amts'],
+              'color_types': project_dict['color_types'],
+              'glitters': project_dict['glitters'],
+              'glitter_types': project_dict['glitter_types'],
+              'glitter_amts': project_dict['glitter_amts'],
+              'time_to_pour_hrs': project_dict['time_to_pour_hrs'],
+              'time_to_pour_mins': project_dict['time_to_pour_mins'],
+              'pouring_time_hrs': project_dict['pouring_time_hrs'],
+              'pouring_time_mins': project_dict['pouring_time_mins'],
+              'time_to_demold_hrs': project_dict['time_to_demold_hrs'],
+              'time_to_demold_mins': project_dict['time_to_demold_mins'],
+              'result_scale': project_dict['result_scale'],
+              'start_temp': project_dict['start_temp'],
+              'start_temp_unit': project_dict['start_temp_unit'],
+              'end_temp': project_dict['end_temp'],
+              'end_temp_unit': project_dict['end_temp_unit'],
+              'demold_temp': project_dict['demold_temp'],
+              'demold_temp_unit': project_dict['demold_temp_unit']}
+    values = {column: picked(column, value) for column, value in values.items()}
+
+    # The amount, temperatures and times in the same units as every other
+    #   project
+    values.update(canonical_values(values))
+
+    return values
+
+
+def _new_project(project_dict):
+    """
+    Create the project and details rows for a new project, linked together so
+        the details get the project id when they are added to the database.
+
+    :param
+        - project_dict : *dict* : dictionary with the keys used by
+                                  add_new_project
+
+    :return:
+        *Project* : the new project with its details attached
+    """
+    # Create new values to add to the project table based on given parameters
+    new_project = Project(**_project_values(project_dict))
     # Create new values to add to the details table based on given parameters
-    new_details = Details(project_id=proj_id[0],
-                          resin_brand=project_dict['resin_brand'],
-                          resin_type=project_dict['resin_type'],
-                          amount=project_dict['amt'],
-                          unit=project_dict['unit'],
-                          colors=project_dict['colors'],
-                          color_amts=project_dict['color_amts'],
-                          color_types=project_dict['color_types'],
-                          glitters=project_dict['glitters'],
-                          glitter_types=project_dict['glitter_types'],
-                          glitter_amts=project_dict['glitter_amts'],
-                          time_to_pour_hrs=project_dict['time_to_pour_hrs'],
-                          time_to_pour_mins=project_dict['time_to_pour_mins'],
-                          pouring_time_hrs=project_dict['pouring_time_hrs'],
-                          pouring_time_mins=project_dict['pouring_time_mins'],
-                          time_to_demold_hrs=project_dict['time_to_demold_hrs'],
-                          time_to_demold_mins=project_dict['time_to_demold_mins'],
-                          result_scale=project_dict['result_scale'],
-                          start_temp=project_dict['start_temp'],
-                          start_temp_unit=project_dict['start_temp_unit'],
-                          end_temp=project_dict['end_temp'],
-                          end_temp_unit=project_dict['end_temp_unit'],
-                          demold_temp=project_dict['demold_temp'],
-                          demold_temp_unit=project_dict['demold_temp_unit'])
-    # Add the new values to the details table
-    DB.session.add(new_details)
-    # Commit the changes to the database
-    DB.session.commit()
-    DB.session.close()
+    new_project.details.append(Details(**_details_values(project_dict)))
+    # Split the colors and glitters into their own rows
+    new_project.project_colors = [ProjectColor(**row) for row in split_colorants(
+        project_dict['colors'], project_dict['color_amts'],
+        project_dict['color_types'])]
+    new_project.project_glitters = [ProjectGlitter(**row) for row in split_colorants(
+        project_dict['glitters'], project_dict['glitter_amts'],
+        project_dict['glitter_types'])]
+
+    return new_project
+
+
+def _split_list(value):
+    """Split a comma separated value into its stripped parts; None if empty"""
+    if not value:
+        return []
+
+    if isinstance(value, str):
+        value = value.split(',')
+
+    return [str(part).strip() or None for part in value]
+
+
+def split_colorants(names, amounts, types):
+    """
+    Split the comma separated names, amounts and types of a project's colors
+        or glitters into one row for each
+
+    :param
+        - names   : *str or list* : color(s) or glitter(s) separated by commas
+        - amounts : *str or list* : amount(s) of each separated by commas
+        - types   : *str or list* : type(s) of each separated by commas
+
+    :return:
+        *list* : dicts with the position, name, amount and type of each
+    """
+    rows = zip_longest(_split_list(names), _split_list(amounts),
+                       _split_list(types))
+
+    # Leave out the blanks left by extra commas
+    rows = [row for row in rows if any(row)]
+
+    return [{'position': position, 'name': name, 'amount': amount, 'type': kind}
+            for position, (name, amount, kind) in enumerate(rows)]
+
+
+def _normalize_units(proj_id):
+    """
+    Work out the amount in grams and milliliters, the temperatures in Celsius
+        and the times in minutes of a changed project again. Uses the app's
+        session without committing.
+
+    :param
+        - proj_id : *int* : id of the project that was changed
+    """
+    # The details were already updated, so these are the new values
+    saved = DB.session.execute(select(
+        *(getattr(Details, column) for column in SOURCE_COLUMNS)
+    ).where(Details.project_id == proj_id)).one()
+
+    DB.session.execute(update(Details).where(
+        Details.project_id == proj_id
+    ).values(**canonical_values(saved._mapping)))
+
+
+def _replace_colorants(proj_id, changes):
+    """
+    Split the saved colors and glitters of a project into their rows again,
+        for any that were changed. Uses the app's session without committing.
+
+    :param
+        - proj_id : *int*  : id of the project that was changed
+        - changes : *dict* : the details columns that were changed
+    """
+    for model, columns in COLORANTS.values():
+        if not any(column in changes for column in columns):
+            continue
+
+        # The details were already updated, so these are the new values
+        saved = DB.session.execute(select(
+            *(getattr(Details, column) for column in columns)
+        ).where(Details.project_id == proj_id)).one()
+
+        DB.session.execute(delete(model).where(model.project_id == proj_id))
+
+        rows = [dict(row, project_id=proj_id) for row in split_colorants(*saved)]
+        if rows:
+            DB.session.execute(insert(model), rows)
 
 
 def get_all(user_id):
@@ -313,41 +640,474 @@ def get_all(user_id):
     return all_projects
 
 
-def del_rec(proj_name, user_id):
+# Columns of each project written to the exports, in order
+EXPORT_COLUMNS = ('name', 'resin_brand', 'resin_type', 'amount', 'unit',
+                  'colors', 'color_amts', 'color_types', 'glitters',
+                  'glitter_amts', 'glitter_types', 'time_to_pour_hrs',
+                  'time_to_pour_mins', 'pouring_time_hrs', 'pouring_time_mins',
+                  'time_to_demold_hrs', 'time_to_demold_mins', 'start_temp',
+                  'start_temp_unit', 'end_temp', 'end_temp_unit', 'demold_temp',
+                  'demold_temp_unit', 'result_scale', 'notes', 'updated_at',
+                  'mold_img', 'result_img')
+
+
+def iter_projects(user_id, batch_size=500):
     """
-    Queries the database to remove a single record with the provide project id
+    Query to get all of a user's projects a batch at a time, without ever
+        holding more than one batch in memory.
+
+    A server side cursor is used where the database has one, so the first
+        batch comes back before the database has found every project.
 
     :param
-        - proj_name : str : the name of the project record to be removed
-        - user_id   : int : id of the user who added the project record
+        - user_id    : *int* : user id of currently signed in user
+        - batch_size : *int* : number of projects in each batch
 
     :return:
-        Database with the record removed that had the given id.
+        *generator* : lists of up to batch_size rows with the EXPORT_COLUMNS,
+            in order of project id
     """
-    # Get the project id from the parameters given
-    proj_id = DB.engine.execute(
-        text("""
-        SELECT id
-        FROM "project"
-        WHERE name = :name AND user_id = :user;
-        """), name=proj_name, user=user_id).one()
+    columns = ', '.join(f'p.{col}' if col in Project.__table__.columns
+                        else f'd.{col}' for col in EXPORT_COLUMNS)
+
+    # The connection is kept until the last batch has been read
+    with DB.engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(text(
+            f"""
+            SELECT {columns}
+            FROM "project" p
+                JOIN "details" d ON d.project_id = p.id
+            WHERE p.user_id = :user_id
+            ORDER BY p.id;
+            """).columns(updated_at=DB.DateTime), {'user_id': user_id})
+
+        for batch in result.partitions(batch_size):
+            yield batch
+
+
+# Columns the all projects page can be sorted by, with the SQL to sort on
+#   - NULLs are turned into empty values so every row has a cursor to compare
+#   - the time totals are never NULL, so cure time is sorted on the column
+SORT_COLUMNS = {
+    'id': 'p.id',
+    'name': 'p.name',
+    'resin_brand': "COALESCE(d.resin_brand, '')",
+    'resin_type': "COALESCE(d.resin_type, '')",
+    'result_scale': "COALESCE(d.result_scale, '')",
+    'cure_time': 'd.time_to_demold_total',
+    'amount': 'COALESCE(d.amount_g, -1)',
+    'start_temp': 'COALESCE(d.start_temp_c, -1000)',
+}
+
+# The sorts above on columns of numbers, the rest are sorted on text
+NUMBER_SORTS = {'id', 'cure_time', 'amount', 'start_temp'}
+# The sorts above read in order from a (user_id, sort, project_id) index on
+#   the details table, which holds the exact SQL in SORT_COLUMNS
+DETAILS_SORTS = {'cure_time', 'amount', 'start_temp'}
+
+# Values the all projects page can be narrowed down by, with the SQL for the
+#   value of each project
+#   - brands and types are matched without case or extra spaces
+#   - colorant types come from both the project_color and project_glitter rows
+FACETS = {
+    'resin_brand': 'trim(d.resin_brand)',
+    'resin_type': 'trim(d.resin_type)',
+    'unit': 'd.unit',
+    'result_scale': 'd.result_scale',
+    'colorant_type': 'c.type',
+}
+
+# Filters the all projects page can use, with the SQL each one adds
+#   - the ranges are numbers in grams or degrees Celsius, compared to the
+#     same expressions as SORT_COLUMNS so the user_id indexes on them can be
+#     used, leaving out the rows with no amount or temperature
+#   - the rest are one of the values counted by facet_counts
+FILTERS = {
+    'min_amount': 'COALESCE(d.amount_g, -1) >= :min_amount '
+                  'AND d.amount_g IS NOT NULL',
+    'max_amount': 'COALESCE(d.amount_g, -1) <= :max_amount '
+                  'AND d.amount_g IS NOT NULL',
+    'min_temp': 'COALESCE(d.start_temp_c, -1000) >= :min_temp '
+                'AND d.start_temp_c IS NOT NULL',
+    'max_temp': 'COALESCE(d.start_temp_c, -1000) <= :max_temp '
+                'AND d.start_temp_c IS NOT NULL',
+    'resin_brand': 'lower(trim(d.resin_brand)) = lower(:resin_brand)',
+    'resin_type': 'lower(trim(d.resin_type)) = lower(:resin_type)',
+    'unit': 'lower(d.unit) = lower(:unit)',
+    'result_scale': 'lower(d.result_scale) = lower(:result_scale)',
+    'colorant_type': """(EXISTS (
+            SELECT 1 FROM "project_color" c
+            WHERE c.project_id = p.id AND lower(c.type) = lower(:colorant_type)
+        ) OR EXISTS (
+            SELECT 1 FROM "project_glitter" c
+            WHERE c.project_id = p.id AND lower(c.type) = lower(:colorant_type)
+        ))""",
+}
+
+
+def get_page(user_id, sort='id', descending=False, after=None, per_page=25,
+             filters=None):
+    """
+    Functionality to run the query to get one page of projects for the user
+        specified, using the last row of the previous page as the cursor.
 
-    # Remove the project record from both tables
-    DB.engine.execute(
-        text("""
-            DELETE FROM "details"
-            WHERE project_id = :id;
-            
-            DELETE FROM "project"
-            WHERE id = :id;
-            """), id=proj_id[0])
+    :param
+        - user_id    : *int*   : user id of currently signed in user
+        - sort       : *str*   : key in SORT_COLUMNS to sort the projects by
+        - descending : *bool*  : True to sort from largest to smallest
+        - after      : *tuple* : (sort value, project id) of the last row on
+                                 the previous page; None for the first page
+        - per_page   : *int*   : the most projects to return
+        - filters    : *dict*  : values for any of the keys in FILTERS, to only
+                                 return the projects that match all of them
+
+    :return:
+        *tuple* : (rows for this page, cursor for the next page or None)
+    """
+    sort_col = SORT_COLUMNS[sort]
+    # Use the project id to break ties so the order is always the same, from
+    #   the same table as the index the page is read from
+    id_col = 'd.project_id' if sort in DETAILS_SORTS else 'p.id'
+    order = 'DESC' if descending else 'ASC'
+    compare = '<' if descending else '>'
+
+    params = {'user_id': user_id, 'limit': per_page + 1}
+    keyset = ''
+
+    # Only keep the projects that match every filter given
+    filters = {k: v for k, v in (filters or {}).items()
+               if k in FILTERS and v is not None}
+    where = ''.join(f' AND {FILTERS[k]}' for k in filters)
+    params.update(filters)
+
+    # Only look at rows past the end of the previous page
+    #   - the first comparison lets SQLite start from the cursor in an index
+    #     on an expression, which it does not do for the pair of values
+    if after is not None:
+        keyset = f'AND {sort_col} {compare}= :after_key ' \
+                 f'AND ({sort_col}, {id_col}) {compare} (:after_key, :after_id)'
+        params['after_key'], params['after_id'] = after
+
+    rows = DB.engine.execute(text(
+        f"""
+        SELECT p.id, p.name, p.mold_img, p.result_img, p.notes,
+            d.resin_brand, d.resin_type, d.amount, d.unit, d.colors,
+            d.color_amts, d.color_types, d.glitters, d.glitter_amts,
+            d.glitter_types, d.time_to_pour_hrs, d.time_to_pour_mins,
+            d.pouring_time_hrs, d.pouring_time_mins, d.time_to_demold_hrs,
+            d.time_to_demold_mins, d.result_scale, d.start_temp,
+            d.start_temp_unit, d.end_temp, d.end_temp_unit, d.demold_temp,
+            d.demold_temp_unit, {sort_col} AS sort_key
+        FROM "project" p
+            JOIN "details" d ON d.project_id = p.id
+        WHERE p.user_id = :user_id AND d.user_id = :user_id{where} {keyset}
+        ORDER BY sort_key {order}, {id_col} {order}
+        LIMIT :limit;
+        """), **params).all()
+
+    DB.session.close()
+
+    # The extra row only tells us if there is another page after this one
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        return rows, (rows[-1]['sort_key'], rows[-1]['id'])
+
+    return rows, None
+
+
+def get_names(user_id):
+    """
+    Functionality to get the id and name of every project for the user
+        specified, to fill in the project dropdowns.
+
+    :param
+        - user_id : int : user id of currently signed in user
+
+    :return:
+        list of (id, name) tuples sorted by project name
+    """
+    def load():
+        names = DB.session.query(Project.id, Project.name).filter(
+            Project.user_id == user_id).order_by(Project.name).all()
+
+        DB.session.close()
+
+        return [tuple(row) for row in names]
+
+    return _cached(user_id, 'names', load)
+
+
+def del_rec(proj_ids, user_id):
+    """
+    Queries the database to remove the project records with the ids provided,
+        in a single statement. The database removes the details of each
+        project along with it.
+
+    :param
+        - proj_ids : list : the ids of the project records to be removed
+        - user_id  : int  : id of the user who added the project records
+
+    :return:
+        int : the number of project records removed
+    """
+    # Nothing to remove, so there is no need to touch the database
+    if not proj_ids:
+        return 0
+
+    # Remove the project records, only if they belong to the user
+    removed = DB.session.execute(delete(Project).where(
+        Project.user_id == user_id, Project.id.in_(proj_ids)
+    ).execution_options(synchronize_session=False)).rowcount
 
     # Commit the changes to the database
     DB.session.commit()
     # Close the database session
     DB.session.close()
 
-    return
+    # The user's list of projects has changed
+    invalidate_user_cache(user_id)
+
+    return removed
+
+
+def get_project(user_id, proj_name):
+    """
+    Query to get just one single project and all its details from the database
+        by its name, in a single query using the unique index on user_id and name
+
+    :param
+        - user_id   : *int* : id of the user who added the project
+        - proj_name : *str* : the exact name of the project needed
+
+    :return:
+        dict with all the details for given project only; None if not found
+    """
+    # Query the database joining the two tables with all the details
+    single = DB.engine.execute(text(
+        """
+        SELECT p.id, p.name, p.mold_img, p.mold_img_type, p.result_img,
+            p.result_img_type, p.notes, p.user_id, p.updated_at, d.project_id,
+            d.resin_brand,
+            d.resin_type, d.amount, d.unit, d.colors, d.color_amts,
+            d.color_types, d.glitters, d.glitter_amts, d.glitter_types,
+            d.time_to_pour_hrs, d.time_to_pour_mins, d.pouring_time_hrs,
+            d.pouring_time_mins, d.time_to_demold_hrs, d.time_to_demold_mins,
+            d.result_scale, d.start_temp, d.start_temp_unit, d.end_temp,
+            d.end_temp_unit, d.demold_temp, d.demold_temp_unit
+        FROM "project" p
+            JOIN "details" d ON d.project_id = p.id
+        WHERE p.user_id = :user_id AND p.name = :name;
+        """).columns(updated_at=DB.DateTime), user_id=user_id, name=proj_name).first()
+
+    # Close the session
+    DB.session.close()
+
+    # Turn the row into a dictionary keyed by column name
+    return dict(single._mapping) if single is not None else None
+
+
+def get_colorants(proj_id):
+    """
+    Query to get the colors and glitters of a project, in the order they were
+        listed, in a single query
+
+    :param
+        - proj_id : *int* : id of the project
+
+    :return:
+        *dict* : "color" and "glitter" -> list of rows with the name, amount
+            and type of each
+    """
+    rows = DB.engine.execute(text(
+        """
+        SELECT 'color' AS kind, c.position, c.name, c.amount, c.type
+        FROM "project_color" c
+        WHERE c.project_id = :proj_id
+        UNION ALL
+        SELECT 'glitter' AS kind, g.position, g.name, g.amount, g.type
+        FROM "project_glitter" g
+        WHERE g.project_id = :proj_id
+        ORDER BY kind, position;
+        """), proj_id=proj_id).all()
+
+    DB.session.close()
+
+    colorants = {kind: [] for kind in COLORANTS}
+    for row in rows:
+        colorants[row.kind].append(row)
+
+    return colorants
+
+
+def projects_using(user_id, kind, name=None, colorant_type=None):
+    """
+    Query to find a user's projects that used a color or glitter, ie. every
+        project made with mica powder, without matching the case
+
+    :param
+        - user_id       : *int* : id of the user currently logged in
+        - kind          : *str* : "color" or "glitter"
+        - name          : *str* : name of the color or glitter; None for any
+        - colorant_type : *str* : type of the color or glitter; None for any
+
+    :return:
+        *list* : (id, name) of each project found, in order of name
+    """
+    table = COLORANTS[kind][0].__tablename__
+    filters = ''
+
+    # The lower() matches the indexes on the colorant tables
+    if name is not None:
+        filters += ' AND lower(c.name) = lower(:name)'
+    if colorant_type is not None:
+        filters += ' AND lower(c.type) = lower(:colorant_type)'
+
+    rows = DB.engine.execute(text(
+        f"""
+        SELECT p.id, p.name
+        FROM "project" p
+        WHERE p.user_id = :user_id
+            AND EXISTS (
+                SELECT 1
+                FROM "{table}" c
+                WHERE c.project_id = p.id{filters}
+            )
+        ORDER BY p.name;
+        """), user_id=user_id, name=name, colorant_type=colorant_type).all()
+
+    DB.session.close()
+
+    return rows
+
+
+def colorant_counts(user_id, kind, by='type'):
+    """
+    Query to count how many of a user's projects used each color or glitter,
+        or each type of them, the most used first
+
+    :param
+        - user_id : *int* : id of the user currently logged in
+        - kind    : *str* : "color" or "glitter"
+        - by      : *str* : "name" or "type", what to count the projects by
+
+    :return:
+        *list* : (value, number of projects, number of times used) for each
+    """
+    if by not in ('name', 'type'):
+        raise ValueError(f'Can not count {kind}s by {by!r}')
+
+    table = COLORANTS[kind][0].__tablename__
+
+    def load():
+        rows = DB.engine.execute(text(
+            f"""
+            SELECT min(c.{by}) AS value, count(DISTINCT c.project_id) AS projects,
+                count(*) AS uses
+            FROM "{table}" c
+                JOIN "project" p ON p.id = c.project_id
+            WHERE p.user_id = :user_id AND c.{by} IS NOT NULL
+            GROUP BY lower(c.{by})
+            ORDER BY projects DESC, value;
+            """), user_id=user_id).all()
+
+        DB.session.close()
+
+        return [tuple(row) for row in rows]
+
+    return _cached(user_id, f'{kind}_{by}_counts', load)
+
+
+def facet_counts(user_id):
+    """
+    Query to count how many of a user's projects have each value of each of
+        the FACETS, in a single query
+
+    :param
+        - user_id : *int* : id of the user currently logged in
+
+    :return:
+        *dict* : facet name -> list of (value, number of projects), the most
+            used first
+    """
+    def load():
+        # The projects each colorant type was used in, once per project
+        colorants = """
+            SELECT c.project_id, c.type FROM "project_color" c
+            UNION
+            SELECT g.project_id, g.type FROM "project_glitter" g
+        """
+        counts = ' UNION ALL '.join(
+            f"""
+            SELECT '{facet}' AS facet, min({value}) AS value,
+                count(DISTINCT p.id) AS projects
+            FROM "project" p
+                {'JOIN (' + colorants + ') c ON c.project_id = p.id'
+                 if facet == 'colorant_type'
+                 else 'JOIN "details" d ON d.project_id = p.id'}
+            WHERE p.user_id = :user_id AND {value} IS NOT NULL
+                AND {value} <> ''
+            GROUP BY lower({value})
+            """ for facet, value in FACETS.items())
+
+        rows = DB.engine.execute(text(
+            f'{counts} ORDER BY facet, projects DESC, value;'),
+            user_id=user_id).all()
+
+        DB.session.close()
+
+        facets = {facet: [] for facet in FACETS}
+        for facet, value, projects in rows:
+            facets[facet].append((value, projects))
+
+        return facets
+
+    return _cached(user_id, 'facets', load)
+
+
+def get_similar(user_id, proj_id, count=5):
+    """
+    Find the user's projects most like one of their projects, using the
+        feature vectors of all the user's projects kept in the user's cache
+
+    :param
+        - user_id : *int* : id of the user currently logged in
+        - proj_id : *int* : id of the project to compare to
+        - count   : *int* : the most projects to return
+
+    :return:
+        *list* : dicts with the id, name, result_scale and similarity (0-1) of
+            each project found, most similar first
+    """
+    def load():
+        rows = DB.engine.execute(text(
+            """
+            SELECT f.project_id, p.name, d.result_scale, f.vector
+            FROM "project_feature" f
+                JOIN "project" p ON p.id = f.project_id
+                JOIN "details" d ON d.project_id = f.project_id
+            WHERE f.user_id = :user_id AND f.version = :version
+            ORDER BY f.project_id;
+            """), user_id=user_id, version=FEATURE_VERSION).all()
+
+        DB.session.close()
+
+        # Stack the vectors into one matrix, in order of project id
+        matrix = np.frombuffer(b''.join(row.vector for row in rows),
+                               dtype=np.float32).reshape(-1, FEATURE_SIZE)
+
+        return (np.array([row.project_id for row in rows]),
+                [(row.name, row.result_scale) for row in rows], matrix)
+
+    ids, projects, matrix = _cached(user_id, 'features', load)
+
+    # Find the row of the project, if it has a vector yet
+    index = int(np.searchsorted(ids, proj_id))
+    if index >= len(ids) or ids[index] != proj_id:
+        return []
+
+    return [{'id': int(ids[row]), 'name': projects[row][0],
+             'result_scale': projects[row][1], 'similarity': similarity}
+            for row, similarity in nearest(matrix, index, count)]
 
 
 def get_single(proj_id):
@@ -379,147 +1139,65 @@ def get_single(proj_id):
     return single_list
 
 
-def edit_project(project_dict):
+def edit_project(proj_id, user_id, changes):
     """
-    Function to edit a project in the current user's account with all the
-        optional parameters available.
+    Function to edit a project in the current user's account, writing only
+        the columns that were changed.
 
     :param
-        - project_dict : *dict* : Dictionary with all of the following as its keys:
+        - proj_id : *int*  : id of the project being edited
+        - user_id : *int*  : id of the user who added the project
+        - changes : *dict* : new values for only the columns that are different,
+                             keyed by column name from either of these tables:
 
-            - user_id            : *int*         :
-                - currently logged in user id
-            - name               : *str*         :
-                - name of project
-            - mold_img           : *url*         :
-                - link to image of mold used
-            - resin_brand        : *str*         :
-                - name of the brand of resin used
-            - resin_type         : *str*         :
-                - type of resin used
-            - amt                : *int*         :
-                - total amount of resin used
-            - unit               : *str*         :
-                - unit of measurement for resin
-            - colors             : *str or list* :
-                - color(s) separated by commas
-            - color_amts         : *str or list* :
-                - color amount(s) separated by commas
-            - color_types        : *str or list* :
-                - color type(s) separated by commas
-            - glitters           : *str or list* :
-                - glitter(s) separated by commas
-            - glitter_amts       : *str or list* :
-                - glitter amount(s) separated by commas
-            - glitter_types      : *str or list* :
-                - glitter type(s) separated by commas
-            - time_to_pour_hrs   : *int*         :
-                - time from combining to pouring in hours
-            - time_to_pour_mins  : *int*         :
-                - time from combining to pouring in minutes
-            - pouring_time_hrs   : *int*         :
-                - total time took for all pouring in hours
-            - pouring_time_mins  : *int*         :
-                - total time took for all pouring in minutes
-            - time_to_demold_hrs : *float*       :
-                - time from finished pouring to de-molding in hours
-            - time_to_demold_mins: *float*       :
-                - time from finished pouring to de-molding in minutes
-            - start_temp         : *float*       :
-                - room temp at start of project
-            - start_temp_unit    : *float*       :
-                - unit of room temp at start of project
-            - end_temp           : *float*       :
-                - room temp at end of project
-            - end_temp_unit      : *float*       :
-                - unit of room temp at end of project
-            - demold_temp        : *float*       :
-                - room temp at de-molding of project
-            - demold_temp_unit   : *float*       :
-                - unit of room temp at de-molding of project
-            - result_scale       : *int*         :
-                - results scale 1-5 (1 being best result)
-            - res_img            : *url*         :
-                - link to image of results
-            - notes              : *str*         :
-                - additional notes
-            - mold_img_type      : *str*         :
-                - type of mold image uploaded, taken from data when uploaded
-            - res_img_type       : *str*         :
-                - type of result image uploaded, taken from data when uploaded
+            - project : mold_img, mold_img_type, result_img, result_img_type,
+                        notes
+            - details : any column except project_id
 
     :return:
-        Edits only the given parameters in the database
+        *bool* : True if anything was changed; False if there was nothing to do
     """
-    details = Details.query.filter_by(project_id = project_dict['id']).first()
-
-    details.resin_brand = project_dict['resin_brand']
-    details.resin_type = project_dict['resin_type']
-    details.amount = project_dict['amount']
-    details.unit = project_dict['unit']
-    details.colors = project_dict['colors']
-    details.color_amts = project_dict['color_amts']
-    details.color_types = project_dict['color_types']
-    details.glitters = project_dict['glitters']
-    details.glitter_types = project_dict['glitter_types']
-    details.glitter_amts = project_dict['glitter_amts']
-    details.time_to_pour_hrs = project_dict['time_to_pour_hrs']
-    details.time_to_pour_mins = project_dict['time_to_pour_mins']
-    details.pouring_time_hrs = project_dict['pouring_time_hrs']
-    details.pouring_time_mins = project_dict['pouring_time_mins']
-    details.time_to_demold_hrs = project_dict['time_to_demold_hrs']
-    details.time_to_demold_mins = project_dict['time_to_demold_mins']
-    details.result_scale = project_dict['result_scale']
-    details.start_temp = project_dict['start_temp']
-    details.start_temp_unit = project_dict['start_temp_unit']
-    details.end_temp = project_dict['end_temp']
-    details.end_temp_unit = project_dict['end_temp_unit']
-    details.demold_temp = project_dict['demold_temp']
-    details.demold_temp_unit = project_dict['demold_temp_unit']
-
-    project = Project.query.filter_by(id = project_dict['id']).first()
-
-    project.mold_img = project_dict['mold_img']
-    project.mold_img_type = project_dict['mold_img_type']
-    project.result_img = project_dict['result_img']
-    project.result_img_type = project_dict['result_img_type']
-    project.notes = project_dict['notes']
+    # Split the changes by the table they belong to
+    project_changes = {k: v for k, v in changes.items()
+                       if k in Project.__table__.columns}
+    details_changes = {k: picked(k, v) for k, v in changes.items()
+                       if k in Details.__table__.columns}
+
+    # Nothing was changed, so there is no need to touch the database
+    if not project_changes and not details_changes:
+        return False
 
-    DB.session.commit()
+    # Update only the changed columns, in a single transaction
+    # The project's version changes along with any of its details
+    DB.session.execute(update(Project).where(
+        Project.id == proj_id, Project.user_id == user_id
+    ).values(updated_at=datetime.utcnow(), **project_changes))
+
+    if details_changes:
+        DB.session.execute(update(Details).where(
+            Details.project_id == proj_id
+        ).values(**details_changes))
+
+        # Keep the amounts, temperatures and times in the same units as the
+        #   details
+        if any(k in SOURCE_COLUMNS for k in details_changes):
+            _normalize_units(proj_id)
+
+        # Keep the colors and glitters rows the same as the details
+        _replace_colorants(proj_id, details_changes)
+        # Make the project's feature vector again from the new details
+        index_features([proj_id])
+
+    # Update the search index if any of the searched words changed
+    if any(k in SEARCH_WEIGHTS for k in changes):
+        index_projects([proj_id])
 
-    # for k, v in project_dict.items():
-    #     if k in d_to_change:
-    #         details.k = project_dict[k]
-    #         print(f'k in loop: {k}\n details in loop: {details}\n  details.k in loop: {details.k}')
-    #         # DB.session.update(details.k)
-    #         DB.session.commit()
-    #
-    #     if k in p_to_change:
-    #         project.k = project_dict[k]
-    #         # DB.session.update(project.k)
-    #         DB.session.commit()
-    #
-    # pprint(project_dict)
-
-    # Add the new values to the details table
-    # DB.session.add(details)
-
-    # # Update values in the project table based on given parameters
-    # edit_proj = DB.engine.execute(
-    #     text(
-    #         """
-    #         UPDATE "project"
-    #         SET mold_img = :mold_img, result_img = :res_img, notes = :notes
-    #         WHERE id = :id;
-    #         """
-    #     ), mold_img=project_dict['mold_img'], res_img=project_dict['result_img'],
-    #     notes=project_dict['notes'], id=project_dict['id']
-    # )
-    #
-    # Add the new values to the project table
-    # DB.session.add(project)
-
-    # # Commit the changes to the database
-    # DB.session.commit()
+    # Commit the changes to the database
+    DB.session.commit()
     # Close the session
     DB.session.close()
+
+    # The user's list of projects has changed
+    invalidate_user_cache(user_id)
+
+    return True
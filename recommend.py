@@ -0,0 +1,228 @@
+"""
+Feature vectors for finding the projects most like a project.
+
+Every project gets a short vector made from its resin, amount, times,
+    temperatures and colorants, saved in the project_feature table. The
+    vectors are made in the same transaction that adds or changes a project,
+    and for older projects by ``flask migrate`` or ``flask build-features``.
+
+The vectors all have a length of 1, so the similarity of two projects is the
+    dot product of their vectors, and the projects most like one project are
+    found with a single matrix product over the user's vectors.
+"""
+from functools import lru_cache
+from zlib import crc32
+
+import numpy as np
+from sqlalchemy import bindparam, delete, insert, text
+
+from analytics import DETAIL_COLUMNS, METRICS, project_metrics
+from db_model import DB, ProjectFeature
+
+# Change this when the vectors are made differently, so they are all made again
+FEATURE_VERSION = 1
+
+# How each measurement is scaled so a typical difference is about 1
+#   - (center, scale) in the units of analytics.METRICS
+NUMERIC_SCALES = {
+    'amount_g': (150.0, 150.0),
+    'time_to_pour': (10.0, 15.0),
+    'pouring_time': (10.0, 15.0),
+    'cure_time': (24 * 60.0, 24 * 60.0),
+    'start_temp': (21.0, 5.0),
+    'end_temp': (21.0, 5.0),
+    'demold_temp': (21.0, 5.0),
+}
+NUMERIC_FEATURES = tuple(NUMERIC_SCALES)
+
+# The words of each project are hashed into this many columns
+HASHED_FEATURES = 48
+FEATURE_SIZE = len(NUMERIC_FEATURES) + HASHED_FEATURES
+
+# How much each kind of word counts towards the similarity
+WORD_WEIGHTS = {'brand': 1.5, 'type': 1.0, 'color': 0.5, 'color_type': 0.5,
+                'glitter': 0.5, 'glitter_type': 0.5}
+
+
+@lru_cache(maxsize=4096)
+def _word_column(kind, word):
+    """
+    The hashed column and sign for a word, the same in every process
+
+    :return:
+        *tuple* : (column index, +1 or -1)
+    """
+    digest = crc32(f'{kind}:{word}'.encode('utf-8'))
+    column = len(NUMERIC_FEATURES) + digest % HASHED_FEATURES
+
+    # The sign keeps words that share a column from adding up
+    return column, 1.0 if digest & (1 << 31) else -1.0
+
+
+def feature_vectors(columns, words):
+    """
+    Make the feature vectors of many projects at once
+
+    :param
+        - columns : *list* : the values of each of analytics.DETAIL_COLUMNS, as
+                             one sequence per column
+        - words   : *list* : for each project, a list of (kind, word) pairs
+                             with kinds from WORD_WEIGHTS
+
+    :return:
+        *ndarray* : float32 array with one row of FEATURE_SIZE per project,
+            each with a length of 1
+    """
+    metrics = project_metrics(columns)
+    vectors = np.zeros((len(words), FEATURE_SIZE), dtype=np.float32)
+
+    for i, name in enumerate(NUMERIC_FEATURES):
+        center, scale = NUMERIC_SCALES[name]
+        values = (metrics[:, METRICS.index(name)] - center) / scale
+        # Measurements that were not recorded are treated as typical ones
+        vectors[:, i] = np.clip(np.nan_to_num(values), -3, 3)
+
+    rows, cols, values = [], [], []
+
+    for row, project_words in enumerate(words):
+        for kind, word in project_words:
+            column, sign = _word_column(kind, word)
+            rows.append(row)
+            cols.append(column)
+            values.append(sign * WORD_WEIGHTS[kind])
+
+    np.add.at(vectors, (rows, cols), values)
+
+    lengths = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(lengths > 0, lengths, 1)
+
+
+def _words(value):
+    """The cleaned up word for a brand, type or colorant; None if empty"""
+    return value.strip().lower() if value and value.strip() else None
+
+
+def index_features(proj_ids):
+    """
+    Make and save the feature vectors of some projects.
+
+    This uses the app's database session without committing, so the vectors
+        are saved in the same transaction as the projects.
+
+    :param
+        - proj_ids : *list* : ids of the projects that were added or changed
+    """
+    if not proj_ids:
+        return
+
+    ids = {'ids': list(proj_ids)}
+
+    rows = DB.session.execute(text(
+        f"""
+        SELECT p.id, p.user_id, d.resin_brand, d.resin_type, {DETAIL_COLUMNS}
+        FROM "project" p
+            JOIN "details" d ON d.project_id = p.id
+        WHERE p.id IN :ids
+        ORDER BY p.id;
+        """).bindparams(bindparam('ids', expanding=True)), ids).all()
+
+    if not rows:
+        return
+
+    colorants = DB.session.execute(text(
+        """
+        SELECT c.project_id, 'color' AS kind, c.name, c.type
+        FROM "project_color" c
+        WHERE c.project_id IN :ids
+        UNION ALL
+        SELECT g.project_id, 'glitter' AS kind, g.name, g.type
+        FROM "project_glitter" g
+        WHERE g.project_id IN :ids;
+        """).bindparams(bindparam('ids', expanding=True)), ids).all()
+
+    words = {row.id: [('brand', _words(row.resin_brand)),
+                      ('type', _words(row.resin_type))] for row in rows}
+
+    for proj_id, kind, name, colorant_type in colorants:
+        words[proj_id] += [(kind, _words(name)),
+                           (f'{kind}_type', _words(colorant_type))]
+
+    vectors = feature_vectors(
+        list(zip(*rows))[4:],
+        [[(kind, word) for kind, word in words[row.id] if word]
+         for row in rows])
+
+    DB.session.execute(delete(ProjectFeature).where(
+        ProjectFeature.project_id.in_(ids['ids'])))
+    DB.session.execute(insert(ProjectFeature), [
+        {'project_id': row.id, 'user_id': row.user_id,
+         'version': FEATURE_VERSION, 'vector': vector.tobytes()}
+        for row, vector in zip(rows, vectors)])
+
+
+def index_all_features(batch_size=1000):
+    """
+    Make the feature vectors of every project that does not have a current
+        one, ie. after FEATURE_VERSION changes.
+
+    :param
+        - batch_size : *int* : number of projects to make vectors for per commit
+
+    :return:
+        *int* : the number of projects given new vectors
+    """
+    last_id = 0  # Keep track of where the last batch ended
+    indexed = 0
+
+    while True:
+        proj_ids = [proj_id for proj_id, in DB.session.execute(text(
+            """
+            SELECT p.id
+            FROM "project" p
+                LEFT JOIN "project_feature" f ON f.project_id = p.id
+            WHERE p.id > :last_id
+                AND (f.project_id IS NULL OR f.version <> :version)
+            ORDER BY p.id
+            LIMIT :limit;
+            """), {'last_id': last_id, 'version': FEATURE_VERSION,
+                   'limit': batch_size})]
+
+        if not proj_ids:
+            break
+
+        index_features(proj_ids)
+        DB.session.commit()
+
+        indexed += len(proj_ids)
+        last_id = proj_ids[-1]
+
+    DB.session.close()
+
+    return indexed
+
+
+def nearest(matrix, index, count=5):
+    """
+    Find the rows of a matrix most like one of its rows
+
+    :param
+        - matrix : *ndarray* : feature vectors, one row per project
+        - index  : *int*     : the row of the project to compare to
+        - count  : *int*     : the most rows to return
+
+    :return:
+        *list* : (row, similarity) of the most similar rows, most similar first,
+            leaving out the row itself
+    """
+    similarity = matrix @ matrix[index]
+    similarity[index] = -np.inf
+
+    count = min(count, len(similarity) - 1)
+    if count <= 0:
+        return []
+
+    # Only the top rows need to be put in order
+    top = np.argpartition(-similarity, count - 1)[:count]
+    top = top[np.argsort(-similarity[top])]
+
+    return [(int(row), float(similarity[row])) for row in top]
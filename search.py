@@ -0,0 +1,254 @@
+"""
+Full text search over the name, notes, resin and colorants of the projects.
+
+The search index lives in the project_search table, which is made by
+    ``flask migrate`` since it is different for each database:
+
+    - *Postgres* : a tsvector for each project, with a GIN index
+    - *SQLite*   : an FTS5 virtual table, for running the app locally
+
+Each project is indexed in the same transaction that adds or changes it, and
+    its index row is removed along with it.
+"""
+import re
+
+from sqlalchemy import bindparam, text
+
+from db_model import DB
+
+# Words are stemmed in English, so "pouring" finds "poured" too
+SEARCH_LANGUAGE = 'english'
+
+# The words of each project that are searched, and how much a match in each
+#   counts towards the rank; the name counts the most and the notes the least
+SEARCH_WEIGHTS = {'name': 'A', 'resin_brand': 'B', 'resin_type': 'B',
+                  'colors': 'B', 'glitters': 'B', 'notes': 'C'}
+# The same weights as numbers for SQLite, in the order of the columns
+SQLITE_WEIGHTS = {'A': 10.0, 'B': 4.0, 'C': 1.0}
+
+# Columns of the project and its details shown with each search result
+RESULT_COLUMNS = """
+    p.id, p.name, p.notes, p.mold_img, d.resin_brand, d.resin_type,
+    d.colors, d.glitters, d.result_scale
+"""
+
+
+def _is_postgres():
+    """Check if the app is connected to Postgres instead of SQLite"""
+    return DB.engine.dialect.name == 'postgresql'
+
+
+def _column_source(name):
+    """The table alias and column holding a searched value"""
+    return f'p.{name}' if name in ('name', 'notes') else f'd.{name}'
+
+
+def create_search_index():
+    """
+    Create the project_search table and its indexes if they do not exist
+    """
+    if _is_postgres():
+        DB.session.execute(text(
+            """
+            CREATE TABLE IF NOT EXISTS "project_search" (
+                project_id INTEGER PRIMARY KEY
+                    REFERENCES "project" (id) ON DELETE CASCADE,
+                user_id INTEGER NOT NULL,
+                document TSVECTOR NOT NULL
+            );
+            """))
+        DB.session.execute(text(
+            """
+            CREATE INDEX IF NOT EXISTS ix_project_search_document
+            ON "project_search" USING GIN (document);
+            """))
+        DB.session.execute(text(
+            """
+            CREATE INDEX IF NOT EXISTS ix_project_search_user_id
+            ON "project_search" (user_id);
+            """))
+
+    else:
+        # The rowid of each index row is the id of its project
+        DB.session.execute(text(
+            f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS "project_search" USING fts5(
+                {', '.join(SEARCH_WEIGHTS)}, user_id UNINDEXED,
+                tokenize = 'porter unicode61'
+            );
+            """))
+        # FTS5 tables can not have foreign keys, so remove the index rows of
+        #   deleted projects with a trigger instead
+        DB.session.execute(text(
+            """
+            CREATE TRIGGER IF NOT EXISTS project_search_delete
+            AFTER DELETE ON "project"
+            BEGIN
+                DELETE FROM "project_search" WHERE rowid = old.id;
+            END;
+            """))
+
+    DB.session.commit()
+    DB.session.close()
+
+
+def index_projects(proj_ids):
+    """
+    Add or replace the search index rows of some projects.
+
+    This uses the app's database session without committing, so the index
+        changes are saved in the same transaction as the projects.
+
+    :param
+        - proj_ids : *list* : ids of the projects that were added or changed
+    """
+    if not proj_ids:
+        return
+
+    if _is_postgres():
+        document = ' || '.join(
+            f"setweight(to_tsvector('{SEARCH_LANGUAGE}', "
+            f"coalesce({_column_source(name)}, '')), '{weight}')"
+            for name, weight in SEARCH_WEIGHTS.items())
+
+        query = text(
+            f"""
+            INSERT INTO "project_search" (project_id, user_id, document)
+            SELECT p.id, p.user_id, {document}
+            FROM "project" p
+                JOIN "details" d ON d.project_id = p.id
+            WHERE p.id IN :ids
+            ON CONFLICT (project_id) DO UPDATE SET
+                document = EXCLUDED.document;
+            """)
+
+    else:
+        # FTS5 has no upsert, so the old rows are removed first
+        DB.session.execute(text(
+            'DELETE FROM "project_search" WHERE rowid IN :ids'
+        ).bindparams(bindparam('ids', expanding=True)), {'ids': list(proj_ids)})
+
+        query = text(
+            f"""
+            INSERT INTO "project_search" (rowid, {', '.join(SEARCH_WEIGHTS)},
+                user_id)
+            SELECT p.id, {', '.join(map(_column_source, SEARCH_WEIGHTS))},
+                p.user_id
+            FROM "project" p
+                JOIN "details" d ON d.project_id = p.id
+            WHERE p.id IN :ids;
+            """)
+
+    DB.session.execute(query.bindparams(bindparam('ids', expanding=True)),
+                       {'ids': list(proj_ids)})
+
+
+def index_all_projects(batch_size=1000):
+    """
+    Index every project that is not in the search index yet, for databases
+        made before searching was added.
+
+    :param
+        - batch_size : *int* : number of projects to index per commit
+
+    :return:
+        *int* : the number of projects indexed
+    """
+    index_id = 'project_id' if _is_postgres() else 'rowid'
+    last_id = 0  # Keep track of where the last batch ended
+    indexed = 0
+
+    while True:
+        proj_ids = [proj_id for proj_id, in DB.session.execute(text(
+            f"""
+            SELECT p.id
+            FROM "project" p
+            WHERE p.id > :last_id
+                AND NOT EXISTS (
+                    SELECT 1 FROM "project_search" s WHERE s.{index_id} = p.id
+                )
+            ORDER BY p.id
+            LIMIT :limit;
+            """), {'last_id': last_id, 'limit': batch_size})]
+
+        if not proj_ids:
+            break
+
+        index_projects(proj_ids)
+        DB.session.commit()
+
+        indexed += len(proj_ids)
+        last_id = proj_ids[-1]
+
+    DB.session.close()
+
+    return indexed
+
+
+def _fts5_query(words):
+    """
+    Turn the words searched for into an FTS5 query that finds projects with
+        all of them, quoting each so nothing typed is read as FTS5 syntax.
+    """
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in words)
+
+
+def search_projects(user_id, query, page=1, per_page=25):
+    """
+    Query to find a user's projects matching the words searched for, the
+        best matches first
+
+    :param
+        - user_id  : *int* : id of the user searching
+        - query    : *str* : the words to search for, as typed by the user
+        - page     : *int* : the page of results to get, starting at 1
+        - per_page : *int* : the most results on each page
+
+    :return:
+        *tuple* : (list of result rows, True if there is a next page)
+    """
+    words = re.findall(r'\w+', query or '')
+
+    if not words:
+        return [], False
+
+    params = {'user_id': user_id, 'limit': per_page + 1,
+              'offset': (page - 1) * per_page}
+
+    if _is_postgres():
+        params.update(query=' '.join(words), language=SEARCH_LANGUAGE)
+
+        results = DB.engine.execute(text(
+            f"""
+            SELECT {RESULT_COLUMNS}, ts_rank(s.document, q.query) AS rank
+            FROM "project_search" s
+                CROSS JOIN plainto_tsquery(CAST(:language AS regconfig), :query)
+                    AS q(query)
+                JOIN "project" p ON p.id = s.project_id
+                JOIN "details" d ON d.project_id = p.id
+            WHERE s.user_id = :user_id AND s.document @@ q.query
+            ORDER BY rank DESC, p.id
+            LIMIT :limit OFFSET :offset;
+            """), **params).all()
+
+    else:
+        weights = ', '.join(str(SQLITE_WEIGHTS[weight])
+                            for weight in SEARCH_WEIGHTS.values())
+        params.update(query=_fts5_query(words))
+
+        # bm25 gives the best matches the lowest numbers
+        results = DB.engine.execute(text(
+            f"""
+            SELECT {RESULT_COLUMNS}, -bm25("project_search", {weights}) AS rank
+            FROM "project_search" s
+                JOIN "project" p ON p.id = s.rowid
+                JOIN "details" d ON d.project_id = p.id
+            WHERE "project_search" MATCH :query AND s.user_id = :user_id
+            ORDER BY rank DESC, p.id
+            LIMIT :limit OFFSET :offset;
+            """), **params).all()
+
+    DB.session.close()
+
+    # One more row than needed was asked for to see if there is a next page
+    return results[:per_page], len(results) > per_page
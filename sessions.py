@@ -0,0 +1,257 @@
+"""
+Server side session backends, picked with the SESSION_BACKEND setting:
+
+    - *database*   : saved in the user_session table, so every worker on every
+                     host sees the same sessions
+    - *memory*     : kept in this worker process only, for running on one node
+    - *filesystem* : the Flask-Session files on this host's disk
+"""
+from collections import OrderedDict
+from datetime import datetime
+import pickle
+from threading import Lock
+
+from flask_session import Session
+from flask_session.sessions import ServerSideSession, SessionInterface
+from itsdangerous import BadSignature, want_bytes
+from sqlalchemy import delete, insert, select, update
+
+from db_model import DB, UserSession
+
+
+class StoredSession(ServerSideSession):
+    """
+    A server side session that remembers when its saved copy expires
+    """
+    expiry = None
+
+
+class StoredSessionInterface(SessionInterface):
+    """
+    Shared cookie handling for the database and memory backends.
+
+    The saved copy of a session is only written when the session changes, or
+        when more than half of its lifetime has passed, so most page views only
+        need to read the session.
+    """
+    serializer = pickle
+    session_class = StoredSession
+
+    def __init__(self, use_signer=False, permanent=True):
+        self.use_signer = use_signer
+        self.permanent = permanent
+
+    def _load(self, sid):
+        """Get (data, expiry) for a session id; None if not saved"""
+        raise NotImplementedError
+
+    def _save(self, sid, data, expiry):
+        """Save the data and expiry for a session id"""
+        raise NotImplementedError
+
+    def _delete(self, sid):
+        """Remove the saved data for a session id"""
+        raise NotImplementedError
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.session_cookie_name)
+
+        if sid and self.use_signer:
+            try:
+                sid = self._get_signer(app).unsign(sid).decode()
+
+            except (AttributeError, BadSignature):
+                sid = None
+
+        saved = self._load(sid) if sid else None
+
+        # Start a new session with a new id if there is no valid saved one
+        if saved is None or saved[1] <= datetime.utcnow():
+            return self.session_class(sid=self._generate_sid(),
+                                      permanent=self.permanent)
+
+        try:
+            session = self.session_class(
+                self.serializer.loads(want_bytes(saved[0])), sid=sid)
+
+        except (pickle.UnpicklingError, EOFError, ValueError):
+            return self.session_class(sid=self._generate_sid(),
+                                      permanent=self.permanent)
+
+        session.expiry = saved[1]
+        return session
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        # Remove the saved copy and the cookie when the session is cleared
+        if not session:
+            if session.modified:
+                self._delete(session.sid)
+                response.delete_cookie(app.session_cookie_name,
+                                       domain=domain, path=path)
+            return
+
+        lifetime = app.permanent_session_lifetime
+        now = datetime.utcnow()
+
+        # Skip the write when nothing changed and the expiry is still fresh
+        if not session.modified and session.expiry is not None and \
+                session.expiry - now > lifetime / 2:
+            return
+
+        expiry = now + lifetime
+        self._save(session.sid, self.serializer.dumps(dict(session)), expiry)
+
+        if self.use_signer:
+            session_id = self._get_signer(app).sign(want_bytes(session.sid))
+        else:
+            session_id = session.sid
+
+        response.set_cookie(app.session_cookie_name, session_id,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path,
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+
+class DatabaseSessionInterface(StoredSessionInterface):
+    """
+    Sessions saved in the user_session table.
+
+    Expired sessions are removed in batches every `cleanup_every` writes,
+        using the index on the expiry column.
+    """
+
+    def __init__(self, use_signer=False, permanent=True, cleanup_every=1000,
+                 cleanup_batch=1000):
+        super().__init__(use_signer, permanent)
+        self.cleanup_every = cleanup_every
+        self.cleanup_batch = cleanup_batch
+        self._writes = 0
+        # Request threads share the count, see the Procfile's --threads
+        self._writes_lock = Lock()
+
+    def _load(self, sid):
+        with DB.engine.connect() as conn:
+            return conn.execute(select(UserSession.data, UserSession.expiry).where(
+                UserSession.id == sid)).first()
+
+    def _save(self, sid, data, expiry):
+        with DB.engine.begin() as conn:
+            updated = conn.execute(update(UserSession).where(
+                UserSession.id == sid).values(data=data, expiry=expiry)).rowcount
+
+            if not updated:
+                conn.execute(insert(UserSession).values(
+                    id=sid, data=data, expiry=expiry))
+
+        # Only one thread sees each multiple of cleanup_every, so the cleanup
+        #   is run once for it and never skipped
+        with self._writes_lock:
+            self._writes += 1
+            cleanup = self._writes % self.cleanup_every == 0
+
+        if cleanup:
+            cleanup_sessions(self.cleanup_batch, max_batches=1)
+
+    def _delete(self, sid):
+        with DB.engine.begin() as conn:
+            conn.execute(delete(UserSession).where(UserSession.id == sid))
+
+
+class MemorySessionInterface(StoredSessionInterface):
+    """
+    Sessions kept in a least recently used cache in this worker process.
+
+    Only for running a single worker, since other workers can not see them.
+    """
+
+    def __init__(self, use_signer=False, permanent=True, max_sessions=10000):
+        super().__init__(use_signer, permanent)
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = Lock()
+
+    def _load(self, sid):
+        with self._lock:
+            saved = self._sessions.get(sid)
+
+            if saved is not None:
+                self._sessions.move_to_end(sid)
+
+            return saved
+
+    def _save(self, sid, data, expiry):
+        with self._lock:
+            self._sessions[sid] = (data, expiry)
+            self._sessions.move_to_end(sid)
+
+            # Drop the least recently used sessions when the cache is full
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def _delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+
+def cleanup_sessions(batch_size=1000, max_batches=None):
+    """
+    Remove the expired sessions from the user_session table in batches, so a
+        large cleanup never holds a long lock on the table.
+
+    :param
+        - batch_size  : *int* : the most sessions to remove per transaction
+        - max_batches : *int* : stop after this many batches; None for all
+
+    :return:
+        *int* : the number of sessions removed
+    """
+    removed = 0
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        expired = select(UserSession.id).where(
+            UserSession.expiry < datetime.utcnow()).limit(batch_size)
+
+        with DB.engine.begin() as conn:
+            count = conn.execute(delete(UserSession).where(
+                UserSession.id.in_(expired.scalar_subquery()))).rowcount
+
+        removed += count
+        batches += 1
+
+        # The last batch was not full, so there is nothing left to remove
+        if count < batch_size:
+            break
+
+    return removed
+
+
+def init_sessions(app):
+    """
+    Set up the session backend named in the app's SESSION_BACKEND setting
+
+    :param
+        - app : *Flask* : the application to set the sessions up for
+    """
+    backend = app.config.get('SESSION_BACKEND', 'filesystem')
+    use_signer = app.config.get('SESSION_USE_SIGNER', False)
+    permanent = app.config.get('SESSION_PERMANENT', True)
+
+    if backend == 'database':
+        app.session_interface = DatabaseSessionInterface(use_signer, permanent)
+
+    elif backend == 'memory':
+        app.session_interface = MemorySessionInterface(
+            use_signer, permanent, app.config.get('SESSION_MEMORY_MAX', 10000))
+
+    elif backend == 'filesystem':
+        app.config['SESSION_TYPE'] = 'filesystem'
+        Session(app)
+
+    else:
+        raise ValueError(f'Unknown SESSION_BACKEND: {backend!r}')
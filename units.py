@@ -0,0 +1,135 @@
+"""
+The amounts, temperatures and times of every project in the same units, so
+    they can be compared, filtered and sorted by the database.
+
+Each details row keeps the amount, temperatures and times the way the user
+    entered them, and also saves them in grams, milliliters, degrees Celsius
+    and minutes in the amount_g, amount_ml, *_temp_c and *_total columns.
+    Those are worked out here whenever the details are added or changed.
+"""
+
+# Grams or milliliters in one of each unit on the add form
+#   - the forms and older projects use both the singular and plural names
+#   - ounces are weighed, the rest are measured by volume
+GRAMS_PER_UNIT = {'Grams': 1.0, 'Ounces': 28.349523}
+MILLILITERS_PER_UNIT = {'Milliliters': 1.0,
+                        'Teaspoon': 4.928922, 'Teaspoons': 4.928922,
+                        'Tablespoon': 14.786765, 'Tablespoons': 14.786765,
+                        'Pint': 473.176473, 'Pints': 473.176473,
+                        'Quart': 946.352946, 'Quarts': 946.352946,
+                        'Gallon': 3785.411784, 'Gallons': 3785.411784}
+
+# The temperature units on the add form
+TEMP_UNITS = ('Celsius', 'Fahrenheit')
+
+# Grams in a milliliter of mixed epoxy resin, to turn weights into volumes
+RESIN_DENSITY = 1.1
+
+# The temperature columns, with the unit column and canonical column of each
+TEMP_COLUMNS = (('start_temp', 'start_temp_unit', 'start_temp_c'),
+                ('end_temp', 'end_temp_unit', 'end_temp_c'),
+                ('demold_temp', 'demold_temp_unit', 'demold_temp_c'))
+
+# The time columns, with the hours, minutes and total minutes column of each
+DURATION_COLUMNS = (
+    ('time_to_pour_hrs', 'time_to_pour_mins', 'time_to_pour_total'),
+    ('pouring_time_hrs', 'pouring_time_mins', 'pouring_time_total'),
+    ('time_to_demold_hrs', 'time_to_demold_mins', 'time_to_demold_total'))
+
+# The details columns the canonical values are worked out from
+SOURCE_COLUMNS = ('amount', 'unit') + tuple(
+    column for columns in TEMP_COLUMNS + DURATION_COLUMNS
+    for column in columns[:2])
+
+
+def _number(value):
+    """A value as a float; None if it is blank or not a number"""
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def celsius(temp, unit):
+    """
+    A room temperature in degrees Celsius
+
+    :param
+        - temp : *int* : the temperature the user entered
+        - unit : *str* : "Celsius" or "Fahrenheit"
+
+    :return:
+        *float* : the temperature in degrees Celsius; None if it has no unit
+    """
+    temp = _number(temp)
+
+    if temp is None or unit not in TEMP_UNITS:
+        return None
+
+    return round(temp if unit == 'Celsius' else (temp - 32) * 5 / 9, 2)
+
+
+def grams_and_ml(amount, unit):
+    """
+    An amount of resin in both grams and milliliters
+
+    :param
+        - amount : *int* : the amount the user entered
+        - unit   : *str* : the unit from the add form, ie. "Ounces"
+
+    :return:
+        *tuple* : (grams, milliliters); (None, None) if the amount was left
+            blank or its unit can not be turned into either
+    """
+    amount = _number(amount)
+
+    # The forms save 0 for an amount that was left blank
+    if not amount:
+        return None, None
+
+    if unit in GRAMS_PER_UNIT:
+        grams = amount * GRAMS_PER_UNIT[unit]
+        return round(grams, 2), round(grams / RESIN_DENSITY, 2)
+
+    if unit in MILLILITERS_PER_UNIT:
+        ml = amount * MILLILITERS_PER_UNIT[unit]
+        return round(ml * RESIN_DENSITY, 2), round(ml, 2)
+
+    return None, None
+
+
+def minutes(hours, mins):
+    """
+    A time of hours and minutes in minutes
+
+    :param
+        - hours : *int* : the hours the user entered
+        - mins  : *int* : the minutes the user entered
+
+    :return:
+        *int* : the total minutes, 0 if both were left blank like the forms save
+    """
+    return int(round((_number(hours) or 0) * 60 + (_number(mins) or 0)))
+
+
+def canonical_values(details):
+    """
+    Work out the canonical columns of a details row
+
+    :param
+        - details : *dict* : the details columns, with at least SOURCE_COLUMNS
+
+    :return:
+        *dict* : the values for amount_g, amount_ml and the *_temp_c and
+            *_total columns
+    """
+    values = dict(zip(('amount_g', 'amount_ml'),
+                      grams_and_ml(details['amount'], details['unit'])))
+
+    for temp, unit, column in TEMP_COLUMNS:
+        values[column] = celsius(details[temp], details[unit])
+
+    for hours, mins, column in DURATION_COLUMNS:
+        values[column] = minutes(details[hours], details[mins])
+
+    return values